@@ -0,0 +1,239 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Sequence, Set, Tuple
+
+from excel_handler import (RESULT_FORMATS, excel_processing, excel_processing_merge, find_isin_rows,
+                           iter_excel_sheets)
+from instrumentation import configure, default_instrumentation, span
+from settings import Settings
+from selection_rules import RuleError, RuleStore, SelectionRule
+from sheet_cache import default_cache
+
+
+def collect_source_files(sources: List[str]) -> List[str]:
+    """
+    Собирает список исходных файлов из каталогов, масок и путей
+
+    Args:
+        sources (List[str]): Каталоги, glob-маски или пути к файлам
+
+    Returns:
+        List[str]: Отсортированный список путей к .xlsx файлам без дубликатов
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, "*.xlsx"))
+        else:
+            matches = glob.glob(source)
+        for path in matches:
+            # Пропускаем временные файлы Excel и уже обработанные результаты
+            name = os.path.basename(path)
+            if name.startswith("~$") or name.endswith(("_result.xlsx", "_result_raw.xlsx")):
+                continue
+            files.append(os.path.abspath(path))
+    return sorted(set(files))
+
+
+def load_isins(select: str) -> Optional[Set[str]]:
+    """
+    Разбирает правило выбора строк
+
+    Args:
+        select (str): "all" - все ISIN-строки, "isin:<файл>" - ISIN из файла
+            (по одному в строке), иначе - список ISIN через запятую
+
+    Returns:
+        Optional[Set[str]]: Набор ISIN или None для выбора всех строк
+    """
+    if select == "all":
+        return None
+    if select.startswith("isin:"):
+        with open(select[len("isin:"):], "r") as f:
+            return {line.strip() for line in f if line.strip()}
+    return {isin.strip() for isin in select.split(",") if isin.strip()}
+
+
+def load_rule(rule: str) -> SelectionRule:
+    """
+    Правило выбора строк: имя сохраненного правила или текст правила
+
+    Args:
+        rule (str): Имя из selection_rules.json или текст, например
+            "ccy in {USD, EUR} and rating_sp >= A-"
+    """
+    return SelectionRule(RuleStore().get_rule(rule) or rule)
+
+
+def process_file(file_path: str, save_path: str, columns_to_keep: List[int],
+                 isins: Optional[Set[str]], use_cache: bool = True,
+                 rule: Optional[SelectionRule] = None,
+                 formats: Sequence[str] = ("xlsx",)) -> Tuple[str, Optional[str], float]:
+    """
+    Обрабатывает один файл в рабочем процессе
+
+    Returns:
+        Tuple[str, Optional[str], float]: (путь, текст ошибки или None, время в секундах)
+    """
+    start = time.perf_counter()
+    try:
+        # Файл разбирается один раз: и для отбора строк, и для обработки.
+        # iter_excel_sheets не перехватывает ошибки чтения, поэтому в отчет
+        # попадает настоящая причина
+        with span("load_excel_data", file=os.path.basename(file_path)) as load_span:
+            sheet_data = {sheet_name: df for sheet_name, df, _ in
+                          iter_excel_sheets(file_path, default_cache if use_cache else None)}
+            load_span.rows = sum(len(df) for df in sheet_data.values())
+        if not sheet_data:
+            raise ValueError("No data found in the Excel file")
+        selected_rows = rule(sheet_data) if rule else find_isin_rows(sheet_data, isins)
+        if not any(selected_rows.values()):
+            raise ValueError("No rows match the selection rule")
+        excel_processing(
+            file_path=file_path,
+            sheet_data=sheet_data,
+            selected_rows=selected_rows,
+            save_path=save_path,
+            columns_to_keep=columns_to_keep,
+            # Каждый файл обрабатывается один раз, кэш записей только занимал бы память
+            record_cache=None,
+            formats=formats
+        )
+        return file_path, None, time.perf_counter() - start
+    except Exception as e:
+        return file_path, str(e), time.perf_counter() - start
+
+
+def run_batch(files: List[str], save_path: str, columns_to_keep: List[int],
+              isins: Optional[Set[str]], workers: Optional[int] = None,
+              use_cache: bool = True, rule: Optional[SelectionRule] = None,
+              formats: Sequence[str] = ("xlsx",)) -> int:
+    """
+    Запускает обработку файлов в пуле процессов
+
+    Ошибка в одном файле не останавливает обработку остальных.
+
+    Returns:
+        int: Количество файлов, обработанных с ошибкой
+    """
+    failed = 0
+    start = time.perf_counter()
+    # Рабочие процессы получают настройки замеров основного процесса
+    instrumentation_args = (default_instrumentation.log_path, default_instrumentation.trace_memory,
+                            default_instrumentation.profile_dir)
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure,
+                             initargs=instrumentation_args) as pool:
+        futures = [pool.submit(process_file, path, save_path, columns_to_keep, isins, use_cache, rule, formats)
+                   for path in files]
+        for future in as_completed(futures):
+            path, error, elapsed = future.result()
+            if error is None:
+                print(f"OK    {path} ({elapsed:.2f} s)")
+            else:
+                failed += 1
+                print(f"FAIL  {path}: {error}")
+    total = time.perf_counter() - start
+    rate = len(files) / total if total > 0 else 0.0
+    print(f"Processed {len(files) - failed}/{len(files)} files in {total:.2f} s "
+          f"({rate:.2f} files/s)")
+    return failed
+
+
+def run_merge(files: List[str], save_path: str, columns_to_keep: List[int],
+              isins: Optional[Set[str]], result_name: str, workers: Optional[int] = None,
+              use_cache: bool = True, rule: Optional[SelectionRule] = None,
+              formats: Sequence[str] = ("xlsx",)) -> int:
+    """
+    Объединяет выбранные строки всех файлов в один файл результата
+
+    Returns:
+        int: 0 при успехе, 1 при ошибке
+    """
+    start = time.perf_counter()
+    try:
+        result_path = excel_processing_merge({path: None for path in files}, save_path, columns_to_keep,
+                                             result_name=result_name, isins=isins, workers=workers,
+                                             use_cache=use_cache, select=rule, formats=formats)
+    except Exception as e:
+        print(f"FAIL  merge: {e}")
+        return 1
+    print(f"Merged {len(files)} files into {result_path} in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless batch processing of broker workbooks")
+    parser.add_argument("sources", nargs="+", help="Directories, glob patterns or .xlsx files")
+    parser.add_argument("--columns", help="Columns to keep (1..25), comma separated; "
+                                          "defaults to the settings profile")
+    parser.add_argument("--config", default="config.json", help="Settings profile (config.json)")
+    parser.add_argument("--select", default="all",
+                        help='Row selection rule: "all", "isin:<file>", comma separated ISINs or '
+                             '"rule:<saved rule name or rule text>"')
+    parser.add_argument("--out", help="Output directory; defaults to the settings save path")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the parsed sheet cache")
+    parser.add_argument("--merge", metavar="NAME",
+                        help="Merge all sources into one result workbook with this file name")
+    parser.add_argument("--format", default="xlsx",
+                        help="Result formats, comma separated, written concurrently: "
+                             + ", ".join(RESULT_FORMATS))
+    parser.add_argument("--span-log", help="Append per-stage timings to this JSON-lines file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record peak allocation per stage (slower)")
+    parser.add_argument("--profile-dir", help="Write a cProfile dump per top-level stage to this directory")
+    args = parser.parse_args(argv)
+
+    if args.span_log or args.trace_memory or args.profile_dir:
+        configure(args.span_log, args.trace_memory, args.profile_dir)
+
+    settings = Settings(args.config)
+    if args.columns:
+        columns_to_keep = [int(c) for c in args.columns.split(",") if c.strip()]
+    else:
+        columns_to_keep = settings.get_column_to_keep()
+    save_path = args.out or settings.get_save_path()
+    os.makedirs(save_path, exist_ok=True)
+
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in RESULT_FORMATS]
+    if unknown or not formats:
+        print(f"Unknown result format: {', '.join(unknown) or args.format}; "
+              f"expected {', '.join(RESULT_FORMATS)}")
+        return 1
+
+    files = collect_source_files(args.sources)
+    if not files:
+        print("No source files found")
+        return 1
+
+    rule = None
+    isins = None
+    if args.select.startswith("rule:"):
+        try:
+            rule = load_rule(args.select[len("rule:"):])
+        except RuleError as e:
+            print(f"Invalid selection rule: {e}")
+            return 1
+    else:
+        try:
+            isins = load_isins(args.select)
+        except OSError as e:
+            print(f"Cannot read ISIN file: {e}")
+            return 1
+    if args.merge:
+        return run_merge(files, save_path, columns_to_keep, isins, args.merge, args.workers,
+                         not args.no_cache, rule, formats)
+    failed = run_batch(files, save_path, columns_to_keep, isins, args.workers, not args.no_cache, rule,
+                       formats)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from excel_handler import (excel_processing, extract_selected_rows, find_isin_rows,  # noqa: E402
+                           get_all_sheets_max_lengths, load_excel_data, write_results)
+from record_cache import RecordCache  # noqa: E402
+from synthetic_workbook import generate_workbook  # noqa: E402
+
+# Замедление относительно базовой линии, после которого замер считается регрессией
+DEFAULT_THRESHOLD = 1.10
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """
+    Замеряет функцию: лучшее время из repeat запусков и пик памяти
+
+    Пик памяти снимается отдельным запуском под tracemalloc, чтобы
+    трассировка не искажала время.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"wall_s": round(min(times), 4), "peak_mb": round(peak / (1024 * 1024), 2)}
+
+
+def display_sheet_benchmark(sheet_data: Dict[str, pd.DataFrame]) -> Callable[[], object]:
+    """
+    display_sheet без видимого окна
+
+    Если дисплей доступен, используется настоящий ExcelAppGUI в скрытом
+    окне; иначе замеряется подготовка данных листа (заголовки и строковое
+    хранилище), которую выполняет display_sheet.
+    """
+    import tkinter as tk
+    from gui import ExcelAppGUI, build_row_store, sheet_columns
+
+    sheet_name = next(iter(sheet_data))
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        df = sheet_data[sheet_name]
+        return lambda: (sheet_columns(df), build_row_store(df))
+
+    root.withdraw()
+    app = ExcelAppGUI(root, on_file_load=None, on_open_settings=None)
+    app.sheet_data = sheet_data
+
+    def run():
+        app.row_stores.clear()
+        app.display_sheet(sheet_name)
+        root.update_idletasks()
+    return run
+
+
+def run_benchmarks(rows: int, sheets: int, repeat: int, seed: int) -> Dict[str, object]:
+    """Генерирует книгу и замеряет основные операции"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, "synthetic.xlsx")
+        generate_workbook(source_path, rows=rows, sheets=sheets, seed=seed)
+
+        # Без дискового кэша, чтобы замерять разбор файла
+        sheet_data = load_excel_data(source_path, cache=None)
+        selected_rows = find_isin_rows(sheet_data)
+        columns_to_keep = list(range(1, 26))
+        Chosen_assets, Used_positions = extract_selected_rows(sheet_data, selected_rows, columns_to_keep)
+        result_stem = os.path.join(work_dir, "bench_result")
+        # Повторная обработка того же файла: записи листов уже в кэше
+        warm_records = RecordCache()
+        excel_processing(source_path, sheet_data, selected_rows, work_dir, columns_to_keep,
+                         record_cache=warm_records)
+
+        results = {
+            "load_excel_data": measure(lambda: load_excel_data(source_path, cache=None), repeat),
+            # Каждый раз новые DataFrame, чтобы кэш ширин не влиял на замер
+            "get_all_sheets_max_lengths": measure(
+                lambda: get_all_sheets_max_lengths({name: df.copy() for name, df in sheet_data.items()}),
+                repeat),
+            # Без кэша записей, иначе все запуски после первого замеряли бы повторную обработку
+            "excel_processing": measure(
+                lambda: excel_processing(source_path, sheet_data, selected_rows, work_dir, columns_to_keep,
+                                         record_cache=None),
+                repeat),
+            "excel_processing_warm": measure(
+                lambda: excel_processing(source_path, sheet_data, selected_rows, work_dir, columns_to_keep,
+                                         record_cache=warm_records),
+                repeat),
+            "display_sheet": measure(display_sheet_benchmark(sheet_data), repeat),
+            # Запись одного и того же результата разными форматами
+            "write_xlsx": measure(lambda: write_results(result_stem, Chosen_assets, Used_positions, ("xlsx",)),
+                                  repeat),
+            "write_raw_xlsx": measure(
+                lambda: write_results(result_stem, Chosen_assets, Used_positions, ("raw_xlsx",)), repeat),
+            "write_csv": measure(lambda: write_results(result_stem, Chosen_assets, Used_positions, ("csv",)),
+                                 repeat),
+        }
+
+    return {
+        "meta": {
+            "rows": rows,
+            "sheets": sheets,
+            "repeat": repeat,
+            "seed": seed,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "openpyxl": openpyxl.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, object], baseline: Dict[str, object], threshold: float) -> int:
+    """
+    Печатает сравнение с базовой линией
+
+    Returns:
+        int: Количество замеров, замедлившихся больше чем в threshold раз
+    """
+    regressions = 0
+    print(f"{'benchmark':<28}{'baseline s':>12}{'current s':>12}{'ratio':>8}{'peak MB':>10}")
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:<28}{'-':>12}{result['wall_s']:>12.4f}{'-':>8}{result['peak_mb']:>10.2f}")
+            continue
+        ratio = result["wall_s"] / base["wall_s"] if base["wall_s"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:<28}{base['wall_s']:>12.4f}{result['wall_s']:>12.4f}{ratio:>8.2f}"
+              f"{result['peak_mb']:>10.2f}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark loading and processing on a synthetic workbook")
+    parser.add_argument("--rows", type=int, default=5000, help="Data rows per sheet")
+    parser.add_argument("--sheets", type=int, default=3, help="Number of sheets")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the workbook")
+    parser.add_argument("--out", help="Write results to this JSON file (e.g. a new baseline)")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.rows, args.sheets, args.repeat, args.seed)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("rows") != args.rows or baseline.get("meta", {}).get("sheets") != args.sheets:
+            print("Warning: baseline was recorded with a different workbook size")
+        return 1 if compare(current, baseline, args.threshold) else 0
+
+    print(json.dumps(current["results"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет холодного старта в секундах
+DEFAULT_IMPORT_BUDGET = 0.25   # import main: до показа окна
+DEFAULT_WINDOW_BUDGET = 1.0    # запуск процесса -> окно на экране
+DEFAULT_READY_BUDGET = 6.0     # запуск процесса -> главное окно готово к работе
+# Модули, которые не должны загружаться до показа окна
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "gui", "excel_handler")
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile(modules: List[str], python: str = sys.executable) -> Dict[str, object]:
+    """
+    Время импорта модулей в отдельном интерпретаторе (python -X importtime)
+
+    Returns:
+        Dict[str, object]: total_s - суммарное время импорта modules, top -
+        самые долгие пакеты (с учетом вложенных импортов), heavy -
+        загруженные модули из HEAVY_MODULES
+    """
+    result = subprocess.run([python, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {', '.join(modules)} failed: {result.stderr.strip().splitlines()[-1:]}")
+
+    total_us = 0
+    packages: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 1 and name in modules:
+            total_us += cumulative_us
+        if "." not in name:
+            packages[name] = max(packages.get(name, 0), cumulative_us)
+    top = sorted(((name, us) for name, us in packages.items() if name not in modules),
+                 key=lambda item: item[1], reverse=True)
+    return {
+        "total_s": round(total_us / 1e6, 4),
+        "top": [{"module": name, "s": round(us / 1e6, 4)} for name, us in top[:10]],
+        "heavy": sorted(set(packages).intersection(HEAVY_MODULES)),
+    }
+
+
+def launch_timings(command: List[str], runs: int) -> Dict[str, object]:
+    """
+    Запуски приложения с LIGHT_APP_STARTUP_CHECK=1 (нужен дисплей)
+
+    Приложение печатает свои замеры (window_s, imports_s, ready_s, от начала
+    main.py) и выходит; process_s - полное время процесса, включая запуск
+    интерпретатора или распаковку сборки PyInstaller. Берется медиана.
+    """
+    env = dict(os.environ, LIGHT_APP_STARTUP_CHECK="1")
+    samples: List[Dict[str, float]] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+        if result.returncode != 0 or not lines:
+            raise RuntimeError(f"{' '.join(command)} failed: "
+                               f"{(result.stderr or result.stdout).strip().splitlines()[-1:]}")
+        sample = json.loads(lines[-1])
+        sample["process_s"] = elapsed
+        samples.append(sample)
+    return {name: round(statistics.median(sample[name] for sample in samples), 4) for name in samples[0]}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure cold start of the GUI and check it against a budget")
+    parser.add_argument("--exe", help="Frozen build to launch (PyInstaller); defaults to python main.py")
+    parser.add_argument("--runs", type=int, default=5, help="Launches per measurement")
+    parser.add_argument("--imports-only", action="store_true",
+                        help="Only profile imports (no display required)")
+    parser.add_argument("--import-budget", type=float, default=DEFAULT_IMPORT_BUDGET,
+                        help="Budget for importing main.py, seconds")
+    parser.add_argument("--window-budget", type=float, default=DEFAULT_WINDOW_BUDGET,
+                        help="Budget from process start to the first window, seconds")
+    parser.add_argument("--ready-budget", type=float, default=DEFAULT_READY_BUDGET,
+                        help="Budget from process start to the ready main window, seconds")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    failures = []
+    current: Dict[str, object] = {"exe": args.exe}
+    if not args.exe:
+        current["import_main"] = import_profile(["main"])
+        current["import_deferred"] = import_profile(["gui", "excel_handler"])
+        import_main = current["import_main"]
+        print(f"import main: {import_main['total_s']:.3f} s (budget {args.import_budget:.2f} s)")
+        if import_main["heavy"]:
+            failures.append(f"main.py imports {', '.join(import_main['heavy'])} before the window is shown")
+        if import_main["total_s"] > args.import_budget:
+            failures.append("import main is over budget")
+        print(f"deferred imports (gui, excel_handler): {current['import_deferred']['total_s']:.3f} s")
+        for item in current["import_deferred"]["top"][:5]:
+            print(f"  {item['module']:<24} {item['s']:.3f} s")
+
+    if not args.imports_only:
+        command = [args.exe] if args.exe else [sys.executable, os.path.join(REPO_DIR, "main.py")]
+        try:
+            launch = launch_timings(command, args.runs)
+        except RuntimeError as e:
+            failures.append(str(e))
+        else:
+            current["launch"] = launch
+            # process_s включает запуск интерпретатора, а окно появляется раньше готовности
+            window_s = launch["process_s"] - launch["ready_s"] + launch["window_s"]
+            print(f"first window: {window_s:.3f} s (budget {args.window_budget:.2f} s), "
+                  f"ready: {launch['process_s']:.3f} s (budget {args.ready_budget:.2f} s)")
+            if window_s > args.window_budget:
+                failures.append("first window is over budget")
+            if launch["process_s"] > args.ready_budget:
+                failures.append("ready main window is over budget")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from excel_handler import Old_SetColumns  # noqa: E402
+
+CURRENCIES = ("USD", "EUR", "CHF", "GBP", "JPY")
+SECTORS = ("Financials", "Utilities", "Energy", "Industrials", "Technology", "Health Care")
+INDUSTRIES = ("Banks", "Insurance", "Oil & Gas", "Telecom", "Software", "Pharma", "Autos")
+RATINGS = ("AAA", "AA+", "AA", "AA-", "A+", "A", "A-", "BBB+", "BBB", "BBB-", "BB+")
+MARKETS = ("Euro MTN", "US Domestic", "Global", "Private Placement")
+
+
+def header_titles() -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """
+    Пары заголовков (строки 2/3) для позиций 1..25 из Old_SetColumns
+
+    Берется первая пара для позиции, которую можно записать в ячейки:
+    "0" означает пустую ячейку. Пары с числовым 0 в исходной таблице
+    воспроизвести нельзя, для них пустой становится соответствующая ячейка.
+    """
+    titles = {}
+    for (top, bottom), position in Old_SetColumns.items():
+        if position in titles and not any(isinstance(v, int) for v in titles[position][2]):
+            continue
+        cells = tuple(None if v in ("0", 0) else v for v in (top, bottom))
+        titles[position] = (cells[0], cells[1], (top, bottom))
+    return {position: (top, bottom) for position, (top, bottom, _) in titles.items()}
+
+
+def random_isin(rnd: random.Random) -> str:
+    """12-символьный ISIN (2 буквы страны + 10 символов)"""
+    return rnd.choice(("US", "XS", "DE", "CH", "FR")) + "".join(
+        rnd.choice(string.digits + string.ascii_uppercase) for _ in range(10))
+
+
+def random_row(rnd: random.Random, index: int) -> List[object]:
+    """Значения позиций 1..25 для одной бумаги"""
+    maturity = datetime.datetime(2026, 1, 1) + datetime.timedelta(days=rnd.randint(0, 365 * 15))
+    added = datetime.datetime(2024, 1, 1) + datetime.timedelta(days=rnd.randint(0, 600))
+    return [
+        random_isin(rnd),
+        f"T{index} {rnd.choice(('US', 'LN', 'GY', 'SW'))}",
+        rnd.choice(CURRENCIES),
+        round(rnd.uniform(0, 8), 3),
+        f"Issuer {index % 5000} {rnd.choice(('Corp', 'AG', 'SA', 'plc'))}",
+        rnd.choice(SECTORS),
+        rnd.choice(INDUSTRIES),
+        maturity,
+        round(rnd.uniform(80, 120), 2),
+        round(rnd.uniform(-10, 15), 2),
+        round(rnd.uniform(0.5, 900), 1),
+        round(rnd.uniform(0, 9), 3),
+        rnd.randint(1, 4),
+        round(rnd.uniform(0, 2), 2),
+        rnd.choice(RATINGS),
+        rnd.choice(RATINGS),
+        rnd.choice(RATINGS),
+        rnd.randint(100, 5000),
+        round(rnd.uniform(10, 400), 1),
+        round(rnd.uniform(-50, 300), 1),
+        rnd.choice((1000, 10000, 100000, 200000)),
+        rnd.choice((1000, 10000)),
+        rnd.choice(MARKETS),
+        rnd.choice((None, "callable", "green bond", "subordinated")),
+        added,
+    ]
+
+
+def generate_workbook(path: str, rows: int = 1000, sheets: int = 1, group_every: int = 25,
+                      seed: int = 0) -> str:
+    """
+    Создает книгу в формате, который ожидает excel_processing
+
+    На каждом листе: строка 1 - название, строки 2/3 - заголовки из
+    Old_SetColumns начиная со столбца C, строка 4 пустая, с 5-й строки
+    в столбце C чередуются названия групп и 12-символьные ISIN.
+
+    Args:
+        path (str): Путь к создаваемому файлу
+        rows (int): Количество строк данных (групп и бумаг) на листе
+        sheets (int): Количество листов
+        group_every (int): Строка группы через каждые group_every строк
+        seed (int): Зерно генератора для воспроизводимости
+
+    Returns:
+        str: Путь к созданному файлу
+    """
+    rnd = random.Random(seed)
+    titles = header_titles()
+    positions = sorted(titles)
+
+    wb = Workbook(write_only=True)
+    for sheet_idx in range(sheets):
+        ws = wb.create_sheet(f"Broker {sheet_idx + 1}")
+        ws.append([f"Synthetic broker export {sheet_idx + 1}"])
+        ws.append([None, None] + [titles[position][0] for position in positions])
+        ws.append([None, None] + [titles[position][1] for position in positions])
+        ws.append([])
+
+        group = 0
+        for row_idx in range(rows):
+            if row_idx % group_every == 0:
+                group += 1
+                ws.append([None, None, f"Group {group} - {rnd.choice(SECTORS)}"])
+            else:
+                values = random_row(rnd, sheet_idx * rows + row_idx)
+                ws.append([None, None] + [values[position - 1] for position in positions])
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    wb.save(path)
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic broker workbook")
+    parser.add_argument("path", help="Output .xlsx path")
+    parser.add_argument("--rows", type=int, default=1000, help="Data rows per sheet")
+    parser.add_argument("--sheets", type=int, default=1, help="Number of sheets")
+    parser.add_argument("--group-every", type=int, default=25, help="Group title row interval")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args(argv)
+
+    generate_workbook(args.path, args.rows, args.sheets, args.group_every, args.seed)
+    print(f"Generated {args.path}: {args.sheets} sheets x {args.rows} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import weakref
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Кэш ширин: id(DataFrame) -> {(start_row, skip_missing): {колонка: длина}}
+_frame_widths: Dict[int, Dict[Tuple[int, bool], Dict[Hashable, int]]] = {}
+
+
+def string_lengths(values) -> np.ndarray:
+    """
+    Длины строковых представлений значений без цикла по ячейкам
+
+    Значения переводятся в строки так же, как astype(str) в pandas
+    (NaN -> "nan", None -> "None"), длины считаются через numpy.
+
+    Args:
+        values: Массив, Series или список значений
+
+    Returns:
+        np.ndarray: Длины строк
+    """
+    strings = pd.Series(values, dtype=object, copy=False).astype(str).to_numpy(dtype=np.str_)
+    if strings.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.char.str_len(strings)
+
+
+def max_string_length(values, skip_missing: bool = False) -> int:
+    """
+    Длина самого длинного строкового представления значения
+
+    Args:
+        values: Массив, Series или список значений
+        skip_missing (bool): Не учитывать None/NaN (как пустые ячейки Excel)
+
+    Returns:
+        int: Максимальная длина, 0 для пустого набора
+    """
+    values = pd.Series(values, dtype=object, copy=False)
+    if skip_missing:
+        values = values[values.notna()]
+    if values.empty:
+        return 0
+    return int(string_lengths(values).max())
+
+
+def frame_column_widths(df: pd.DataFrame, start_row: int = 0,
+                        skip_missing: bool = False) -> Dict[Hashable, int]:
+    """
+    Максимальные длины значений по колонкам DataFrame с кэшированием
+
+    Результат запоминается для листа (объекта DataFrame) и параметров,
+    повторные вызовы для того же листа не пересчитывают длины.
+
+    Args:
+        df (pd.DataFrame): Данные листа
+        start_row (int): Индекс первой учитываемой строки
+        skip_missing (bool): Не учитывать None/NaN
+
+    Returns:
+        Dict[Hashable, int]: {имя_колонки: максимальная_длина}
+    """
+    key = (start_row, skip_missing)
+    sheet_widths = _frame_widths.get(id(df))
+    if sheet_widths is None:
+        sheet_widths = _frame_widths[id(df)] = {}
+        # Запись удаляется вместе с DataFrame, чтобы id не переиспользовался
+        weakref.finalize(df, _frame_widths.pop, id(df), None)
+    if key not in sheet_widths:
+        block = df.iloc[start_row:]
+        sheet_widths[key] = {column: max_string_length(block.iloc[:, idx], skip_missing)
+                             for idx, column in enumerate(df.columns)}
+    return sheet_widths[key]
+
+
+def rows_column_widths(rows: Sequence[tuple], indexes: List[int]) -> List[int]:
+    """
+    Максимальные длины значений по позициям для набора строк-кортежей
+
+    Пустые значения (None) не учитываются, как и пустые ячейки при
+    автоподборе ширины в Excel.
+
+    Args:
+        rows (Sequence[tuple]): Строки одинаковой длины
+        indexes (List[int]): Позиции в кортеже, для которых нужны длины
+
+    Returns:
+        List[int]: Длины в порядке indexes
+    """
+    if not rows or not indexes:
+        return [0] * len(indexes)
+    table = np.empty((len(rows), len(rows[0])), dtype=object)
+    table[:] = rows
+    return [max_string_length(table[:, idx], skip_missing=True) for idx in indexes]
@@ -0,0 +1,97 @@
+from typing import List, Mapping, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# Столбец становится категориальным, если различных значений не больше этой доли строк
+CATEGORY_MAX_RATIO = 0.5
+
+
+class SheetMemory(NamedTuple):
+    """Память, занимаемая листом"""
+    name: str
+    rows: int
+    columns: int
+    bytes: int
+    categorical: int
+
+
+def compact_column(column: pd.Series) -> pd.Series:
+    """
+    Компактное представление столбца с теми же значениями
+
+    - только целые без пропусков: наименьший подходящий целый тип;
+    - только дробные числа: float64 (float32 изменил бы записываемые значения);
+    - мало различных значений (валюта, сектор, рейтинги): categorical, каждая
+      строка хранится один раз, в ячейках - коды;
+    - остальные столбцы не меняются.
+
+    Значения, которые отдает to_numpy(dtype=object), остаются прежними.
+    """
+    if column.dtype != object:
+        return column
+    present = column.dropna()
+    if present.empty:
+        return column
+
+    kind = pd.api.types.infer_dtype(column, skipna=True)
+    if kind == "integer" and len(present) == len(column):
+        return pd.to_numeric(column, downcast="integer")
+    if kind == "floating":
+        return column.astype(np.float64)
+
+    if present.nunique() <= CATEGORY_MAX_RATIO * len(column):
+        return column.astype("category")
+    return column
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Компактная копия листа (compact_column для каждого столбца)
+
+    Строки заголовков и групп остаются на своих местах, поэтому позиционный
+    доступ (iloc, to_numpy) дает те же значения, что и у исходного листа.
+    """
+    return pd.DataFrame({column: compact_column(df[column]) for column in df.columns},
+                        index=df.index)
+
+
+def compact_sheet(df: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """compact_frame с замером этапа compact_sheet"""
+    with span("compact_sheet", rows=len(df), sheet=sheet_name):
+        return compact_frame(df)
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    """Память листа в байтах с учетом строк в object-столбцах"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def memory_report(sheet_data: Mapping[str, pd.DataFrame]) -> List[SheetMemory]:
+    """
+    Память по листам
+
+    Args:
+        sheet_data (Mapping[str, pd.DataFrame]): Листы (для LazySheetData -
+            только уже разобранные, см. LazySheetData.loaded)
+
+    Returns:
+        List[SheetMemory]: Записи по листам в порядке sheet_data
+    """
+    report = []
+    for sheet_name, df in sheet_data.items():
+        categorical = sum(1 for dtype in df.dtypes if isinstance(dtype, pd.CategoricalDtype))
+        report.append(SheetMemory(sheet_name, len(df), len(df.columns), frame_memory(df), categorical))
+    return report
+
+
+def format_memory_report(report: List[SheetMemory]) -> str:
+    """Текст отчета о памяти для показа пользователю"""
+    lines = [f"{item.name}: {item.rows} rows x {item.columns} columns, "
+             f"{item.bytes / (1024 * 1024):.1f} MB ({item.categorical} categorical)"
+             for item in report]
+    total = sum(item.bytes for item in report)
+    lines.append(f"Total: {total / (1024 * 1024):.1f} MB in {len(report)} sheets")
+    return "\n".join(lines)
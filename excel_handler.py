@@ -1,12 +1,28 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
 from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image
-import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy
 import os
 import sys
+import threading
+import weakref
+
+from column_widths import frame_column_widths, rows_column_widths
+from compact_frames import compact_sheet
+from header_matcher import HeaderMatcher
+from instrumentation import configure, default_instrumentation, span
+from lazy_workbook import LazySheetData, read_sheet_index
+from record_cache import RecordCache, default_record_cache
+from result_writers import build_result_table, write_result_csv, write_result_tsv, write_result_xlsx_raw
+from sheet_cache import SheetCache, default_cache
+from template_cache import default_template_cache
+from xlsx_reader import UnsupportedWorkbook, read_targeted_sheets
 
 class ExcelHandler:
     """
@@ -14,19 +30,24 @@ class ExcelHandler:
     """
 
     @staticmethod
-    def load_excel_data(file_path: str) -> Dict[str, pd.DataFrame]:
+    def load_excel_data(file_path: str, cache: Optional[SheetCache] = default_cache,
+                        compact: bool = False) -> Dict[str, pd.DataFrame]:
         """
         Загружает все листы из Excel файла
 
         Args:
             file_path (str): Путь к Excel файлу
+            cache (Optional[SheetCache]): Дисковый кэш листов (None - не использовать)
+            compact (bool): Хранить листы компактно (compact_sheet)
 
         Returns:
             Dict[str, pd.DataFrame]: Словарь с данными всех листов
         """
         try:
             # Загружаем все листы из Excel файла
-            excel_data = pd.read_excel(file_path, sheet_name=None)
+            with span("load_excel_data", file=os.path.basename(file_path)) as load_span:
+                excel_data = {sheet_name: df for sheet_name, df, _ in ExcelHandler.iter_excel_sheets(file_path, cache, compact)}
+                load_span.rows = sum(len(df) for df in excel_data.values())
 
             if not excel_data:
                 print("No data found in the Excel file")
@@ -42,6 +63,49 @@ class ExcelHandler:
             print(f"Error loading Excel file {file_path}: {e}")
             return {}
 
+    @staticmethod
+    def iter_excel_sheets(file_path: str, cache: Optional[SheetCache] = default_cache,
+                          compact: bool = False) -> Iterator[Tuple[str, pd.DataFrame, int]]:
+        """
+        Загружает листы Excel файла по одному
+
+        Позволяет показывать прогресс и первые листы, пока остальные
+        еще загружаются. Листы из дискового кэша не разбираются, а файл
+        открывается только если какого-то листа в кэше нет. Ошибки чтения
+        не перехватываются.
+
+        Args:
+            file_path (str): Путь к Excel файлу
+            cache (Optional[SheetCache]): Дисковый кэш листов (None - не использовать)
+            compact (bool): Хранить листы компактно (compact_sheet); в дисковый
+                кэш попадает компактный лист
+
+        Yields:
+            Tuple[str, pd.DataFrame, int]: (имя листа, данные листа, всего листов)
+        """
+        sheet_names = [info.name for info in read_sheet_index(file_path)]
+        excel_file = None
+        try:
+            for sheet_name in sheet_names:
+                df = cache.get(file_path, sheet_name) if cache else None
+                if df is None:
+                    with span("parse_sheet", sheet=sheet_name) as parse_span:
+                        if excel_file is None:
+                            excel_file = pd.ExcelFile(file_path)
+                        df = excel_file.parse(sheet_name)
+                        parse_span.rows = len(df)
+                    if compact:
+                        df = compact_sheet(df, sheet_name)
+                    if cache:
+                        cache.put(file_path, sheet_name, df)
+                elif compact:
+                    # Лист мог попасть в кэш из обычной загрузки
+                    df = compact_sheet(df, sheet_name)
+                yield sheet_name, df, len(sheet_names)
+        finally:
+            if excel_file is not None:
+                excel_file.close()
+
     @staticmethod
     def get_column_max_lengths(df: pd.DataFrame) -> Dict[str, int]:
         """
@@ -53,14 +117,8 @@ class ExcelHandler:
         Returns:
             Dict[str, int]: Словарь {имя_колонки: максимальная_длина}
         """
-        max_lengths = {}
-
-        for column in df.columns:
-            # Преобразуем все значения в строки и находим максимальную длину
-            max_length = df[column].astype(str).apply(len).max()
-            max_lengths[column] = max_length
-
-        return max_lengths
+        # Длины строковых представлений считаются векторно и кэшируются по листу
+        return frame_column_widths(df)
 
     @staticmethod
     def get_all_sheets_max_lengths(excel_data: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, int]]:
@@ -81,11 +139,27 @@ class ExcelHandler:
         return all_max_lengths
 
 # Функции для удобного импорта
-def load_excel_data(file_path: str) -> Dict[str, pd.DataFrame]:
+def load_excel_data(file_path: str, cache: Optional[SheetCache] = default_cache,
+                    compact: bool = False) -> Dict[str, pd.DataFrame]:
     """
     Функция-обертка для удобного импорта
     """
-    return ExcelHandler.load_excel_data(file_path)
+    return ExcelHandler.load_excel_data(file_path, cache, compact)
+
+def iter_excel_sheets(file_path: str, cache: Optional[SheetCache] = default_cache,
+                      compact: bool = False) -> Iterator[Tuple[str, pd.DataFrame, int]]:
+    """
+    Загружает листы Excel файла по одному
+    """
+    return ExcelHandler.iter_excel_sheets(file_path, cache, compact)
+
+def open_excel_data(file_path: str, compact: bool = False) -> LazySheetData:
+    """
+    Открывает Excel файл: сразу читается только список листов и их размеры,
+    DataFrame листа создается при первом обращении (compact - хранить
+    листы компактно)
+    """
+    return LazySheetData(file_path, compact=compact)
 
 def get_column_max_lengths(df: pd.DataFrame) -> Dict[str, int]:
     """
@@ -99,267 +173,920 @@ def get_all_sheets_max_lengths(excel_data: Dict[str, pd.DataFrame]) -> Dict[str,
     """
     return ExcelHandler.get_all_sheets_max_lengths(excel_data)
 
-def excel_processing(file_path: str, sheet_data: Dict[str, pd.DataFrame], 
-                    selected_rows: Dict[str, List[int]], save_path: str, 
-                    columns_to_keep: List[int]):
+# ---- Справочные соответствия колонок старого файла ----
+Old_Columns: Tuple[Tuple[object, object], ...] = (
+    ("ISIN", 0),
+    ("Ticker &", "Exchange"), 
+    ("Ccy", 0),
+    ("Cpn", "(%)"),
+    ("Name", 0),
+    ("Sector", 0),
+    ("Industry", 0), 
+    ("Maturity", "(1. call date)"),
+    ("Price", 0),
+    ("Perf", "YTD %"),
+    ("Mk-Cap", "mia"),
+    ("YTM", "MID"),
+    ("Share", "classes"),
+    ("ER/MF", 0),
+    ("Rating", "Mood"),
+    ("Rating", "S&P"),
+    ("Rating", "Fitch"),
+    ("Size", "mio"),
+    ("Z-", "Spread"),
+    ("ASW", "spread"),
+    ("Min", "piece"),
+    ("Min", "incr"),
+    ("Mkt of", "Issue"),
+    ("Notes", 0),
+    ("Added", "on")
+)
+
+Old_SetColumns: Dict[Tuple[object, object], int] = {
+    ("ISIN", "0"):1, 
+    ("Ticker &", "Exchange"):2, 
+    ("Ccy", "0"):3, 
+    ("Cpn", "(%)"):4, 
+    ("0", "(%)"):4, 
+    ("Name", "1"):5, 
+    ("Sector", "0"):6, 
+    ("Industry", "0"):7, 
+    ("Maturity", "(1. call date)"):8, 
+    ("Price", "MID"):9, 
+    ("Price", "1"):9, 
+    ("Perf", "YTD %"):10,
+    ("Mk-Cap", "mia"):11, 
+    ("YTM", "MID"):12, 
+    ("Share class", "0"):13, 
+    ("Share", "class"):13, 
+    ("ER/MF", "0"):14, 
+    ("Rating", "Moody"):15, 
+    ("Rating", "S&P"):16, 
+    ("Rating", "Fitch"):17, 
+    ("Size", "mio"):18, 
+    ("Z-", "spread"):19, 
+    ("ASW", "spread"):20, 
+    ("Min", "piece"):21, 
+    ("Min", "incr"):22, 
+    (0, "Mkt of Issue"):23, 
+    ("Notes", "0"):24, 
+    (0, "Notes"):24, 
+    ("Added on", "0"):25, 
+    ("Added", "on"):25
+}
+
+# Номер строки Excel = индекс строки DataFrame + 2 (1-я строка листа уходит в заголовок)
+DATA_ROW_OFFSET = 2
+
+
+def _cell_value(value):
+    """Приводит значение ячейки DataFrame к значению openpyxl (NaN -> None)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if value is pd.NaT:
+        return None
+    return value
+
+
+# Длина значения колонки C, по которой строка считается строкой с ISIN
+ISIN_LENGTH = 12
+# Группа строк, которые идут до первого названия группы
+UNTITLED_GROUP = "Без названия"
+
+
+class GroupIndex(NamedTuple):
     """
-    Обработка выделенных данных из Excel файла и сохранение результата
+    Разметка колонки C листа на группы и строки с ISIN (начиная с 5-й строки)
+
+    Позиции - индексы строк DataFrame (строка Excel = позиция + DATA_ROW_OFFSET).
+    Непустое значение из ISIN_LENGTH символов - ISIN, любое другое непустое
+    значение - название группы. isin_groups - номер группы строки с ISIN
+    в titles, -1 для строк до первой группы.
+    """
+    titles: List[str]
+    group_positions: np.ndarray
+    isin_positions: np.ndarray
+    isin_values: np.ndarray
+    isin_groups: np.ndarray
+
+    def group_of(self, positions: np.ndarray) -> np.ndarray:
+        """Номер группы для произвольных позиций (-1 - до первой группы)"""
+        return np.searchsorted(self.group_positions, positions, side="right") - 1
+
+
+# Кэш разметки: id(DataFrame) -> GroupIndex
+_group_indexes: Dict[int, GroupIndex] = {}
+
+
+def build_group_index(df: pd.DataFrame) -> GroupIndex:
+    """
+    Разбирает колонку C листа на группы и строки с ISIN за один векторный проход
+
+    Пустыми считаются те же значения, что и при построчной проверке
+    (None, NaN, NaT, "", 0), строки длины считаются через pandas.
 
     Args:
-        file_path (str): Путь к исходному файлу
-        sheet_data (Dict[str, pd.DataFrame]): Данные всех листов
+        df (pd.DataFrame): Данные листа
+
+    Returns:
+        GroupIndex: Разметка листа
+    """
+    start = 5 - DATA_ROW_OFFSET
+    if len(df.columns) < 3 or len(df) <= start:
+        empty = np.zeros(0, dtype=np.int64)
+        return GroupIndex([], empty, empty, np.zeros(0, dtype=object), empty)
+
+    column_C = df.iloc[start:, 2]
+    present = (column_C.notna() & ~column_C.isin(["", 0])).to_numpy(dtype=bool)
+    positions = np.flatnonzero(present) + start
+    strings = column_C[present].astype(str)
+    is_isin = (strings.str.len() == ISIN_LENGTH).to_numpy(dtype=bool)
+
+    group_positions = positions[~is_isin]
+    isin_positions = positions[is_isin]
+    return GroupIndex(
+        titles=strings[~is_isin].tolist(),
+        group_positions=group_positions,
+        isin_positions=isin_positions,
+        isin_values=strings[is_isin].to_numpy(dtype=object),
+        isin_groups=np.searchsorted(group_positions, isin_positions) - 1,
+    )
+
+
+def sheet_group_index(df: pd.DataFrame) -> GroupIndex:
+    """
+    Разметка листа (build_group_index), считается один раз для объекта DataFrame
+
+    Используется обработкой, правилами выбора и отображением листа в GUI.
+    """
+    index = _group_indexes.get(id(df))
+    if index is None:
+        with span("group_index", rows=len(df)):
+            index = build_group_index(df)
+        _group_indexes[id(df)] = index
+        # Запись удаляется вместе с DataFrame, чтобы id не переиспользовался
+        weakref.finalize(df, _group_indexes.pop, id(df), None)
+    return index
+
+
+def find_isin_rows(sheet_data: Dict[str, pd.DataFrame],
+                   isins: Optional[Set[str]] = None) -> Dict[str, List[int]]:
+    """
+    Находит строки с ISIN (колонка C, начиная с 5-й строки) во всех листах
+
+    Args:
+        sheet_data (Dict[str, pd.DataFrame]): Данные листов из load_excel_data
+        isins (Optional[Set[str]]): Набор ISIN для отбора; None - все ISIN-строки
+
+    Returns:
+        Dict[str, List[int]]: Номера строк по листам в формате selected_rows
+    """
+    selected_rows: Dict[str, List[int]] = {}
+    for sheet_name, df in sheet_data.items():
+        index = sheet_group_index(df)
+        positions = index.isin_positions
+        if isins is not None:
+            positions = positions[np.fromiter((value in isins for value in index.isin_values),
+                                              dtype=bool, count=len(positions))]
+        selected_rows[sheet_name] = (positions + DATA_ROW_OFFSET).tolist()
+    return selected_rows
+
+
+# Сопоставление заголовков с кэшем известных раскладок
+default_matcher = HeaderMatcher(Old_SetColumns)
+
+
+class SheetRecords(NamedTuple):
+    """
+    Записи листа, не зависящие от выделения и выбранных столбцов
+
+    values - значения только строк с ISIN, titles - названия групп в
+    порядке появления, rows - строки с ISIN в виде (строка Excel, группа,
+    индекс строки в values). Остальные строки листа не копируются, чтобы
+    записи в RecordCache не держали в памяти весь лист.
+    """
+    header_row2: List[object]
+    header_row3: List[object]
+    titles: List[str]
+    rows: List[Tuple[int, str, int]]
+    values: np.ndarray
+
+
+def sheet_header_rows(df: pd.DataFrame) -> Tuple[List[object], List[object]]:
+    """Заголовки листа из 2 и 3 строк Excel (пустые ячейки -> None)"""
+    return ([_cell_value(v) for v in df.iloc[0].tolist()],
+            [_cell_value(v) for v in df.iloc[1].tolist()])
+
+
+def build_sheet_records(df: pd.DataFrame) -> Optional[SheetRecords]:
+    """
+    Разбирает лист на группы и строки с ISIN (колонка C, начиная с 5-й строки)
+
+    Returns:
+        Optional[SheetRecords]: Записи листа или None, если в листе нет данных
+    """
+    if len(df.columns) < 3 or len(df) < 2:
+        return None
+
+    header_row2, header_row3 = sheet_header_rows(df)
+
+    # Группы и строки с ISIN берутся из разметки листа
+    index = sheet_group_index(df)
+    values = df.iloc[index.isin_positions].to_numpy(dtype=object)
+    titles = index.titles
+    group_titles = titles + [UNTITLED_GROUP]  # номер -1 - строки до первой группы
+    rows = [(i + DATA_ROW_OFFSET, group_titles[group], k)
+            for k, (i, group) in enumerate(zip(index.isin_positions.tolist(), index.isin_groups.tolist()))]
+
+    return SheetRecords(header_row2, header_row3, titles, rows, values)
+
+
+def extract_file_records(sheet_data: Mapping[str, pd.DataFrame]) -> Dict[str, Optional[SheetRecords]]:
+    """Записи всех листов файла (build_sheet_records)"""
+    return {sheet_name: build_sheet_records(df) for sheet_name, df in sheet_data.items()}
+
+
+def select_records(records: Dict[str, Optional[SheetRecords]],
+                   selected_rows: Dict[str, List[int]],
+                   columns_to_keep: List[int],
+                   matcher: Optional[HeaderMatcher] = None
+                   ) -> Tuple[Dict[str, set], set]:
+    """
+    Отбирает из записей листов выделенные строки и выбранные столбцы
+
+    Args:
+        records (Dict[str, Optional[SheetRecords]]): Записи из extract_file_records
         selected_rows (Dict[str, List[int]]): Выделенные строки по листам
-        save_path (str): Путь для сохранения результата
         columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        matcher (Optional[HeaderMatcher]): Сопоставление заголовков (по умолчанию default_matcher)
+
+    Returns:
+        Tuple[Dict[str, set], set]: То же, что и extract_selected_rows
     """
+    matcher = matcher or default_matcher
+    Chosen_assets: Dict[str, set] = {UNTITLED_GROUP: set()}
+    Used_positions: set = set()
 
-    # ---- Справочные соответствия колонок старого файла ----
-    Old_Columns: Tuple[Tuple[object, object], ...] = (
-        ("ISIN", 0),
-        ("Ticker &", "Exchange"), 
-        ("Ccy", 0),
-        ("Cpn", "(%)"),
-        ("Name", 0),
-        ("Sector", 0),
-        ("Industry", 0), 
-        ("Maturity", "(1. call date)"),
-        ("Price", 0),
-        ("Perf", "YTD %"),
-        ("Mk-Cap", "mia"),
-        ("YTM", "MID"),
-        ("Share", "classes"),
-        ("ER/MF", 0),
-        ("Rating", "Mood"),
-        ("Rating", "S&P"),
-        ("Rating", "Fitch"),
-        ("Size", "mio"),
-        ("Z-", "Spread"),
-        ("ASW", "spread"),
-        ("Min", "piece"),
-        ("Min", "incr"),
-        ("Mkt of", "Issue"),
-        ("Notes", 0),
-        ("Added", "on")
-    )
+    for sheet_name, sheet_records in records.items():
+        if sheet_records is None:
+            continue
+        for title in sheet_records.titles:
+            if title not in Chosen_assets:
+                Chosen_assets[title] = set()
+
+        sheet_selected = set(selected_rows.get(sheet_name, []))
+        if not sheet_selected:
+            continue
+
+        with span("header_match", sheet=sheet_name):
+            dic_to_copy = matcher.match(sheet_records.header_row2, sheet_records.header_row3, columns_to_keep)
+
+        values = sheet_records.values
+        for excel_row, title, i in sheet_records.rows:
+            if excel_row not in sheet_selected:
+                continue
+            row_values = values[i]
+            # 25 позиций, как в старом формате
+            list_of_values = [None] * 25
+
+            for source_col, target_pos in dic_to_copy.items():
+                if 1 <= target_pos <= 25:
+                    value = _cell_value(row_values[source_col - 1])
+                    list_of_values[target_pos - 1] = value
+                    if value:
+                        Used_positions.add(target_pos)
+
+            Chosen_assets[title].add(tuple(list_of_values))
+
+    return Chosen_assets, Used_positions
+
+
+def extract_selected_rows(sheet_data: Mapping[str, pd.DataFrame],
+                          selected_rows: Dict[str, List[int]],
+                          columns_to_keep: List[int],
+                          matcher: Optional[HeaderMatcher] = None
+                          ) -> Tuple[Dict[str, set], set]:
+    """
+    Собирает выбранные строки из уже загруженных листов
+
+    Args:
+        sheet_data (Mapping[str, pd.DataFrame]): Данные листов из load_excel_data
+            или open_excel_data
+        selected_rows (Dict[str, List[int]]): Выделенные строки по листам
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        matcher (Optional[HeaderMatcher]): Сопоставление заголовков (по умолчанию default_matcher)
+
+    Returns:
+        Tuple[Dict[str, set], set]: (строки по группам в виде кортежей из 25 позиций,
+            множество позиций, в которых есть хотя бы одно значение)
+    """
+    return select_records(extract_file_records(sheet_data), selected_rows, columns_to_keep, matcher)
+
+
+def extract_selected_rows_streaming(file_path: str,
+                                    selected_rows: Dict[str, List[int]],
+                                    columns_to_keep: List[int],
+                                    matcher: Optional[HeaderMatcher] = None
+                                    ) -> Tuple[Dict[str, set], set]:
+    """
+    Собирает выбранные строки потоково, не загружая файл целиком
+
+    Каждый лист читается в режиме read_only одним проходом iter_rows:
+    строки 2/3 дают сопоставление заголовков, с 5-й строки по колонке C
+    определяются группы и ISIN, выбранные строки сохраняются сразу.
+    Расход памяти не зависит от количества строк в листах.
+
+    Args:
+        file_path (str): Путь к исходному файлу
+        selected_rows (Dict[str, List[int]]): Выделенные строки по листам
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        matcher (Optional[HeaderMatcher]): Сопоставление заголовков (по умолчанию default_matcher)
 
-    Old_SetColumns = {
-        ("ISIN", "0"):1, 
-        ("Ticker &", "Exchange"):2, 
-        ("Ccy", "0"):3, 
-        ("Cpn", "(%)"):4, 
-        ("0", "(%)"):4, 
-        ("Name", "1"):5, 
-        ("Sector", "0"):6, 
-        ("Industry", "0"):7, 
-        ("Maturity", "(1. call date)"):8, 
-        ("Price", "MID"):9, 
-        ("Price", "1"):9, 
-        ("Perf", "YTD %"):10,
-        ("Mk-Cap", "mia"):11, 
-        ("YTM", "MID"):12, 
-        ("Share class", "0"):13, 
-        ("Share", "class"):13, 
-        ("ER/MF", "0"):14, 
-        ("Rating", "Moody"):15, 
-        ("Rating", "S&P"):16, 
-        ("Rating", "Fitch"):17, 
-        ("Size", "mio"):18, 
-        ("Z-", "spread"):19, 
-        ("ASW", "spread"):20, 
-        ("Min", "piece"):21, 
-        ("Min", "incr"):22, 
-        (0, "Mkt of Issue"):23, 
-        ("Notes", "0"):24, 
-        (0, "Notes"):24, 
-        ("Added on", "0"):25, 
-        ("Added", "on"):25
-    }
-
-    # ---- Преобразование columns_to_keep и построение справочников ----
-    # Исправление "tuple index out of range": columns_to_keep даны как 1..25,
-    # а Old_Columns индексируется с 0, поэтому вычитаем 1.
-    Columns: List[Tuple[object, object]] = []
-    SetColumns: Dict[Tuple[object, object], int] = {}
-
-    for chosen_column in columns_to_keep:
-        if 1 <= chosen_column <= len(Old_Columns):
-            Columns.append(Old_Columns[chosen_column - 1])  # <-- фикс off-by-one
-            # набираем соответствующие пары заголовков для сопоставления
-            for title_for_old_columns, idx in Old_SetColumns.items():
-                if idx == chosen_column:
-                    SetColumns[title_for_old_columns] = chosen_column
-
-    Chosen_assets: Dict[str, set] = {"Без названия": set()}
+    Returns:
+        Tuple[Dict[str, set], set]: То же, что и extract_selected_rows
+    """
+    matcher = matcher or default_matcher
+    Chosen_assets: Dict[str, set] = {UNTITLED_GROUP: set()}
     Used_positions: set = set()
 
-    # ---- Подготовка файла результата ----
-    file_name = os.path.basename(file_path)
-    name_without_ext = os.path.splitext(file_name)[0]
-    result_file_name = f"{name_without_ext}_result.xlsx"
-    result_path = os.path.join(save_path, result_file_name)
+    source_wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for source_ws in source_wb.worksheets:
+            current_title = UNTITLED_GROUP
+            sheet_selected = set(selected_rows.get(source_ws.title, []))
+            header_row2: Tuple[object, ...] = ()
+            dic_to_copy: Dict[int, int] = {}
 
-    # Копируем cleaned.xlsx в результат
+            for row_idx, row_values in enumerate(source_ws.iter_rows(values_only=True), start=1):
+                if row_idx == 2:
+                    header_row2 = row_values
+                    continue
+                if row_idx == 3:
+                    with span("header_match", sheet=source_ws.title):
+                        dic_to_copy = matcher.match(header_row2, row_values, columns_to_keep)
+                    continue
+                # Строки с данными начинаются с 5-й
+                if row_idx < 5 or len(row_values) < 3:
+                    continue
 
-    if getattr(sys, 'frozen', False):
-        # If the application is run as a bundle, the PyInstaller bootloader
-        # extends the sys module by a flag frozen=True and sets the app 
-        # path into variable _MEIPASS'.
-        current_dir = sys._MEIPASS
-        print("asddd", sys._MEIPASS)
-    else:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-    cleaned_path = os.path.join(current_dir, "cleaned.xlsx")
-    Img = Image(os.path.join(current_dir, "QW.png"))
-    shutil.copy2(cleaned_path, result_path)
+                value_C = row_values[2]
+                if not value_C:
+                    continue
 
-    # Загружаем исходный файл и целевой файл
-    source_wb = load_workbook(file_path, read_only=False, data_only=True)
-    target_wb = load_workbook(result_path)
-    target_ws = target_wb.active
+                str_value_C = str(value_C)
+
+                # Если это название группы (не ISIN), обновляем текущий заголовок группы
+                if len(str_value_C) != ISIN_LENGTH:
+                    if str_value_C not in Chosen_assets:
+                        Chosen_assets[str_value_C] = set()
+                    current_title = str_value_C
+                elif row_idx in sheet_selected:
+                    # 25 позиций, как в старом формате
+                    list_of_values = [None] * 25
+
+                    for source_col, target_pos in dic_to_copy.items():
+                        if source_col - 1 < len(row_values) and 1 <= target_pos <= 25:
+                            value = row_values[source_col - 1]
+                            list_of_values[target_pos - 1] = value
+                            if value:
+                                Used_positions.add(target_pos)
+
+                    Chosen_assets[current_title].add(tuple(list_of_values))
+    finally:
+        source_wb.close()
+
+    return Chosen_assets, Used_positions
 
-    # Вставка изображения
-    Img.width = 96 
-    Img.height = 58
-    target_ws.column_dimensions["A"].width = 15
-    target_ws.row_dimensions[1].height = 60
-    target_ws.add_image(Img, "A1")
 
-    # Сбор выбранных данных из исходного файла 
-    for source_ws in source_wb.worksheets:
-        current_title = "Без названия"
-        max_row = source_ws.max_row
-        max_column = source_ws.max_column
+def extract_selected_rows_targeted(file_path: str,
+                                   selected_rows: Dict[str, List[int]],
+                                   columns_to_keep: List[int],
+                                   matcher: Optional[HeaderMatcher] = None
+                                   ) -> Tuple[Dict[str, set], set]:
+    """
+    Собирает выбранные строки выборочным чтением xlsx (read_targeted_sheets)
+
+    Читаются только строки 2/3, колонка C и из выделенных строк - столбцы,
+    сопоставленные с columns_to_keep; модель книги openpyxl не строится. Если файл не удается разобрать напрямую (не xlsx,
+    нестандартная структура архива), строки читаются через
+    extract_selected_rows_streaming.
+
+    Args:
+        file_path (str): Путь к исходному файлу
+        selected_rows (Dict[str, List[int]]): Выделенные строки по листам
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        matcher (Optional[HeaderMatcher]): Сопоставление заголовков (по умолчанию default_matcher)
+
+    Returns:
+        Tuple[Dict[str, set], set]: То же, что и extract_selected_rows
+    """
+    matcher = matcher or default_matcher
+    try:
+        with span("read_targeted", file=os.path.basename(file_path)):
+            sheets = read_targeted_sheets(
+                file_path, selected_rows,
+                columns=lambda header_row2, header_row3: matcher.match(header_row2, header_row3, columns_to_keep))
+    except UnsupportedWorkbook as e:
+        print(f"Targeted read failed for {file_path}, falling back to openpyxl: {e}")
+        return extract_selected_rows_streaming(file_path, selected_rows, columns_to_keep, matcher)
+
+    Chosen_assets: Dict[str, set] = {UNTITLED_GROUP: set()}
+    Used_positions: set = set()
+
+    for sheet in sheets:
+        current_title = UNTITLED_GROUP
         dic_to_copy: Dict[int, int] = {}
+        if sheet.rows:
+            with span("header_match", sheet=sheet.name):
+                dic_to_copy = matcher.match(sheet.header_row2, sheet.header_row3, columns_to_keep)
 
-        # Сопоставляем столбцы по двум строкам заголовка (r2/r3)
-        for title_column in range(3, max_column + 1):
-            cell1 = source_ws.cell(row=2, column=title_column)
-            cell2 = source_ws.cell(row=3, column=title_column)
-            value1 = cell1.value if cell1.value is not None else "0"
-            value2 = cell2.value if cell2.value is not None else "0"
-            title_to_check = (value1, value2)
-            title_to_check2 = (value1, "1")
-
-            if title_to_check in SetColumns:
-                dic_to_copy[title_column] = SetColumns[title_to_check]
-            elif title_to_check2 in SetColumns:
-                dic_to_copy[title_column] = SetColumns[title_to_check2]
-
-        # Строки с данными начинаются с 5-й
-        for row in source_ws.iter_rows(min_row=5, max_row=max_row, min_col=3, max_col=3):
-            cell_C = row[0]
-            current_row_idx = cell_C.row
-            value_C = cell_C.value
+        for row_idx, value_C in sheet.column_C:
             if not value_C:
                 continue
 
             str_value_C = str(value_C)
 
             # Если это название группы (не ISIN), обновляем текущий заголовок группы
-            if len(str_value_C) != 12:
+            if len(str_value_C) != ISIN_LENGTH:
                 if str_value_C not in Chosen_assets:
                     Chosen_assets[str_value_C] = set()
                 current_title = str_value_C
-            else:
-                # Это ISIN/бумага
-                if current_row_idx in selected_rows.get(source_ws.title, []):
-                    row_cells = next(source_ws.iter_rows(min_row=current_row_idx,
-                                                         max_row=current_row_idx))
+            elif row_idx in sheet.rows:
+                row_values = sheet.rows[row_idx]
+                # 25 позиций, как в старом формате
+                list_of_values = [None] * 25
 
-                    # 25 позиций, как в старом формате
-                    list_of_values = [None] * 25
+                for source_col, target_pos in dic_to_copy.items():
+                    if 1 <= target_pos <= 25:
+                        value = row_values[source_col - 1] if source_col - 1 < len(row_values) else None
+                        list_of_values[target_pos - 1] = value
+                        if value:
+                            Used_positions.add(target_pos)
 
-                    for source_col, target_pos in dic_to_copy.items():
-                        if source_col - 1 < len(row_cells) and 1 <= target_pos <= 25:
-                            list_of_values[target_pos - 1] = row_cells[source_col - 1].value
-                            if row_cells[source_col - 1].value:
-                                Used_positions.add(target_pos)
+                Chosen_assets[current_title].add(tuple(list_of_values))
 
-                    Chosen_assets[current_title].add(tuple(list_of_values))
+    return Chosen_assets, Used_positions
 
-    source_wb.close()
 
-    # ---- Подготовка структуры столбцов для вывода ----
-    Empty_columns = set(range(1, 26)) - Used_positions
-    visible_positions = sorted(pos for pos in range(1, 26) if pos not in Empty_columns)
-    visible_count = len(visible_positions)
+def _resource_dir() -> str:
+    """Каталог с cleaned.xlsx и QW.png (учитывает сборку PyInstaller)"""
+    if getattr(sys, 'frozen', False):
+        # If the application is run as a bundle, the PyInstaller bootloader
+        # extends the sys module by a flag frozen=True and sets the app 
+        # path into variable _MEIPASS'.
+        return sys._MEIPASS
+    return os.path.dirname(os.path.abspath(__file__))
 
-    # ---- Заголовок портфеля ----
-    target_ws.cell(row=1, column=2, value="Balanced Portfolio")
-    target_ws.cell(row=1, column=2).alignment = Alignment(horizontal='center', vertical='center')
-    target_ws.cell(row=1, column=2).font = Font(size=40, bold=True, color='808080', name='Calabria Light')
-    if visible_count >= 2:
-        target_ws.merge_cells(start_row=1, start_column=2, end_row=1, end_column=visible_count)
 
-    # ---- Заголовки столбцов (2 строки) ----
-    current_row = 4
-    # Ставим только для реально используемых позиций, в "сжатом" порядке
-    for new_idx, old_pos in enumerate(visible_positions, start=1):
-        if 1 <= old_pos <= len(Old_Columns):
-            top, bottom = Old_Columns[old_pos - 1]
-            target_ws.cell(row=2, column=new_idx).value = top if top != 0 else None
-            target_ws.cell(row=3, column=new_idx).value = bottom if bottom != 0 else None
-
-    # ---- Базовые стили ----
+def _template_paths() -> Tuple[str, str]:
+    """Пути к шаблону cleaned.xlsx и логотипу QW.png"""
+    current_dir = _resource_dir()
+    return os.path.join(current_dir, "cleaned.xlsx"), os.path.join(current_dir, "QW.png")
+
+
+def preload_result_template():
+    """Разбирает шаблон результата заранее, например при запуске рабочего процесса"""
+    default_template_cache.get(*_template_paths())
+
+
+# Имена стилей файла результата
+STYLE_TITLE = "LP Title"
+STYLE_HEADER = "LP Header"
+STYLE_GROUP = "LP Group"
+STYLE_DATA = "LP Data"
+STYLE_DATA_FLOAT = "LP Data Float"
+
+
+def _register_result_styles(wb: Workbook, base_font: Font) -> Dict[str, StyleArray]:
+    """
+    Регистрирует именованные стили результата в книге
+
+    Каждый стиль записывается в файл один раз, а ячейки ссылаются на него,
+    поэтому при записи не создаются отдельные Font/Fill/Border на ячейку.
+
+    Args:
+        wb (Workbook): Книга результата
+        base_font (Font): Шрифт по умолчанию из шаблона
+
+    Returns:
+        Dict[str, StyleArray]: {имя стиля: готовый набор индексов стиля для ячеек}
+    """
+    FONT_TITLE = Font(size=40, bold=True, color='808080', name='Calabria Light')
     FONT_GROUP = Font(bold=True, color='808080', name='Calabria Light')
     FILL_GROUP = PatternFill(start_color='C0C0C0', end_color='C0C0C0', fill_type='solid')
     BORDER_THIN = Border(left=Side(style=None), right=Side(style=None),
                          top=Side(style='thin'), bottom=Side(style='thin'))
     ALIGN_LEFT = Alignment(horizontal='left', vertical='bottom')
 
-    # ---- Вставка данных ----
-    for key, value_set in Chosen_assets.items():
-        if not value_set:
-            continue
+    named_styles = (
+        NamedStyle(name=STYLE_TITLE, font=FONT_TITLE,
+                   alignment=Alignment(horizontal='center', vertical='center')),
+        NamedStyle(name=STYLE_HEADER, font=copy(base_font)),
+        NamedStyle(name=STYLE_GROUP, font=FONT_GROUP, fill=FILL_GROUP, border=BORDER_THIN),
+        NamedStyle(name=STYLE_DATA, font=copy(base_font), border=BORDER_THIN, alignment=ALIGN_LEFT),
+        NamedStyle(name=STYLE_DATA_FLOAT, font=copy(base_font), border=BORDER_THIN, alignment=ALIGN_LEFT,
+                   number_format='#,##0.0'),
+    )
+    styles = {}
+    for named_style in named_styles:
+        wb.add_named_style(named_style)
+        styles[named_style.name] = named_style.as_tuple()
+    return styles
 
-        # Строка группы
-        target_ws.cell(row=current_row, column=1, value=key)
-        for i in range(1, visible_count + 1):
-            c = target_ws.cell(row=current_row, column=i)
-            c.font = FONT_GROUP
-            c.fill = FILL_GROUP
-        current_row += 1
-
-        # Строки значений
-        for tuple_item in value_set:
-            # tuple_item гарантированно длиной 25
-            empty_before = 0
-            for col_idx, value in enumerate(tuple_item, start=1):
-                if col_idx in Empty_columns:
-                    empty_before += 1
-                    continue
 
-                new_col = col_idx - empty_before
-                if new_col < 1 or new_col > visible_count:
-                    continue  # защита от выхода за пределы
-
-                cell_out = target_ws.cell(row=current_row, column=new_col, value=value)
-                cell_out.alignment = ALIGN_LEFT
-                if isinstance(value, float):
-                    cell_out.number_format = '#,##0.0'
-            current_row += 1
-
-    # Рамки
-    for i in range(1, visible_count + 1):
-        for j in range(4, target_ws.max_row + 1):
-            target_ws.cell(row=j, column=i).border = BORDER_THIN
-
-    # Пробегаемся по каждой видимой колонке и считаем максимальную длину текста
-    for i, old_pos in enumerate(visible_positions, start=1):
-        max_len = 1
-        for r in range(3, target_ws.max_row + 1):
-            v = target_ws.cell(row=r, column=i).value
-            if v is None:
-                continue
-            length = len(str(v))
-            if length > max_len:
-                max_len = length
-        # ширина = макс. длина + 2, но не больше 60
+def _styled_cell(ws, value, style: StyleArray) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value)
+    # Для дат openpyxl сам выставляет формат числа, его нужно сохранить
+    date_format = cell._style.numFmtId if cell.is_date else None
+    cell._style = copy(style)
+    if date_format is not None:
+        cell._style.numFmtId = date_format
+    return cell
+
+
+def write_result_workbook(result_path: str, Chosen_assets: Dict[str, set],
+                          Used_positions: set, template_path: str, logo_path: str):
+    """
+    Записывает файл результата потоково в режиме write_only
+
+    Строки выводятся по порядку за один проход: значения, оформление групп
+    и строк данных, рамки и формат чисел назначаются через именованные
+    стили в момент записи ячейки. Ширины столбцов считаются векторно по
+    извлеченным строкам до записи (в write_only описание столбцов идет
+    перед строками), поэтому повторных проходов по листу нет и память не
+    растет с количеством строк результата. Параметры листа
+    (вид, поля, печать, шрифт по умолчанию) берутся из шаблона cleaned.xlsx,
+    который вместе с логотипом разбирается один раз на процесс
+    (default_template_cache).
+
+    Args:
+        result_path (str): Путь к файлу результата
+        Chosen_assets (Dict[str, set]): Строки по группам из extract_selected_rows
+        Used_positions (set): Позиции 1..25, в которых есть значения
+        template_path (str): Путь к шаблону cleaned.xlsx
+        logo_path (str): Путь к логотипу QW.png
+    """
+    # ---- Подготовка структуры столбцов для вывода ----
+    visible_positions = sorted(pos for pos in range(1, 26) if pos in Used_positions)
+    visible_count = len(visible_positions)
+    # Индексы значений в кортеже из 25 позиций, в "сжатом" порядке
+    visible_indexes = [pos - 1 for pos in visible_positions]
+
+    header_top = []
+    header_bottom = []
+    for old_pos in visible_positions:
+        top, bottom = Old_Columns[old_pos - 1]
+        header_top.append(top if top != 0 else None)
+        header_bottom.append(bottom if bottom != 0 else None)
+
+    groups = [(key, value_set) for key, value_set in Chosen_assets.items() if value_set]
+
+    # Ширина столбца = макс. длина текста начиная с 3-й строки + 5
+    all_rows = [tuple_item for _, value_set in groups for tuple_item in value_set]
+    with span("column_widths", rows=len(all_rows)):
+        max_lengths = [max(1, length) for length in rows_column_widths(all_rows, visible_indexes)]
+    for i, value in enumerate(header_bottom):
+        if value is not None:
+            max_lengths[i] = max(max_lengths[i], len(str(value)))
+    if visible_count and groups:
+        max_lengths[0] = max(max_lengths[0], max(len(str(key)) for key, _ in groups))
+
+    # Шаблон и логотип разбираются один раз на процесс
+    template = default_template_cache.get(template_path, logo_path)
+
+    target_wb = Workbook(write_only=True)
+    target_ws = target_wb.create_sheet(template.title)
+
+    # Параметры листа из шаблона
+    template.apply_sheet_setup(target_ws)
+    # Шрифт, который получают новые ячейки шаблона
+    FONT_BASE = template.base_font
+
+    target_ws.column_dimensions["A"].width = 15
+    for i, max_len in enumerate(max_lengths, start=1):
         target_ws.column_dimensions[get_column_letter(i)].width = max_len + 5
+    target_ws.row_dimensions[1].height = 60
+
+    # Вставка изображения
+    Img = template.logo_image()
+    Img.width = 96 
+    Img.height = 58
+    target_ws.add_image(Img, "A1")
+
+    # ---- Именованные стили ----
+    styles = _register_result_styles(target_wb, FONT_BASE)
+    style_title = styles[STYLE_TITLE]
+    style_header = styles[STYLE_HEADER]
+    style_group = styles[STYLE_GROUP]
+    style_data = styles[STYLE_DATA]
+    style_data_float = styles[STYLE_DATA_FLOAT]
+
+    # ---- Заголовок портфеля ----
+    target_ws.append([None, _styled_cell(target_ws, "Balanced Portfolio", style_title)])
+    if visible_count >= 2:
+        target_ws.merged_cells.add(f"B1:{get_column_letter(visible_count)}1")
+
+    # ---- Заголовки столбцов (2 строки) ----
+    target_ws.append([_styled_cell(target_ws, value, style_header) for value in header_top])
+    target_ws.append([_styled_cell(target_ws, value, style_header) for value in header_bottom])
+
+    # ---- Вставка данных ----
+    with span("write_rows", rows=len(all_rows)):
+        for key, value_set in groups:
+            # Строка группы
+            group_row = [_styled_cell(target_ws, None, style_group) for _ in range(visible_count)]
+            if group_row:
+                group_row[0].value = key
+            else:
+                group_row = [key]
+            target_ws.append(group_row)
+
+            # Строки значений
+            for tuple_item in value_set:
+                row = []
+                for idx in visible_indexes:
+                    value = tuple_item[idx]
+                    style = style_data_float if isinstance(value, float) else style_data
+                    row.append(_styled_cell(target_ws, value, style))
+                target_ws.append(row)
 
     # Сохранение результата
-    target_wb.save(result_path)
-    target_wb.close()
+    with span("save"):
+        target_wb.save(result_path)
+
+
+# Форматы результата: {формат: окончание имени файла после "<имя>_result"}
+RESULT_FORMATS: Dict[str, str] = {
+    "xlsx": ".xlsx",          # оформленная книга по шаблону cleaned.xlsx (openpyxl)
+    "raw_xlsx": "_raw.xlsx",  # минимальная книга, XML листа пишется напрямую
+    "csv": ".csv",
+    "tsv": ".tsv",
+}
+
+# Облегченные форматы: пишутся из плоской таблицы результата
+FLAT_RESULT_WRITERS: Dict[str, Callable] = {
+    "raw_xlsx": write_result_xlsx_raw,
+    "csv": write_result_csv,
+    "tsv": write_result_tsv,
+}
+
+
+def _write_atomically(result_path: str, write: Callable[[str], None]):
+    """
+    Записывает файл результата через временный файл в том же каталоге
+
+    write(path) пишет во временный файл, который после успешной записи
+    переименовывается в result_path. Недописанный результат не появляется
+    под итоговым именем (например, в папке, за которой следит watcher),
+    а прежний файл остается целым, если запись не удалась.
+    """
+    tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, result_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_results(result_stem: str, Chosen_assets: Dict[str, set], Used_positions: set,
+                  formats: Sequence[str] = ("xlsx",)) -> List[str]:
+    """
+    Записывает результат в одном или нескольких форматах
+
+    Несколько форматов пишутся одновременно в отдельных потоках из одних
+    и тех же извлеченных строк; сжатие zip и запись файлов идут без GIL.
+
+    Args:
+        result_stem (str): Путь к результату без окончания формата
+            (например, ".../file_result")
+        Chosen_assets (Dict[str, set]): Строки по группам из extract_selected_rows
+        Used_positions (set): Позиции 1..25, в которых есть значения
+        formats (Sequence[str]): Форматы из RESULT_FORMATS
+
+    Returns:
+        List[str]: Пути к файлам результата в порядке formats
+    """
+    unknown = [result_format for result_format in formats if result_format not in RESULT_FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Unknown result formats: {', '.join(unknown) or 'none given'}; "
+                         f"expected {', '.join(RESULT_FORMATS)}")
+
+    table = None
+    if any(result_format in FLAT_RESULT_WRITERS for result_format in formats):
+        table = build_result_table(Chosen_assets, Used_positions, Old_Columns)
+
+    # Потоки пула не видят стек этапов вызывающего потока: родитель передается явно
+    parent_span = default_instrumentation.current()
+
+    def write(result_format: str) -> str:
+        result_path = result_stem + RESULT_FORMATS[result_format]
+        with span(f"write_{result_format}", rows=sum(len(rows) for rows in Chosen_assets.values()),
+                  parent=parent_span):
+            if result_format == "xlsx":
+                template_path, logo_path = _template_paths()
+                _write_atomically(result_path, lambda path: write_result_workbook(
+                    path, Chosen_assets, Used_positions, template_path, logo_path))
+            else:
+                _write_atomically(result_path, lambda path: FLAT_RESULT_WRITERS[result_format](path, table))
+        return result_path
+
+    if len(formats) == 1:
+        return [write(formats[0])]
+    with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+        return list(pool.map(write, formats))
+
+
+def excel_processing(file_path: str, sheet_data: Mapping[str, pd.DataFrame], 
+                    selected_rows: Dict[str, List[int]], save_path: str, 
+                    columns_to_keep: List[int], streaming: bool = False,
+                    record_cache: Optional[RecordCache] = default_record_cache,
+                    formats: Sequence[str] = ("xlsx",)) -> List[str]:
+    """
+    Обработка выделенных данных из Excel файла и сохранение результата
+
+    Исходный файл повторно не разбирается: строки берутся из sheet_data,
+    уже загруженных через load_excel_data или open_excel_data (в этом случае
+    неразобранные листы разбираются здесь). Если sheet_data пуст, листы
+    берутся из дискового кэша, а если их там нет или задан streaming,
+    из файла выборочно читаются только нужные строки
+    (extract_selected_rows_targeted).
+
+    Записи листов (extract_file_records) запоминаются в record_cache, поэтому
+    повторная обработка того же файла с другим выделением или набором
+    столбцов только отбирает строки из записей и записывает результат.
+
+    Args:
+        file_path (str): Путь к исходному файлу
+        sheet_data (Mapping[str, pd.DataFrame]): Данные всех листов
+        selected_rows (Dict[str, List[int]]): Выделенные строки по листам
+        save_path (str): Путь для сохранения результата
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        streaming (bool): Читать строки из файла выборочно, не разбирая листы
+        record_cache (Optional[RecordCache]): Кэш записей листов (None - не использовать)
+        formats (Sequence[str]): Форматы результата из RESULT_FORMATS
+
+    Returns:
+        List[str]: Пути к файлам результата в порядке formats
+    """
+
+    # ---- Подготовка файла результата ----
+    file_name = os.path.basename(file_path)
+    name_without_ext = os.path.splitext(file_name)[0]
+    result_stem = os.path.join(save_path, f"{name_without_ext}_result")
+
+    selected_count = sum(len(rows) for rows in selected_rows.values())
+    with span("excel_processing", rows=selected_count, file=file_name):
+        # Сбор выбранных данных
+        records = record_cache.get(file_path) if record_cache else None
+        if records is None and not sheet_data and not streaming:
+            cached_data = open_excel_data(file_path)
+            if cached_data.is_cached():
+                sheet_data = cached_data
+
+        with span("extract", rows=selected_count, cached=records is not None):
+            if records is None and (streaming or not sheet_data):
+                Chosen_assets, Used_positions = extract_selected_rows_targeted(
+                    file_path, selected_rows, columns_to_keep)
+            else:
+                if records is None:
+                    records = extract_file_records(sheet_data)
+                    if record_cache:
+                        record_cache.put(file_path, records)
+                Chosen_assets, Used_positions = select_records(records, selected_rows, columns_to_keep)
+
+        with span("write_result", formats=",".join(formats)):
+            return write_results(result_stem, Chosen_assets, Used_positions, formats)
+
+# Имя файла результата объединения по умолчанию
+MERGED_RESULT_NAME = "merged_result.xlsx"
+
+
+def extract_source(file_path: str, selected_rows: Optional[Dict[str, List[int]]],
+                   columns_to_keep: List[int], isins: Optional[Set[str]] = None,
+                   use_cache: bool = True,
+                   select: Optional[Callable[[Mapping[str, pd.DataFrame]], Dict[str, List[int]]]] = None
+                   ) -> Tuple[Dict[str, set], set]:
+    """
+    Читает один исходный файл и собирает его выбранные строки
+
+    Выполняется в рабочем процессе при объединении файлов. Листы берутся
+    из дискового кэша, если они там есть (и use_cache включен); иначе при
+    заданных selected_rows нужные строки читаются выборочно
+    (extract_selected_rows_targeted), не разбирая листы целиком.
+
+    Args:
+        file_path (str): Путь к исходному файлу
+        selected_rows (Optional[Dict[str, List[int]]]): Выделенные строки по листам;
+            None - строки отбираются через select или по isins через find_isin_rows
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        isins (Optional[Set[str]]): Набор ISIN для отбора, если selected_rows не задан
+        use_cache (bool): Использовать дисковый кэш листов
+        select: Отбор строк по данным листов (например, SelectionRule), если
+            selected_rows не задан
+
+    Returns:
+        Tuple[Dict[str, set], set]: То же, что и extract_selected_rows
+    """
+    sheet_data = LazySheetData(file_path, disk_cache=default_cache if use_cache else None)
+    try:
+        if selected_rows is not None and not sheet_data.is_cached():
+            with span("extract_source", rows=sum(len(rows) for rows in selected_rows.values()),
+                      file=os.path.basename(file_path)):
+                return extract_selected_rows_targeted(file_path, selected_rows, columns_to_keep)
+        if selected_rows is None:
+            selected_rows = select(sheet_data) if select else find_isin_rows(sheet_data, isins)
+        with span("extract_source", rows=sum(len(rows) for rows in selected_rows.values()),
+                  file=os.path.basename(file_path)):
+            return extract_selected_rows(sheet_data, selected_rows, columns_to_keep)
+    finally:
+        sheet_data.close()
+
+
+def merge_extracted(results: List[Tuple[Dict[str, set], set]]) -> Tuple[Dict[str, set], set]:
+    """
+    Объединяет строки нескольких файлов в одну группировку
+
+    Группы с одинаковым названием из разных файлов сливаются, порядок групп -
+    порядок первого появления. Одинаковые строки попадают в результат один раз.
+
+    Args:
+        results (List[Tuple[Dict[str, set], set]]): Результаты extract_selected_rows по файлам
+
+    Returns:
+        Tuple[Dict[str, set], set]: (строки по группам, использованные позиции)
+    """
+    Chosen_assets: Dict[str, set] = {UNTITLED_GROUP: set()}
+    Used_positions: set = set()
+    for assets, positions in results:
+        for title, rows in assets.items():
+            Chosen_assets.setdefault(title, set()).update(rows)
+        Used_positions |= positions
+    return Chosen_assets, Used_positions
+
+
+def excel_processing_merge(sources: Mapping[str, Optional[Dict[str, List[int]]]], save_path: str,
+                           columns_to_keep: List[int], result_name: str = MERGED_RESULT_NAME,
+                           isins: Optional[Set[str]] = None, workers: Optional[int] = None,
+                           use_cache: bool = True,
+                           select: Optional[Callable[[Mapping[str, pd.DataFrame]], Dict[str, List[int]]]] = None,
+                           formats: Sequence[str] = ("xlsx",)) -> str:
+    """
+    Объединяет выбранные строки нескольких файлов в один файл результата
+
+    Файлы читаются и обрабатываются параллельно в пуле процессов, строки
+    объединяются через merge_extracted в порядке sources и записываются
+    один раз через write_results.
+
+    Args:
+        sources (Mapping[str, Optional[Dict[str, List[int]]]]): {путь к файлу: выделенные
+            строки по листам}; None - отбор через select или по isins
+        save_path (str): Путь для сохранения результата
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        result_name (str): Имя файла результата
+        isins (Optional[Set[str]]): Набор ISIN для файлов без выделенных строк (None - все ISIN)
+        workers (Optional[int]): Количество рабочих процессов
+        use_cache (bool): Использовать дисковый кэш листов
+        select: Отбор строк для файлов без выделенных строк (например, SelectionRule)
+        formats (Sequence[str]): Форматы результата из RESULT_FORMATS; окончание
+            формата заменяет расширение result_name
+
+    Returns:
+        str: Путь к файлу результата первого формата
+    """
+    if not sources:
+        raise ValueError("No source files to merge")
+
+    file_paths = list(sources)
+    result_stem = os.path.join(save_path, os.path.splitext(result_name)[0])
+    with span("excel_processing_merge", file=result_name, files=len(file_paths)) as merge_span:
+        with span("extract", files=len(file_paths)):
+            if len(file_paths) == 1:
+                results = [extract_source(file_paths[0], sources[file_paths[0]], columns_to_keep, isins,
+                                          use_cache, select)]
+            else:
+                # Рабочие процессы получают настройки замеров основного процесса
+                instrumentation_args = (default_instrumentation.log_path, default_instrumentation.trace_memory,
+                                        default_instrumentation.profile_dir)
+                max_workers = min(workers or os.cpu_count() or 1, len(file_paths))
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=configure,
+                                         initargs=instrumentation_args) as pool:
+                    # map сохраняет порядок файлов, поэтому порядок групп не зависит от скорости чтения
+                    results = list(pool.map(extract_source, file_paths,
+                                            [sources[path] for path in file_paths],
+                                            [columns_to_keep] * len(file_paths),
+                                            [isins] * len(file_paths),
+                                            [use_cache] * len(file_paths),
+                                            [select] * len(file_paths)))
+
+        Chosen_assets, Used_positions = merge_extracted(results)
+        merge_span.rows = sum(len(rows) for rows in Chosen_assets.values())
+
+        with span("write_result", formats=",".join(formats)):
+            result_paths = write_results(result_stem, Chosen_assets, Used_positions, formats)
+    return result_paths[0]
+
 
 # Для тестирования модуля
 if __name__ == "__main__":
@@ -1,7 +1,17 @@
+import queue
+import threading
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import ttk, filedialog, messagebox
+import numpy as np
 import pandas as pd
-from excel_handler import get_column_max_lengths
+from column_widths import max_string_length
+from compact_frames import format_memory_report, memory_report
+from excel_handler import DATA_ROW_OFFSET, GroupIndex, sheet_group_index
+from instrumentation import default_instrumentation, format_span, span
+from lazy_workbook import SHEET_CACHE_SIZE
+from search_index import SearchIndex
+from selection_rules import RULE_FIELDS, RuleError, RuleStore, SelectionRule
 from settings import Settings  # Импортируем Settings
 
 class SettingsDialog:
@@ -11,6 +21,7 @@ class SettingsDialog:
         self.dialog = None
         self.save_path_var = None
         self.columns_var = None
+        self.compact_var = None
         
     def show(self):
         """Показать диалоговое окно настроек"""
@@ -37,7 +48,7 @@ class SettingsDialog:
         
         # Настраиваем веса строк для правильного распределения пространства
         main_frame.rowconfigure(3, weight=1)  # Даем строке с чекбоксами возможность растягиваться
-        main_frame.rowconfigure(4, weight=0)  # Кнопки фиксированы внизу
+        main_frame.rowconfigure(5, weight=0)  # Кнопки фиксированы внизу
         
         # Путь сохранения
         ttk.Label(main_frame, text="Save Path:").grid(row=0, column=0, sticky=tk.W, pady=(0, 5))
@@ -113,9 +124,14 @@ class SettingsDialog:
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         
+        # Компактное хранение листов (действует для следующих открытых файлов)
+        self.compact_var = tk.BooleanVar()
+        ttk.Checkbutton(main_frame, text="Compact mode (less memory, applies to newly opened files)",
+                        variable=self.compact_var).grid(row=4, column=0, sticky=tk.W)
+
         # Кнопки - ПЕРЕМЕЩАЕМ В ОТДЕЛЬНУЮ СТРОКУ
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=4, column=0, sticky=tk.E, pady=(10, 0))
+        button_frame.grid(row=5, column=0, sticky=tk.E, pady=(10, 0))
         
         cancel_btn = ttk.Button(button_frame, text="Cancel", command=self.dialog.destroy)
         cancel_btn.pack(side=tk.RIGHT, padx=(5, 0))
@@ -134,6 +150,7 @@ class SettingsDialog:
         columns_to_keep = self.settings.get_column_to_keep()
         for col_num, var in self.checkbox_vars.items():
             var.set(col_num in columns_to_keep)
+        self.compact_var.set(self.settings.get_compact_mode())
         
     def browse_save_path(self):
         """Выбрать путь для сохранения"""
@@ -166,15 +183,236 @@ class SettingsDialog:
                 return
             
             # Сохранение настроек - ИСПРАВЛЕНО ИМЯ МЕТОДА
-            self.settings.save_settings(save_path, columns_to_keep)
+            self.settings.save_settings(save_path, columns_to_keep, self.compact_var.get())
             messagebox.showinfo("Success", "Settings saved successfully")
             self.dialog.destroy()
             
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
 
+class RulesDialog:
+    """Диалог правил выбора строк: ввод, сохранение и применение правила"""
+
+    def __init__(self, parent, on_apply):
+        self.parent = parent
+        self.on_apply = on_apply
+        self.store = RuleStore()
+        self.dialog = None
+        self.name_var = None
+        self.rule_text = None
+
+    def show(self):
+        """Показать диалоговое окно правил"""
+        self.dialog = tk.Toplevel(self.parent)
+        self.dialog.title("Selection Rules")
+        self.dialog.geometry("600x320")
+        self.dialog.transient(self.parent)
+        self.dialog.grab_set()
+        self.create_widgets()
+
+    def create_widgets(self):
+        """Создать виджеты диалогового окна"""
+        main_frame = ttk.Frame(self.dialog, padding="20")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.rowconfigure(3, weight=1)
+
+        # Сохраненные правила
+        ttk.Label(main_frame, text="Saved rule:").grid(row=0, column=0, sticky=tk.W, pady=(0, 5))
+        self.name_var = tk.StringVar()
+        name_box = ttk.Combobox(main_frame, textvariable=self.name_var,
+                                values=sorted(self.store.get_rules()))
+        name_box.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        name_box.bind('<<ComboboxSelected>>', lambda e: self.load_rule())
+
+        # Текст правила
+        ttk.Label(main_frame, text="Rule, e.g. ccy in {USD, EUR} and rating_sp >= A- and maturity before 2030:"
+                  ).grid(row=2, column=0, sticky=tk.W, pady=(0, 5))
+        self.rule_text = tk.Text(main_frame, height=5, wrap=tk.WORD)
+        self.rule_text.grid(row=3, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        ttk.Label(main_frame, text="Fields: " + ", ".join(RULE_FIELDS), wraplength=560,
+                  foreground="gray").grid(row=4, column=0, sticky=tk.W, pady=(5, 0))
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=5, column=0, sticky=tk.E, pady=(10, 0))
+        ttk.Button(button_frame, text="Close", command=self.dialog.destroy).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(button_frame, text="Delete", command=self.delete_rule).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(button_frame, text="Save", command=self.save_rule).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(button_frame, text="Apply", command=self.apply_rule).pack(side=tk.RIGHT)
+
+    def load_rule(self):
+        """Подставляет текст выбранного сохраненного правила"""
+        text = self.store.get_rule(self.name_var.get())
+        if text is not None:
+            self.rule_text.delete("1.0", tk.END)
+            self.rule_text.insert("1.0", text)
+
+    def parse_rule(self):
+        """Разбирает введенное правило; при ошибке показывает сообщение"""
+        text = self.rule_text.get("1.0", tk.END).strip()
+        if not text:
+            messagebox.showerror("Error", "Rule is empty", parent=self.dialog)
+            return None
+        try:
+            return SelectionRule(text)
+        except RuleError as e:
+            messagebox.showerror("Error", f"Invalid rule: {str(e)}", parent=self.dialog)
+            return None
+
+    def save_rule(self):
+        """Сохраняет правило под введенным именем"""
+        name = self.name_var.get().strip()
+        if not name:
+            messagebox.showerror("Error", "Enter a rule name", parent=self.dialog)
+            return
+        rule = self.parse_rule()
+        if rule is None:
+            return
+        try:
+            self.store.save_rule(name, rule.text)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save rule: {str(e)}", parent=self.dialog)
+
+    def delete_rule(self):
+        """Удаляет сохраненное правило"""
+        self.store.delete_rule(self.name_var.get().strip())
+        self.name_var.set("")
+
+    def apply_rule(self):
+        """Применяет правило ко всем листам открытого файла"""
+        rule = self.parse_rule()
+        if rule is not None:
+            self.dialog.destroy()
+            self.on_apply(rule)
+
+# Сколько строк сверх видимых держать в Treeview в виртуальном режиме
+VIRTUAL_BUFFER = 20
+# Высота строки Treeview по умолчанию, если стиль ее не задает
+DEFAULT_ROW_HEIGHT = 20
+# Период опроса очереди фоновой загрузки, мс
+LOAD_POLL_MS = 50
+# Период опроса очереди завершенных замеров для строки состояния, мс
+SPAN_POLL_MS = 200
+# Задержка поиска после ввода символа, мс
+SEARCH_DELAY_MS = 150
+
+
+def sheet_columns(df):
+    """Имена столбцов Treeview из 2-й и 3-й строк листа, начиная с 3-го столбца"""
+    # Используем 2-ю и 3-ю строки как заголовки, начиная с 3-го столбца
+    if len(df) >= 3:
+        # Объединяем заголовки из 2-й и 3-й строк, начиная с 3-го столбца
+        columns = []
+        for i in range(2, len(df.columns)):  # Начинаем с 3-го столбца (индекс 2)
+            header1 = str(df.iloc[1, i]) if len(df) > 1 and pd.notna(df.iloc[1, i]) else ""
+            header2 = str(df.iloc[2, i]) if len(df) > 2 and pd.notna(df.iloc[2, i]) else ""
+                
+            # Объединяем заголовки через пробел, если оба не пустые
+            if header1 and header2:
+                column_name = f"{header1} {header2}"
+            else:
+                column_name = header1 or header2 or f"Column {i+1}"
+                
+            columns.append(column_name)
+    else:
+        # Если недостаточно строк, используем обычные заголовки, начиная с 3-го столбца
+        columns = list(df.columns[2:])
+    return columns
+
+
+def build_row_store(df):
+    """
+    Строковое представление листа для виртуальной таблицы
+
+    Значения переводятся в строки один раз для всего столбца, поэтому
+    прокрутка не трогает DataFrame.
+
+    Returns:
+        Tuple[List[np.ndarray], np.ndarray, List[int]]: (столбцы строк,
+            номера строк Excel, максимальные длины столбцов)
+    """
+    # Отображаем данные начиная с 5-й строки (индекс 4) и с 3-го столбца (индекс 2)
+    start_row = 3 if len(df) >= 4 else 0
+    block = df.iloc[start_row:, 2:]
+    columns = []
+    for col_idx in range(block.shape[1]):
+        column = block.iloc[:, col_idx]
+        values = column.astype(str).to_numpy(dtype=object)
+        values[column.isna().to_numpy()] = ""
+        columns.append(values)
+    row_numbers = np.arange(start_row, len(df)) + 2
+    column_lengths = [max_string_length(values) for values in columns]
+    return columns, row_numbers, column_lengths
+
+
+class GroupView:
+    """
+    Сворачиваемые группы листа для виртуальной таблицы
+
+    Разметка берется из sheet_group_index: строка группы - родитель,
+    строки после нее до следующей группы - дочерние, строки до первой
+    группы показываются всегда. Позиции - индексы строк в build_row_store.
+    Строки свернутых групп не попадают в visible, поэтому в Treeview они
+    вставляются только после разворачивания группы.
+    """
+
+    def __init__(self, index: GroupIndex, start_row: int, total: int):
+        self.group_positions = index.group_positions - start_row
+        self.titles = index.titles
+        # Номер группы для каждой позиции (-1 - до первой группы)
+        self.row_groups = index.group_of(np.arange(start_row, start_row + total))
+        self.is_group = np.zeros(total, dtype=bool)
+        self.is_group[self.group_positions] = True
+        # Строки Excel с ISIN; номера групп в isin_groups не убывают
+        self.isin_rows = index.isin_positions + DATA_ROW_OFFSET
+        self.isin_groups = index.isin_groups
+        self.expanded = np.zeros(len(self.group_positions), dtype=bool)
+        self.visible = self._visible()
+
+    def _visible(self) -> np.ndarray:
+        show = self.is_group | (self.row_groups < 0)
+        if self.expanded.any():
+            show |= (self.row_groups >= 0) & self.expanded[np.maximum(self.row_groups, 0)]
+        return np.flatnonzero(show)
+
+    def set_expanded(self, group: int, expanded: bool):
+        """Разворачивает или сворачивает группу"""
+        if self.expanded[group] != expanded:
+            self.expanded[group] = expanded
+            self.visible = self._visible()
+
+    def set_all(self, expanded: bool):
+        """Разворачивает или сворачивает все группы"""
+        self.expanded[:] = expanded
+        self.visible = self._visible()
+
+    def reveal(self, pos: int):
+        """Разворачивает группу, в которой находится строка, если она свернута"""
+        group = int(self.row_groups[pos])
+        if group >= 0 and not self.is_group[pos]:
+            self.set_expanded(group, True)
+
+    def members(self, group: int) -> np.ndarray:
+        """Строки Excel с ISIN группы"""
+        lo, hi = np.searchsorted(self.isin_groups, [group, group + 1])
+        return self.isin_rows[lo:hi]
+
+
+def group_item_id(sheet_name, row_idx):
+    """iid строки группы; не разбирается как номер строки в update_selected_rows"""
+    return f"{sheet_name}_group{row_idx}"
+
+
 # Остальной код класса ExcelAppGUI остается без изменений...
 class ExcelAppGUI:
+    """
+    Главное окно приложения
+
+    on_file_load(file_path) выполняется в фоновом потоке и должен возвращать
+    отображение {имя листа: DataFrame}, например LazySheetData, которое
+    разбирает листы при обращении.
+    """
+
     def __init__(self, root, on_file_load, on_open_settings):
         self.root = root
         self.root.title("Light App")
@@ -187,10 +425,42 @@ class ExcelAppGUI:
         self.sheet_data = {}
         self.current_sheet = None
         self.selected_rows = {}
+        # Выделения ранее открытых за сеанс файлов для объединения {путь: {лист: строки}}
+        self.file_selections = {}
+
+        # Виртуальная таблица: строковые колонки листа и номера строк Excel
+        self.row_stores = OrderedDict()
+        self.view_offset = 0
+        # Сворачиваемые группы листов файла {лист: GroupView}, состояние сохраняется при переключении листов
+        self.group_views = {}
+        self.groups_expanded = False
+
+        # Фоновая загрузка: очередь сообщений от потока и флаг отмены
+        self.load_queue = None
+        self.load_cancel = None
+        # Очередь фоновой задачи правила выбора (пока правило вычисляется)
+        self.rule_queue = None
+        self.parsed_sheets = 0
+        self.parsed_rows = 0
+
+        # Поиск: листы индексируются в фоне по мере загрузки
+        self.search_index = None
+        self.search_cancel = None
+        self.search_workers = []
+        self.search_all_queued = False
+        self.search_hits = []
+        self.search_pos = -1
+        self.search_after_id = None
+        self.pending_jump = None
+
+        # Замеры приходят из любого потока, в строку состояния попадают через очередь
+        self.span_queue = queue.Queue()
+        default_instrumentation.add_listener(self.span_queue.put)
 
         self.create_widgets()
         self.sheet_listbox.insert(tk.END, "No file loaded")
         self.sheet_listbox.config(state=tk.DISABLED)
+        self.root.after(SPAN_POLL_MS, self.poll_span_queue)
 
     def get_selected_rows(self):
         """Возвращает словарь с выделенными строками"""
@@ -204,6 +474,13 @@ class ExcelAppGUI:
         """Возвращает путь к текущему файлу"""
         return self.current_file_path
 
+    def get_file_selections(self):
+        """Выделенные строки всех открытых за сеанс файлов с непустым выделением"""
+        selections = {path: rows for path, rows in self.file_selections.items() if any(rows.values())}
+        if self.current_file_path and any(self.selected_rows.values()):
+            selections[self.current_file_path] = self.selected_rows
+        return selections
+
     def create_widgets(self):
         # Main frame
         main_frame = ttk.Frame(self.root, padding="10")
@@ -213,7 +490,7 @@ class ExcelAppGUI:
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(1, weight=1)
+        main_frame.rowconfigure(2, weight=1)
         
         # Toolbar
         toolbar = ttk.Frame(main_frame)
@@ -226,10 +503,44 @@ class ExcelAppGUI:
         # Settings button
         settings_btn = ttk.Button(toolbar, text="Settings", command=self.open_settings)
         settings_btn.pack(side=tk.LEFT)
+
+        # Selection rules button
+        rules_btn = ttk.Button(toolbar, text="Rules", command=self.open_rules)
+        rules_btn.pack(side=tk.LEFT, padx=(5, 0))
+
+        # Memory report button
+        memory_btn = ttk.Button(toolbar, text="Memory", command=self.show_memory_report)
+        memory_btn.pack(side=tk.LEFT, padx=(5, 0))
+
+        # Expand/collapse all groups button
+        self.groups_btn = ttk.Button(toolbar, text="Expand All", command=self.toggle_all_groups)
+        self.groups_btn.pack(side=tk.LEFT, padx=(5, 0))
+
+        # Cancel loading button
+        self.cancel_btn = ttk.Button(toolbar, text="Cancel", command=self.cancel_loading, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=(5, 0))
+
+        # Search bar: отдельная строка, чтобы в панели инструментов хватало
+        # места для Process и Merge Files, которые добавляет main.py
+        search_bar = ttk.Frame(main_frame)
+        search_bar.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        ttk.Label(search_bar, text="Search:").pack(side=tk.LEFT, padx=(0, 5))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.schedule_search())
+        search_entry = ttk.Entry(search_bar, textvariable=self.search_var, width=24)
+        search_entry.pack(side=tk.LEFT)
+        search_entry.bind('<Return>', lambda e: self.next_search_hit())
+        self.search_contains_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_bar, text="Contains", variable=self.search_contains_var,
+                        command=self.schedule_search).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(search_bar, text="Next", command=self.next_search_hit).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(search_bar, text="Select Hits", command=self.select_search_hits).pack(side=tk.LEFT, padx=(5, 0))
+        self.search_count_var = tk.StringVar()
+        ttk.Label(search_bar, textvariable=self.search_count_var).pack(side=tk.LEFT, padx=(5, 0))
         
         # Sheet selection frame
         sheet_frame = ttk.Frame(main_frame)
-        sheet_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10), padx=(0, 10))
+        sheet_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10), padx=(0, 10))
         sheet_frame.columnconfigure(0, weight=1)
         sheet_frame.rowconfigure(1, weight=1)
 
@@ -253,28 +564,46 @@ class ExcelAppGUI:
         
         # Table frame
         table_frame = ttk.Frame(main_frame)
-        table_frame.grid(row=1, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        table_frame.grid(row=2, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         table_frame.columnconfigure(0, weight=1)
         table_frame.rowconfigure(0, weight=1)
         
         # Create treeview with scrollbars - ТОЛЬКО ОДИН БИНДИНГ
-        self.tree = ttk.Treeview(table_frame, show='headings', selectmode='extended')
+        self.tree = ttk.Treeview(table_frame, show='tree headings', selectmode='extended')
         self.tree.bind('<Button-1>', self.on_tree_click)  # ← ТОЛЬКО ЭТОТ
+        # Колонка дерева только для значка группы, название группы - в колонке C
+        self.tree.column("#0", width=28, minwidth=28, stretch=False)
+        self.tree.tag_configure("group", background="#E0E0E0")
+        # Разворачивание с клавиатуры (клик по значку обрабатывает on_tree_click)
+        self.tree.bind('<<TreeviewOpen>>', lambda e: self.on_group_toggle(True))
+        self.tree.bind('<<TreeviewClose>>', lambda e: self.on_group_toggle(False))
 
-        v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        # Вертикальная прокрутка виртуальная: двигаем окно строк, а не Treeview
+        self.v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.on_virtual_scroll)
         h_scrollbar = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
         
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        self.tree.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.tree.bind('<Button-4>', self.on_mouse_wheel)
+        self.tree.bind('<Button-5>', self.on_mouse_wheel)
+        self.tree.bind('<Configure>', lambda e: self.render_window())
         
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
         h_scrollbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
         
         # Status bar
+        status_frame = ttk.Frame(self.root)
+        status_frame.grid(row=1, column=0, sticky=(tk.W, tk.E))
         self.status_var = tk.StringVar()
         self.status_var.set("Ready - Select a file to begin")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # Время и память последней операции
+        self.timing_var = tk.StringVar()
+        timing_bar = ttk.Label(status_frame, textvariable=self.timing_var, relief=tk.SUNKEN, anchor=tk.E)
+        timing_bar.pack(side=tk.RIGHT)
     
     def open_file_dialog_handler(self):
         file_path = filedialog.askopenfilename(
@@ -286,88 +615,474 @@ class ExcelAppGUI:
             self.load_excel_file(file_path)
     
     def load_excel_file(self, file_path):
+        """Открывает файл: в фоне читается только список листов"""
+        self.run_in_background(lambda: self.on_file_load(file_path),
+                               lambda sheet_data: self.on_file_opened(file_path, sheet_data),
+                               "Loading file...")
+
+    def on_file_opened(self, file_path, sheet_data):
+        """Список листов прочитан: заполняем список и показываем первый лист"""
+        if not sheet_data:
+            messagebox.showerror("Error", "Failed to load Excel file or file is empty")
+            self.status_var.set("Error loading file")
+            return
+
+        if hasattr(self.sheet_data, "close"):
+            self.sheet_data.close()
+        # Выделение предыдущего файла сохраняется для объединения
+        if self.current_file_path:
+            self.file_selections[self.current_file_path] = self.selected_rows
+        self.current_file_path = file_path
+        self.selected_rows = self.file_selections.pop(file_path, {})
+        self.sheet_data = sheet_data
+        self.row_stores = OrderedDict()
+        self.group_views = {}
+        self.parsed_sheets = 0
+        self.parsed_rows = 0
+
+        self.sheet_listbox.config(state=tk.NORMAL)
+        self.sheet_listbox.delete(0, tk.END)
+        for sheet_name in sheet_data.keys():
+            self.sheet_listbox.insert(tk.END, sheet_name)
+
+        self.sheet_listbox.selection_set(0)
+        self.show_sheet(next(iter(sheet_data)))
+        self.start_search_index(sheet_data)
+
+    def show_sheet(self, sheet_name):
+        """Показывает лист; неразобранный лист сначала загружается в фоне"""
+        is_loaded = getattr(self.sheet_data, "is_loaded", None)
+        if is_loaded is None or is_loaded(sheet_name):
+            self.display_sheet(sheet_name)
+            return
+        if self.is_applying_rule():
+            # Загрузка листа отменила бы вычисление правила и его выделение
+            self.pending_jump = None
+            self.select_sheet_in_list(self.current_sheet)
+            self.status_var.set("Applying selection rule... switch sheets when it finishes")
+            return
+
+        info = self.sheet_data.info(sheet_name)
+        size = f" ({info.rows} rows)" if info.rows is not None else ""
+        self.run_in_background(lambda: self.sheet_data[sheet_name],
+                               lambda df: self.on_sheet_parsed(sheet_name, df),
+                               f"Loading sheet {sheet_name}{size}...",
+                               error_title="Failed to load sheet")
+
+    def on_sheet_parsed(self, sheet_name, df):
+        """Лист разобран в фоне"""
+        self.parsed_sheets += 1
+        self.parsed_rows += len(df)
+        self.display_sheet(sheet_name)
+        self.index_sheets([sheet_name], lambda _: df)
+        self.status_var.set(f"Loaded: {self.current_file_path} - {sheet_name}, "
+                            f"{self.parsed_sheets}/{len(self.sheet_data)} sheets parsed, "
+                            f"{self.parsed_rows} rows read")
+
+    def run_in_background(self, task, on_result, message, error_title="Failed to load file",
+                          cancelled_message="Loading cancelled"):
+        """
+        Выполняет task в фоновом потоке, on_result вызывается в потоке Tk
+
+        Одновременно выполняется одна задача; новая задача отменяет ожидание
+        предыдущей, результат отмененной задачи отбрасывается. error_title и
+        cancelled_message - текст ошибки и отмены этой задачи.
+        """
+        if self.load_cancel is not None:
+            self.load_cancel.set()
+
+        self.status_var.set(message)
+        self.load_queue = queue.Queue()
+        self.load_cancel = threading.Event()
+        self.cancel_btn.config(state=tk.NORMAL)
+
+        worker = threading.Thread(target=self.background_worker,
+                                  args=(task, self.load_queue),
+                                  daemon=True)
+        worker.start()
+        self.root.after(LOAD_POLL_MS, self.poll_load_queue, self.load_queue, self.load_cancel, on_result,
+                        error_title, cancelled_message)
+
+    def background_worker(self, task, load_queue):
+        """Фоновый поток: выполняет задачу и передает результат через очередь"""
         try:
-            self.status_var.set("Loading file...")
-            self.root.update()
-            
-            sheet_data = self.on_file_load(file_path)
-            
-            if not sheet_data:
-                messagebox.showerror("Error", "Failed to load Excel file or file is empty")
-                return
-            
-            self.current_file_path = file_path
-            self.sheet_data = sheet_data
-            
-            self.sheet_listbox.config(state=tk.NORMAL)
-            self.sheet_listbox.delete(0, tk.END)
-            for sheet_name in sheet_data.keys():
-                self.sheet_listbox.insert(tk.END, sheet_name)
-            
-            if self.sheet_listbox.size() > 0:
-                self.sheet_listbox.selection_set(0)
-                self.display_sheet(list(sheet_data.keys())[0])
-            
-            self.status_var.set(f"Loaded: {file_path}")
-        
+            load_queue.put(("done", task()))
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to load file: {str(e)}")
-            self.status_var.set("Error loading file")
+            load_queue.put(("error", e))
+
+    def poll_load_queue(self, load_queue, load_cancel, on_result, error_title, cancelled_message):
+        """Забирает результат фоновой задачи в главном потоке Tk"""
+        if load_queue is not self.load_queue:
+            return  # Задача была заменена более новой
+
+        try:
+            kind, payload = load_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(LOAD_POLL_MS, self.poll_load_queue, load_queue, load_cancel, on_result,
+                            error_title, cancelled_message)
+            return
+
+        self.load_queue = None
+        self.load_cancel = None
+        self.cancel_btn.config(state=tk.DISABLED)
+
+        if load_cancel.is_set():
+            self.status_var.set(cancelled_message)
+        elif kind == "error":
+            messagebox.showerror("Error", f"{error_title}: {str(payload)}")
+            self.status_var.set(error_title)
+        else:
+            on_result(payload)
+
+    def cancel_loading(self):
+        """Отменяет фоновую загрузку: ее результат будет отброшен"""
+        if self.load_cancel is not None:
+            self.load_cancel.set()
+            self.status_var.set("Cancelling...")
+
+    def is_applying_rule(self):
+        """Вычисляется ли правило выбора в фоне"""
+        return self.load_queue is not None and self.load_queue is self.rule_queue
+
+    def is_loading(self):
+        """Идет ли фоновая загрузка файла"""
+        return self.load_queue is not None
+
+    def start_search_index(self, sheet_data):
+        """
+        Запускает индексирование листов файла в фоновом потоке
+
+        Сразу индексируются только листы, которые уже есть в памяти или в
+        дисковом кэше: разбор всей книги держал бы блокировку LazySheetData
+        и задерживал показ листов. Остальные листы индексируются после
+        загрузки для показа или при первом поиске.
+        """
+        if self.search_cancel is not None:
+            self.search_cancel.set()
+        self.search_index = SearchIndex(sheet_data.keys())
+        self.search_cancel = threading.Event()
+        self.search_workers = []
+        self.search_all_queued = False
+        self.search_hits = []
+        self.search_pos = -1
+        self.index_sheets(list(sheet_data.keys()), getattr(sheet_data, "peek", sheet_data.get))
+
+    def index_sheets(self, sheet_names, read_sheet):
+        """
+        Индексирует листы в фоновом потоке
+
+        Args:
+            sheet_names: Имена листов; уже проиндексированные пропускаются
+            read_sheet: Функция имя листа -> DataFrame или None (лист пропускается)
+        """
+        polling = self.is_indexing()
+        worker = threading.Thread(target=self.build_search_index,
+                                  args=(sheet_names, read_sheet, self.search_index, self.search_cancel),
+                                  daemon=True)
+        self.search_workers.append(worker)
+        worker.start()
+        if not polling:
+            self.root.after(SPAN_POLL_MS, self.poll_search_index, self.search_index)
+
+    def is_indexing(self):
+        """Идет ли индексирование листов"""
+        self.search_workers = [worker for worker in self.search_workers if worker.is_alive()]
+        return bool(self.search_workers)
+
+    def build_search_index(self, sheet_names, read_sheet, search_index, search_cancel):
+        """Фоновый поток: индексирует листы по одному"""
+        with span("search_index", sheets=len(sheet_names)) as index_span:
+            rows = 0
+            for sheet_name in sheet_names:
+                if search_cancel.is_set():
+                    return
+                if search_index.has_sheet(sheet_name):
+                    continue
+                try:
+                    df = read_sheet(sheet_name)
+                    if df is None:
+                        continue
+                    search_index.add_sheet(sheet_name, df)
+                    rows += len(df)
+                except Exception as e:
+                    print(f"Failed to index sheet {sheet_name}: {e}")
+            index_span.rows = rows
+
+    def poll_search_index(self, search_index):
+        """Обновляет результаты поиска, когда индексирование закончено"""
+        if search_index is not self.search_index:
+            return  # Открыт другой файл
+        if self.is_indexing():
+            self.update_search_count()
+            self.root.after(SPAN_POLL_MS, self.poll_search_index, search_index)
+            return
+        if self.search_var.get().strip():
+            self.run_search(jump=not self.search_hits)
+        else:
+            self.update_search_count()
+
+    def schedule_search(self):
+        """Поиск по мере ввода: запускается после паузы в наборе"""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self, jump=True):
+        """Ищет запрос в индексе и переходит к первой найденной строке"""
+        self.search_after_id = None
+        query = self.search_var.get()
+        if self.search_index is None or not query.strip():
+            self.search_hits = []
+        else:
+            if not self.search_all_queued and not self.search_index.is_complete():
+                # Первый поиск: в фоне разбираются и индексируются остальные листы
+                self.search_all_queued = True
+                self.index_sheets(self.search_index.sheet_names, self.sheet_data.__getitem__)
+            with span("search", query=query) as search_span:
+                self.search_hits = self.search_index.search(query, self.search_contains_var.get())
+                search_span.rows = len(self.search_hits)
+        self.search_pos = -1
+        self.update_search_count()
+        if jump and self.search_hits:
+            self.next_search_hit()
+
+    def update_search_count(self):
+        """Количество найденных строк и состояние индекса"""
+        text = ""
+        if self.search_var.get().strip():
+            position = f"{self.search_pos + 1}/" if self.search_pos >= 0 else ""
+            text = f"{position}{len(self.search_hits)} hits"
+        if self.search_index is not None and self.is_indexing():
+            indexed = len(self.search_index.sheets)
+            text = f"{text} (indexing {indexed}/{len(self.search_index.sheet_names)})".strip()
+        self.search_count_var.set(text)
+
+    def next_search_hit(self):
+        """Переходит к следующей найденной строке"""
+        if not self.search_hits:
+            return
+        self.search_pos = (self.search_pos + 1) % len(self.search_hits)
+        self.update_search_count()
+        sheet_name, row_idx = self.search_hits[self.search_pos]
+        self.jump_to_row(sheet_name, row_idx)
+
+    def jump_to_row(self, sheet_name, row_idx):
+        """Показывает строку Excel row_idx листа, при необходимости переключая лист"""
+        if sheet_name == self.current_sheet:
+            self.scroll_to_row(row_idx)
+            return
+        self.update_selected_rows()
+        self.select_sheet_in_list(sheet_name)
+        # Лист может разбираться в фоне: переход выполнит display_sheet
+        self.pending_jump = (sheet_name, row_idx)
+        self.show_sheet(sheet_name)
+
+    def select_sheet_in_list(self, sheet_name):
+        """Выделяет лист в списке листов"""
+        names = list(self.sheet_data.keys())
+        if sheet_name in names:
+            self.sheet_listbox.selection_clear(0, tk.END)
+            self.sheet_listbox.selection_set(names.index(sheet_name))
+            self.sheet_listbox.see(names.index(sheet_name))
+
+    def scroll_to_row(self, row_idx):
+        """Прокручивает виртуальную таблицу к строке Excel и ставит на нее фокус"""
+        _, row_numbers, _ = self.get_row_store(self.current_sheet)
+        pos = int(np.searchsorted(row_numbers, row_idx))
+        if pos >= len(row_numbers) or row_numbers[pos] != row_idx:
+            return
+        # Строка в свернутой группе: группа разворачивается
+        view = self.get_group_view(self.current_sheet)
+        view.reveal(pos)
+        visible_pos = int(np.searchsorted(view.visible, pos))
+        self.view_offset = max(0, visible_pos - self.visible_row_count() // 2)
+        self.render_window()
+        item_id = f"{self.current_sheet}_{row_idx}"
+        if self.tree.exists(item_id):
+            self.tree.focus(item_id)
+            self.tree.see(item_id)
+
+    def select_search_hits(self):
+        """Добавляет все найденные строки в выделение"""
+        if not self.search_hits:
+            return
+        self.update_selected_rows()
+        by_sheet = {}
+        for sheet_name, row_idx in self.search_hits:
+            by_sheet.setdefault(sheet_name, set()).add(row_idx)
+        for sheet_name, rows in by_sheet.items():
+            self.selected_rows[sheet_name] = sorted(set(self.selected_rows.get(sheet_name, [])) | rows)
+        self.render_window()
+        self.status_var.set(f"Added {len(self.search_hits)} search hits to the selection")
+
+    def poll_span_queue(self):
+        """Показывает в строке состояния последний завершенный замер"""
+        last = None
+        while True:
+            try:
+                last = self.span_queue.get_nowait()
+            except queue.Empty:
+                break
+        if last is not None:
+            self.timing_var.set(format_span(last))
+        self.root.after(SPAN_POLL_MS, self.poll_span_queue)
 
     def display_sheet(self, sheet_name):
-        self.current_sheet = sheet_name
         df = self.sheet_data[sheet_name]
+        with span("display_sheet", rows=len(df), sheet=sheet_name):
+            self.current_sheet = sheet_name
+
+            for item in self.tree.get_children():
+                self.tree.delete(item)
         
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Используем 2-ю и 3-ю строки как заголовки, начиная с 3-го столбца
-        if len(df) >= 3:
-            # Объединяем заголовки из 2-й и 3-й строк, начиная с 3-го столбца
-            columns = []
-            for i in range(2, len(df.columns)):  # Начинаем с 3-го столбца (индекс 2)
-                header1 = str(df.iloc[1, i]) if len(df) > 1 and pd.notna(df.iloc[1, i]) else ""
-                header2 = str(df.iloc[2, i]) if len(df) > 2 and pd.notna(df.iloc[2, i]) else ""
-                
-                # Объединяем заголовки через пробел, если оба не пустые
-                if header1 and header2:
-                    column_name = f"{header1} {header2}"
-                else:
-                    column_name = header1 or header2 or f"Column {i+1}"
-                
-                columns.append(column_name)
-        else:
-            # Если недостаточно строк, используем обычные заголовки, начиная с 3-го столбца
-            columns = list(df.columns[2:])
+            columns = sheet_columns(df)
         
-        self.tree["columns"] = columns
+            self.tree["columns"] = columns
         
-        max_lengths = {}
-        for col_idx, col_name in enumerate(columns):
-            # Вычисляем максимальную длину для каждого столбца, начиная с 5-й строки
-            if len(df) >= 5:
-                max_len = df.iloc[3:, col_idx + 2].astype(str).apply(len).max()  # +2 для смещения к 3-му столбцу
-                max_lengths[col_name] = max(max_len, len(col_name)) if not pd.isna(max_len) else len(col_name)
-            else:
-                max_lengths[col_name] = len(col_name)
-
-        for col in columns:
-            self.tree.heading(col, text=col)
-            col_width = max(max_lengths.get(col, 10) * 8, len(col) * 8)
-            self.tree.column(col, width=col_width, minwidth=col_width)
-        
-        # Отображаем данные начиная с 5-й строки (индекс 4) и с 3-го столбца (индекс 2)
-        start_row = 3 if len(df) >= 4 else 0
-        for i in range(start_row, len(df)):
-            values = [str(df.iloc[i, col_idx + 2]) if pd.notna(df.iloc[i, col_idx + 2]) else "" for col_idx in range(len(columns))]
-            item_id = f"{sheet_name}_{i + 2}"
-            self.tree.insert("", "end", values=values, iid=item_id)
-
-        if sheet_name in self.selected_rows and self.selected_rows[sheet_name]:
-            for row_idx in self.selected_rows[sheet_name]:
-                item_id = f"{sheet_name}_{row_idx}"
-                if self.tree.exists(item_id):
-                    self.tree.selection_add(item_id)
+            # Максимальные длины столбцов, начиная с 5-й строки, считаются один раз для листа
+            with span("row_store"):
+                _, _, column_lengths = self.get_row_store(sheet_name)
+            max_lengths = {}
+            for col_idx, col_name in enumerate(columns):
+                if len(df) >= 5 and col_idx < len(column_lengths):
+                    max_lengths[col_name] = max(column_lengths[col_idx], len(col_name))
+                else:
+                    max_lengths[col_name] = len(col_name)
+
+            for col in columns:
+                self.tree.heading(col, text=col)
+                col_width = max(max_lengths.get(col, 10) * 8, len(col) * 8)
+                self.tree.column(col, width=col_width, minwidth=col_width)
+        
+            self.view_offset = 0
+            with span("render"):
+                self.render_window()
+
+        # Переход к найденной строке, если лист выбран поиском
+        if self.pending_jump is not None and self.pending_jump[0] == sheet_name:
+            row_idx = self.pending_jump[1]
+            self.pending_jump = None
+            self.scroll_to_row(row_idx)
+
+    def get_row_store(self, sheet_name):
+        """
+        Возвращает строковое представление листа (build_row_store) из кэша
+
+        Кэш ограничен, поэтому переключение между недавними листами не
+        пересчитывает строки.
+        """
+        if sheet_name in self.row_stores:
+            self.row_stores.move_to_end(sheet_name)
+        else:
+            self.row_stores[sheet_name] = build_row_store(self.sheet_data[sheet_name])
+            # Храним строки не больше листов, чем держит кэш разобранных листов
+            while len(self.row_stores) > SHEET_CACHE_SIZE:
+                self.row_stores.popitem(last=False)
+        return self.row_stores[sheet_name]
+
+    def get_group_view(self, sheet_name):
+        """Сворачиваемые группы листа (GroupView), создаются при первом показе листа"""
+        if sheet_name not in self.group_views:
+            _, row_numbers, _ = self.get_row_store(sheet_name)
+            start_row = int(row_numbers[0]) - DATA_ROW_OFFSET if len(row_numbers) else 0
+            view = GroupView(sheet_group_index(self.sheet_data[sheet_name]), start_row, len(row_numbers))
+            view.set_all(self.groups_expanded)
+            self.group_views[sheet_name] = view
+        return self.group_views[sheet_name]
+
+    def visible_row_count(self):
+        """Количество строк, которое помещается в Treeview"""
+        row_height = ttk.Style().lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT
+        height = self.tree.winfo_height()
+        if height <= 1:
+            # Окно еще не отрисовано
+            return 40
+        return max(1, (height - DEFAULT_ROW_HEIGHT) // int(row_height))
+
+    def render_window(self):
+        """Материализует в Treeview только видимые строки и небольшой запас"""
+        if not self.current_sheet or self.current_sheet not in self.sheet_data:
+            return
+        sheet_name = self.current_sheet
+        columns, row_numbers, _ = self.get_row_store(sheet_name)
+        # Окно двигается по строкам, которые видны с учетом свернутых групп
+        view = self.get_group_view(sheet_name)
+        visible_positions = view.visible
+        total = len(visible_positions)
+        visible = self.visible_row_count()
+
+        self.view_offset = max(0, min(self.view_offset, total - visible))
+        start = self.view_offset
+        end = min(start + visible + VIRTUAL_BUFFER, total)
+
+        self.tree.delete(*self.tree.get_children())
+        selected = set(self.selected_rows.get(sheet_name, []))
+        to_select = []
+        group_items = {}
+
+        def insert_group(group):
+            pos = int(view.group_positions[group])
+            item_id = group_item_id(sheet_name, int(row_numbers[pos]))
+            expanded = bool(view.expanded[group])
+            self.tree.insert("", "end", values=[column[pos] for column in columns], iid=item_id,
+                             open=expanded, tags=("group",))
+            if not expanded:
+                # Пустая дочерняя строка, чтобы Treeview показал значок разворачивания
+                self.tree.insert(item_id, "end", iid=f"{item_id}_stub")
+            members = view.members(group)
+            if len(members) and selected.issuperset(members.tolist()):
+                to_select.append(item_id)
+            group_items[group] = item_id
+
+        for pos in visible_positions[start:end].tolist():
+            group = int(view.row_groups[pos])
+            if view.is_group[pos]:
+                insert_group(group)
+                continue
+            parent = ""
+            if group >= 0:
+                # Строка группы может быть выше окна
+                if group not in group_items:
+                    insert_group(group)
+                parent = group_items[group]
+            row_idx = int(row_numbers[pos])
+            item_id = f"{sheet_name}_{row_idx}"
+            self.tree.insert(parent, "end", values=[column[pos] for column in columns], iid=item_id)
+            if row_idx in selected:
+                to_select.append(item_id)
+        self.tree.selection_set(to_select)
+
+        if total:
+            self.v_scrollbar.set(start / total, min(start + visible, total) / total)
+        else:
+            self.v_scrollbar.set(0, 1)
+
+    def scroll_to(self, offset):
+        """Сдвигает окно виртуальной таблицы к строке offset"""
+        if offset != self.view_offset:
+            self.view_offset = offset
+            self.render_window()
+
+    def on_virtual_scroll(self, *args):
+        """Обработчик вертикального скроллбара (moveto / scroll)"""
+        if not self.current_sheet:
+            return
+        total = len(self.get_group_view(self.current_sheet).visible)
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * total))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_row_count()
+            self.scroll_to(max(0, self.view_offset + step))
+
+    def on_mouse_wheel(self, event):
+        """Прокрутка колесом мыши в виртуальном режиме"""
+        if event.num == 4 or event.delta > 0:
+            self.on_virtual_scroll("scroll", -3, "units")
+        else:
+            self.on_virtual_scroll("scroll", 3, "units")
+        return "break"
 
     def on_tree_click(self, event):
         """Обрабатывает клик мыши для toggle выделения"""
@@ -377,6 +1092,14 @@ class ExcelAppGUI:
         item = self.tree.identify_row(event.y)
         if not item:
             return
+
+        group = self.group_of_item(item)
+        if group is not None:
+            if "indicator" in self.tree.identify_element(event.x, event.y):
+                self.set_group_expanded(group, not self.get_group_view(self.current_sheet).expanded[group])
+            else:
+                self.toggle_group_selection(group)
+            return "break"
         
         current_selection = set(self.tree.selection())
         
@@ -387,21 +1110,93 @@ class ExcelAppGUI:
         
         self.tree.selection_set(list(current_selection))
         self.update_selected_rows()
+        if self.tree.parent(item):
+            # Выделение строки группы зависит от выделения ее строк
+            self.render_window()
         
         return "break"
 
+    def group_of_item(self, item):
+        """Номер группы для строки группы Treeview или None"""
+        if not item.startswith(f"{self.current_sheet}_group") or item.endswith("_stub"):
+            return None
+        row_idx = int(item[len(f"{self.current_sheet}_group"):])
+        view = self.get_group_view(self.current_sheet)
+        _, row_numbers, _ = self.get_row_store(self.current_sheet)
+        pos = int(np.searchsorted(row_numbers, row_idx))
+        return int(view.row_groups[pos])
+
+    def set_group_expanded(self, group, expanded):
+        """Разворачивает или сворачивает группу текущего листа"""
+        self.update_selected_rows()
+        self.get_group_view(self.current_sheet).set_expanded(group, expanded)
+        self.render_window()
+
+    def on_group_toggle(self, expanded):
+        """Группа развернута или свернута с клавиатуры"""
+        item = self.tree.focus()
+        group = self.group_of_item(item) if item else None
+        if group is not None:
+            # Перерисовка после того, как Treeview закончит обработку события
+            self.root.after_idle(lambda: self.set_group_expanded(group, expanded))
+
+    def toggle_group_selection(self, group):
+        """Выделяет все строки группы или снимает выделение, если они уже выделены"""
+        self.update_selected_rows()
+        view = self.get_group_view(self.current_sheet)
+        members = set(view.members(group).tolist())
+        selected = set(self.selected_rows.get(self.current_sheet, []))
+        if members and members <= selected:
+            selected -= members
+            action = "Deselected"
+        else:
+            selected |= members
+            action = "Selected"
+        self.selected_rows[self.current_sheet] = sorted(selected)
+        self.render_window()
+        self.status_var.set(f"{action} {len(members)} rows in group {view.titles[group]}")
+
+    def toggle_all_groups(self):
+        """Разворачивает или сворачивает все группы всех листов файла"""
+        self.update_selected_rows()
+        self.groups_expanded = not self.groups_expanded
+        for view in self.group_views.values():
+            view.set_all(self.groups_expanded)
+        self.groups_btn.config(text="Collapse All" if self.groups_expanded else "Expand All")
+        self.render_window()
+
+    def tree_items(self):
+        """Все строки Treeview, включая строки внутри групп"""
+        items = []
+        for item in self.tree.get_children():
+            items.append(item)
+            items.extend(self.tree.get_children(item))
+        return items
+
     def update_selected_rows(self):
+        """
+        Переносит выделение Treeview в selected_rows
+
+        В Treeview есть только строки текущего окна, поэтому выделение
+        строк вне окна берется из уже сохраненного selected_rows.
+        """
         if not self.current_sheet:
             return
-        selected_items = self.tree.selection()
-        selected_indices = []
-        for item in selected_items:
+        materialized = set()
+        for item in self.tree_items():
+            try:
+                materialized.add(int(item.split('_')[-1]))
+            except (ValueError, IndexError):
+                continue
+        selected_indices = set()
+        for item in self.tree.selection():
             try:
                 row_idx = int(item.split('_')[-1])  # Без +2, реальный индекс
-                selected_indices.append(row_idx)
+                selected_indices.add(row_idx)
             except (ValueError, IndexError):
                 continue
-        self.selected_rows[self.current_sheet] = selected_indices
+        outside = set(self.selected_rows.get(self.current_sheet, [])) - materialized
+        self.selected_rows[self.current_sheet] = sorted(selected_indices | outside)
 
     def on_sheet_select(self, event):
         if not self.sheet_listbox.curselection():
@@ -410,7 +1205,48 @@ class ExcelAppGUI:
         self.update_selected_rows()
         selected_index = self.sheet_listbox.curselection()[0]
         sheet_name = self.sheet_listbox.get(selected_index)
-        self.display_sheet(sheet_name)
+        self.show_sheet(sheet_name)
+
+    def show_memory_report(self):
+        """Показывает память, занимаемую загруженными листами"""
+        if not self.sheet_data:
+            messagebox.showerror("Error", "No file loaded")
+            return
+        # У LazySheetData в памяти только уже разобранные листы
+        loaded = self.sheet_data.loaded() if hasattr(self.sheet_data, "loaded") else self.sheet_data
+        if not loaded:
+            messagebox.showinfo("Memory", "No sheets parsed yet")
+            return
+        messagebox.showinfo("Memory", format_memory_report(memory_report(loaded)))
+
+    def open_rules(self):
+        """Открыть диалоговое окно правил выбора"""
+        RulesDialog(self.root, self.apply_selection_rule).show()
+
+    def apply_selection_rule(self, rule):
+        """Заполняет selected_rows всех листов по правилу (листы разбираются в фоне)"""
+        if not self.sheet_data:
+            messagebox.showerror("Error", "No file loaded")
+            return
+        sheet_data = self.sheet_data
+
+        def task():
+            with span("selection_rule", rule=rule.text) as rule_span:
+                selected = rule.select(sheet_data)
+                rule_span.rows = sum(len(rows) for rows in selected.values())
+            return selected
+        self.run_in_background(task, self.on_rule_applied, "Applying selection rule...",
+                               error_title="Failed to apply selection rule",
+                               cancelled_message="Selection rule cancelled")
+        self.rule_queue = self.load_queue
+
+    def on_rule_applied(self, selected):
+        """Правило вычислено: выделение заменяется найденными строками"""
+        self.selected_rows = selected
+        self.render_window()
+        total = sum(len(rows) for rows in selected.values())
+        sheets = sum(1 for rows in selected.values() if rows)
+        self.status_var.set(f"Selected {total} rows in {sheets} sheets by rule")
 
     def open_settings(self):
         """Открыть диалоговое окно настроек"""
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sheet_cache import CACHE_DIR
+
+# Файл с известными раскладками заголовков
+LAYOUT_CACHE_PATH = os.path.join(CACHE_DIR, "header_layouts.json")
+
+
+class HeaderMatcher:
+    """
+    Сопоставление столбцов листа с позициями 1..25 по строкам заголовка 2/3
+
+    Таблица пар заголовков компилируется один раз. Для каждой раскладки
+    заголовков листа вычисляется отпечаток, и результат сопоставления
+    (столбец источника -> возможные позиции) запоминается в памяти и на
+    диске, поэтому файлы с известной раскладкой не проходят сопоставление
+    заново. Выбор столбцов (columns_to_keep) применяется к готовой карте.
+    """
+
+    def __init__(self, set_columns: Dict[Tuple[object, object], int],
+                 cache_path: Optional[str] = LAYOUT_CACHE_PATH):
+        self.lookup = dict(set_columns)
+        self.cache_path = cache_path
+        # Отпечаток таблицы: при ее изменении старые раскладки не используются
+        self.table_hash = hashlib.sha1(repr(sorted(map(repr, self.lookup.items()))).encode("utf-8")).hexdigest()
+        self.layouts: Dict[str, Dict[int, Tuple[int, ...]]] = {}
+        self._lock = threading.Lock()
+        self._load_layouts()
+
+    @staticmethod
+    def normalize(header_row2: Sequence[object], header_row3: Sequence[object]) -> List[Tuple[object, object]]:
+        """Пары заголовков для столбцов начиная с C; пустые ячейки -> "0" """
+        pairs = []
+        for title_column in range(3, len(header_row2) + 1):
+            value1 = header_row2[title_column - 1]
+            value2 = header_row3[title_column - 1] if title_column <= len(header_row3) else None
+            pairs.append((value1 if value1 is not None else "0",
+                          value2 if value2 is not None else "0"))
+        return pairs
+
+    def fingerprint(self, pairs: List[Tuple[object, object]]) -> str:
+        """Отпечаток раскладки заголовков листа"""
+        digest = hashlib.sha1(self.table_hash.encode("utf-8"))
+        digest.update(repr(pairs).encode("utf-8"))
+        return digest.hexdigest()
+
+    def resolve(self, pairs: List[Tuple[object, object]]) -> Dict[int, Tuple[int, ...]]:
+        """
+        Полное сопоставление раскладки без учета выбранных столбцов
+
+        Returns:
+            Dict[int, Tuple[int, ...]]: {столбец источника (с 1): позиции в порядке приоритета}
+        """
+        resolved = {}
+        for title_column, (value1, value2) in enumerate(pairs, start=3):
+            candidates = []
+            for title_to_check in ((value1, value2), (value1, "1")):
+                position = self.lookup.get(title_to_check)
+                if position is not None and position not in candidates:
+                    candidates.append(position)
+            if candidates:
+                resolved[title_column] = tuple(candidates)
+        return resolved
+
+    def layout(self, header_row2: Sequence[object], header_row3: Sequence[object]) -> Dict[int, Tuple[int, ...]]:
+        """Карта раскладки из кэша или после сопоставления"""
+        pairs = self.normalize(header_row2, header_row3)
+        key = self.fingerprint(pairs)
+        with self._lock:
+            resolved = self.layouts.get(key)
+        if resolved is None:
+            resolved = self.resolve(pairs)
+            with self._lock:
+                self.layouts[key] = resolved
+            self._save_layouts()
+        return resolved
+
+    def match(self, header_row2: Sequence[object], header_row3: Sequence[object],
+              columns_to_keep: List[int]) -> Dict[int, int]:
+        """
+        Сопоставляет столбцы листа с выбранными позициями
+
+        Args:
+            header_row2 (Sequence[object]): Значения 2-й строки, начиная со столбца A
+            header_row3 (Sequence[object]): Значения 3-й строки, начиная со столбца A
+            columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+
+        Returns:
+            Dict[int, int]: {номер столбца источника (с 1): позиция 1..25}
+        """
+        chosen = set(columns_to_keep)
+        dic_to_copy = {}
+        for source_col, candidates in self.layout(header_row2, header_row3).items():
+            for position in candidates:
+                if position in chosen:
+                    dic_to_copy[source_col] = position
+                    break
+        return dic_to_copy
+
+    def _load_layouts(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                stored = json.load(f)
+            for key, resolved in stored.items():
+                self.layouts[key] = {int(col): tuple(positions) for col, positions in resolved.items()}
+        except Exception as e:
+            print(f"Failed to read header layouts from {self.cache_path}: {e}")
+
+    def _save_layouts(self):
+        if not self.cache_path:
+            return
+        try:
+            with self._lock:
+                stored = {key: {str(col): list(positions) for col, positions in resolved.items()}
+                          for key, resolved in self.layouts.items()}
+            cache_dir = os.path.dirname(self.cache_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"Failed to save header layouts to {self.cache_path}: {e}")
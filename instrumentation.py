@@ -0,0 +1,260 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Переменные окружения, которыми инструментирование включается без изменения кода
+ENV_SPAN_LOG = "LIGHT_APP_SPAN_LOG"          # путь к журналу замеров (JSON lines)
+ENV_TRACE_MEMORY = "LIGHT_APP_TRACE_MEMORY"  # "1" - считать пик памяти через tracemalloc
+ENV_PROFILE_DIR = "LIGHT_APP_PROFILE_DIR"    # каталог для дампов cProfile
+
+
+class Span:
+    """
+    Замер одного этапа: время, количество строк и пик выделенной памяти
+
+    peak_bytes заполняется только при включенном учете памяти. Вложенные
+    этапы собираются в children.
+    """
+
+    def __init__(self, name: str, rows: Optional[int] = None, attrs: Optional[Dict[str, object]] = None):
+        self.name = name
+        self.rows = rows
+        self.attrs = attrs or {}
+        self.started = time.time()
+        self.wall_s = 0.0
+        self.peak_bytes: Optional[int] = None
+        self.children: List["Span"] = []
+        # Служебные значения tracemalloc на время выполнения этапа
+        self._start_memory = 0
+        self._max_memory = 0
+
+    def walk(self, path: str = "", depth: int = 0) -> Iterator[tuple]:
+        """Этап и все вложенные этапы в порядке выполнения: (путь, глубина, этап)"""
+        path = f"{path}/{self.name}" if path else self.name
+        yield path, depth, self
+        for child in self.children:
+            yield from child.walk(path, depth + 1)
+
+    def to_dict(self) -> Dict[str, object]:
+        """Поля этапа для журнала"""
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall_s, 4),
+            "rows": self.rows,
+            "peak_mb": round(self.peak_bytes / (1024 * 1024), 2) if self.peak_bytes is not None else None,
+            **self.attrs,
+        }
+
+
+def format_span(span: Span) -> str:
+    """
+    Короткое описание замера для строки состояния
+
+    Например: "excel_processing 1.20 s, 1500 rows, peak 35.1 MB
+    (extract 0.21 s, write_result 0.95 s)"
+    """
+    def describe(item: Span) -> str:
+        text = f"{item.name} {item.wall_s:.2f} s"
+        if item.rows is not None:
+            text += f", {item.rows} rows"
+        if item.peak_bytes is not None:
+            text += f", peak {item.peak_bytes / (1024 * 1024):.1f} MB"
+        return text
+
+    text = describe(span)
+    if span.children:
+        text += " (" + ", ".join(f"{child.name} {child.wall_s:.2f} s" for child in span.children) + ")"
+    return text
+
+
+class Instrumentation:
+    """
+    Именованные замеры этапов обработки
+
+    Этапы вкладываются друг в друга в пределах потока. Когда завершается
+    этап верхнего уровня, он со всеми вложенными этапами передается
+    слушателям (например, строке состояния GUI) и, если задан log_path,
+    дописывается в журнал по одной JSON-строке на этап.
+
+    Пик памяти считается через tracemalloc (trace_memory), что заметно
+    замедляет работу, поэтому учет включается отдельно. Счетчик tracemalloc
+    общий для процесса, так что при одновременных этапах в разных потоках
+    пик приблизительный. Если задан profile_dir, каждый этап верхнего
+    уровня выполняется под cProfile, а статистика сохраняется в .prof файл.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, trace_memory: bool = False,
+                 profile_dir: Optional[str] = None):
+        self.log_path = log_path
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.listeners: List[Callable[[Span], None]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # cProfile в процессе может быть включен только один раз
+        self._profiling = False
+
+    @classmethod
+    def from_env(cls) -> "Instrumentation":
+        """Настройки из переменных окружения LIGHT_APP_*"""
+        return cls(log_path=os.environ.get(ENV_SPAN_LOG) or None,
+                   trace_memory=os.environ.get(ENV_TRACE_MEMORY, "") not in ("", "0"),
+                   profile_dir=os.environ.get(ENV_PROFILE_DIR) or None)
+
+    def add_listener(self, listener: Callable[[Span], None]):
+        """Подписывает listener на завершенные этапы верхнего уровня (вызывается в потоке этапа)"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Span], None]):
+        """Отписывает listener"""
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self) -> Optional[Span]:
+        """Выполняющийся этап текущего потока"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, rows: Optional[int] = None, parent: Optional[Span] = None,
+             **attrs) -> Iterator[Span]:
+        """
+        Замер этапа
+
+        Args:
+            name (str): Имя этапа
+            rows (Optional[int]): Количество обработанных строк, если известно
+                заранее (можно задать позже через span.rows)
+            parent (Optional[Span]): Родительский этап для блока, выполняемого
+                в другом потоке (по умолчанию - текущий этап потока)
+            **attrs: Дополнительные поля для журнала (например, file)
+
+        Yields:
+            Span: Замер, заполняется после выхода из блока
+        """
+        stack = self._stack()
+        if parent is None:
+            parent = stack[-1] if stack else None
+        current = Span(name, rows, attrs)
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            memory, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent._max_memory = max(parent._max_memory, peak)
+            tracemalloc.reset_peak()
+            current._start_memory = current._max_memory = memory
+
+        profiler = self._start_profiler() if parent is None else None
+        stack.append(current)
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            current.wall_s = time.perf_counter() - start
+            stack.pop()
+            if profiler is not None:
+                self._stop_profiler(profiler, name)
+
+            if tracing and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                absolute = max(current._max_memory, peak)
+                current.peak_bytes = absolute - current._start_memory
+                if parent is not None:
+                    parent._max_memory = max(parent._max_memory, absolute)
+                tracemalloc.reset_peak()
+
+            if parent is not None:
+                parent.children.append(current)
+            else:
+                self._finish(current)
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        if not self.profile_dir:
+            return None
+        with self._lock:
+            if self._profiling:
+                return None
+            self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Уже работает другой профилировщик
+            with self._lock:
+                self._profiling = False
+            return None
+        return profiler
+
+    def _stop_profiler(self, profiler: cProfile.Profile, name: str):
+        profiler.disable()
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{stamp}-{os.getpid()}.prof"))
+        except Exception as e:
+            print(f"Failed to save profile for {name}: {e}")
+        finally:
+            with self._lock:
+                self._profiling = False
+
+    def _finish(self, span: Span):
+        """Этап верхнего уровня завершен: журнал и слушатели"""
+        if self.log_path:
+            self._write_log(span)
+        for listener in list(self.listeners):
+            try:
+                listener(span)
+            except Exception as e:
+                print(f"Span listener failed: {e}")
+
+    def _write_log(self, span: Span):
+        timestamp = datetime.fromtimestamp(span.started).isoformat(timespec="milliseconds")
+        lines = []
+        for path, depth, item in span.walk():
+            record = {"time": timestamp, "span": path, "depth": depth,
+                      "pid": os.getpid(), "thread": threading.current_thread().name}
+            record.update(item.to_dict())
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        try:
+            with self._lock:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            print(f"Failed to write span log {self.log_path}: {e}")
+
+
+# Инструментирование по умолчанию для GUI, пакетной обработки и модулей
+default_instrumentation = Instrumentation.from_env()
+
+
+def configure(log_path: Optional[str] = None, trace_memory: bool = False,
+              profile_dir: Optional[str] = None):
+    """
+    Настраивает default_instrumentation
+
+    Используется как initializer пула процессов, чтобы рабочие процессы
+    писали замеры в тот же журнал.
+    """
+    default_instrumentation.log_path = log_path
+    default_instrumentation.trace_memory = trace_memory
+    default_instrumentation.profile_dir = profile_dir
+
+
+def span(name: str, rows: Optional[int] = None, parent: Optional[Span] = None, **attrs):
+    """Замер этапа в default_instrumentation"""
+    return default_instrumentation.span(name, rows, parent, **attrs)
@@ -0,0 +1,189 @@
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from xml.etree import ElementTree
+
+import pandas as pd
+from openpyxl.utils import range_boundaries
+
+from compact_frames import compact_sheet
+from instrumentation import span
+from sheet_cache import SheetCache, default_cache
+
+# Сколько разобранных листов держать в памяти одновременно
+SHEET_CACHE_SIZE = 4
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Заголовок листа до <sheetData> обычно укладывается в несколько КБ
+DIMENSION_PROBE_BYTES = 64 * 1024
+DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\s+ref="([^"]+)"')
+
+
+class SheetInfo(NamedTuple):
+    """Метаданные листа без разбора ячеек"""
+    name: str
+    path: Optional[str]
+    rows: Optional[int]
+    columns: Optional[int]
+
+
+def _sheet_dimensions(archive: zipfile.ZipFile, path: str):
+    """Читает <dimension ref="A1:P300"> из начала XML листа"""
+    with archive.open(path) as f:
+        head = f.read(DIMENSION_PROBE_BYTES)
+    match = DIMENSION_RE.search(head)
+    if not match:
+        return None, None
+    try:
+        min_col, min_row, max_col, max_row = range_boundaries(match.group(1).decode())
+    except (ValueError, TypeError):
+        return None, None
+    if max_row is None or max_col is None:
+        return None, None
+    return max_row, max_col
+
+
+def read_sheet_index(file_path: str) -> List[SheetInfo]:
+    """
+    Читает список листов и их размеры из метаданных xlsx без разбора ячеек
+
+    Для файлов, которые не являются zip-архивом (.xls), размеры неизвестны,
+    а имена листов берутся через pandas.
+
+    Args:
+        file_path (str): Путь к Excel файлу
+
+    Returns:
+        List[SheetInfo]: Листы в порядке книги
+    """
+    if not zipfile.is_zipfile(file_path):
+        with pd.ExcelFile(file_path) as excel_file:
+            return [SheetInfo(name, None, None, None) for name in excel_file.sheet_names]
+
+    with zipfile.ZipFile(file_path) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{NS_PKG_REL}Relationship")}
+
+        sheets = []
+        for sheet in workbook.iter(f"{NS_MAIN}sheet"):
+            target = targets.get(sheet.get(f"{NS_REL}id"))
+            if target is None:
+                sheets.append(SheetInfo(sheet.get("name"), None, None, None))
+                continue
+            if target.startswith("/"):
+                path = target.lstrip("/")
+            else:
+                path = posixpath.normpath(posixpath.join("xl", target))
+            rows, columns = _sheet_dimensions(archive, path) if path in archive.namelist() else (None, None)
+            sheets.append(SheetInfo(sheet.get("name"), path, rows, columns))
+        return sheets
+
+
+class LazySheetData(Mapping):
+    """
+    Листы Excel файла, которые разбираются только при обращении
+
+    Ведет себя как Dict[str, pd.DataFrame]: список листов известен сразу
+    из read_sheet_index, DataFrame листа создается при первом обращении
+    и хранится в ограниченном LRU-кэше. Перед разбором лист ищется в
+    дисковом кэше disk_cache (None - не использовать). При compact листы
+    хранятся компактно (compact_sheet).
+    """
+
+    def __init__(self, file_path: str, cache_size: int = SHEET_CACHE_SIZE,
+                 disk_cache: Optional[SheetCache] = default_cache, compact: bool = False):
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self.disk_cache = disk_cache
+        self.compact = compact
+        self.sheets: Dict[str, SheetInfo] = OrderedDict(
+            (info.name, info) for info in read_sheet_index(file_path))
+        self._cache: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._excel_file = None
+        # Листы могут разбираться из фонового потока GUI и из обработки
+        self._lock = threading.Lock()
+
+    def __getitem__(self, sheet_name: str) -> pd.DataFrame:
+        if sheet_name not in self.sheets:
+            raise KeyError(sheet_name)
+        with self._lock:
+            if sheet_name in self._cache:
+                self._cache.move_to_end(sheet_name)
+                return self._cache[sheet_name]
+
+            df = self.disk_cache.get(self.file_path, sheet_name) if self.disk_cache else None
+            if df is None:
+                with span("parse_sheet", sheet=sheet_name) as parse_span:
+                    if self._excel_file is None:
+                        self._excel_file = pd.ExcelFile(self.file_path)
+                    df = self._excel_file.parse(sheet_name)
+                    parse_span.rows = len(df)
+                if self.compact:
+                    df = compact_sheet(df, sheet_name)
+                if self.disk_cache:
+                    self.disk_cache.put(self.file_path, sheet_name, df)
+            elif self.compact:
+                # Лист мог попасть в кэш из обычной загрузки
+                df = compact_sheet(df, sheet_name)
+
+            self._cache[sheet_name] = df
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return df
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.sheets)
+
+    def __len__(self) -> int:
+        return len(self.sheets)
+
+    def is_cached(self) -> bool:
+        """Есть ли все листы файла в дисковом кэше"""
+        return bool(self.disk_cache) and self.disk_cache.has_all(self.file_path, list(self.sheets))
+
+    def is_loaded(self, sheet_name: str) -> bool:
+        """Разобран ли лист и находится ли он в кэше"""
+        return sheet_name in self._cache
+
+    def peek(self, sheet_name: str) -> Optional[pd.DataFrame]:
+        """
+        Лист из памяти или дискового кэша без разбора файла
+
+        Не держит блокировку во время чтения дискового кэша и не меняет
+        LRU-кэш, поэтому не мешает загрузке листов для показа.
+
+        Returns:
+            Optional[pd.DataFrame]: Данные листа или None, если лист еще не разбирался
+        """
+        with self._lock:
+            df = self._cache.get(sheet_name)
+        if df is None and self.disk_cache:
+            df = self.disk_cache.get(self.file_path, sheet_name)
+            if df is not None and self.compact:
+                df = compact_sheet(df, sheet_name)
+        return df
+
+    def loaded(self) -> Dict[str, pd.DataFrame]:
+        """Уже разобранные листы из кэша в памяти"""
+        with self._lock:
+            return OrderedDict(self._cache)
+
+    def info(self, sheet_name: str) -> SheetInfo:
+        """Метаданные листа"""
+        return self.sheets[sheet_name]
+
+    def close(self):
+        """Закрывает исходный файл и очищает кэш"""
+        with self._lock:
+            if self._excel_file is not None:
+                self._excel_file.close()
+                self._excel_file = None
+            self._cache.clear()
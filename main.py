@@ -1,31 +1,114 @@
-from gui import ExcelAppGUI
+import json
+import multiprocessing
+import os
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-from excel_handler import load_excel_data, excel_processing
+from tkinter import ttk, messagebox, simpledialog
+# Тяжелые модули (gui, excel_handler: pandas, numpy, openpyxl) импортируются после показа окна
+from instrumentation import span
 from settings import Settings  # Добавлен импорт Settings
 
+# Отсчет холодного старта (без запуска интерпретатора, его учитывает benchmarks/startup_time.py)
+STARTUP_T0 = time.perf_counter()
+
+# "1" - вывести замеры запуска в stdout и сразу выйти (benchmarks/startup_time.py)
+ENV_STARTUP_CHECK = "LIGHT_APP_STARTUP_CHECK"
+# Период проверки фоновой загрузки модулей
+IMPORT_POLL_MS = 20
+
+
+def import_heavy_modules(done: dict):
+    """
+    Импорт gui и excel_handler (pandas, numpy, openpyxl) в фоновом потоке
+
+    Окно уже показано, пока модули загружаются. Виджеты создаются только
+    в главном потоке после загрузки.
+    """
+    try:
+        with span("startup_imports") as import_span:
+            import excel_handler  # noqa: F401
+            import gui  # noqa: F401
+        done["imports_s"] = import_span.wall_s
+    except BaseException as e:
+        done["error"] = e
+    finally:
+        done["finished"] = True
+
+
 def main():
     root = tk.Tk()
-    app = ExcelAppGUI(root, on_file_load=load_excel_data, on_open_settings=None)
-    settings = Settings()  # Создаем экземпляр настроек
+    root.title("Light App")
+    root.geometry("800x600")
+    # Окно показывается до загрузки pandas/openpyxl
+    splash = ttk.Label(root, text="Loading...", anchor=tk.CENTER)
+    splash.pack(expand=True, fill=tk.BOTH)
+    root.update()
+    timings = {"window_s": time.perf_counter() - STARTUP_T0}
+
+    done = {}
+    threading.Thread(target=import_heavy_modules, args=(done,), name="startup-imports", daemon=True).start()
+
+    def wait_for_imports():
+        if not done.get("finished"):
+            root.after(IMPORT_POLL_MS, wait_for_imports)
+            return
+        if "error" in done:
+            messagebox.showerror("Error", f"Failed to start: {done['error']}")
+            root.destroy()
+            return
+        timings["imports_s"] = done["imports_s"]
+        splash.destroy()
+        build_main_window(root)
+        root.update_idletasks()
+        timings["ready_s"] = time.perf_counter() - STARTUP_T0
+        if os.environ.get(ENV_STARTUP_CHECK, "") not in ("", "0"):
+            print(json.dumps({name: round(value, 4) for name, value in timings.items()}), flush=True)
+            root.destroy()
+
+    root.after(IMPORT_POLL_MS, wait_for_imports)
+    root.mainloop()
+
+
+def load_file(path):
+    """Загрузка файла для GUI; режим хранения читается при каждом открытии, чтобы учесть изменения в настройках"""
+    from excel_handler import open_excel_data
+    return open_excel_data(path, compact=Settings().get_compact_mode())
+
+
+def build_main_window(root):
+    """Главное окно; вызывается после загрузки gui и excel_handler"""
+    from gui import ExcelAppGUI
+
+    app = ExcelAppGUI(root, on_file_load=load_file, on_open_settings=None)
     
     # Создаем кнопку для обработки данных
     toolbar = app.root.nametowidget('.!frame.!frame')  # Получаем доступ к toolbar
-    process_btn = ttk.Button(toolbar, text="Process", command=lambda: process_excel_data(app, settings))
+    process_btn = ttk.Button(toolbar, text="Process", command=lambda: process_excel_data(app))
     process_btn.pack(side=tk.LEFT, padx=(5, 0))
-    
-    app.run()
 
-def process_excel_data(app, settings):
+    # Кнопка объединения выделенных строк всех открытых файлов
+    merge_btn = ttk.Button(toolbar, text="Merge Files", command=lambda: merge_excel_data(app))
+    merge_btn.pack(side=tk.LEFT, padx=(5, 0))
+    return app
+
+def process_excel_data(app):
     """Обработка выделенных данных Excel"""
     if not app.current_file_path:
         messagebox.showerror("Error", "No file loaded")
         return
+
+    if app.is_loading():
+        messagebox.showerror("Error", "File is still loading")
+        return
         
     if not app.selected_rows:
         messagebox.showerror("Error", "No rows selected")
         return
         
+    from excel_handler import excel_processing
+    # Настройки читаются при каждой обработке, чтобы учесть изменения в SettingsDialog
+    settings = Settings()
     try:
         # Передаем данные в функцию обработки
         excel_processing(
@@ -40,5 +123,41 @@ def process_excel_data(app, settings):
     except Exception as e:
         messagebox.showerror("Error", f"Processing failed: {str(e)}")
 
+def merge_excel_data(app):
+    """Объединение выделенных строк всех открытых за сеанс файлов в один результат"""
+    from excel_handler import MERGED_RESULT_NAME, excel_processing_merge
+
+    if app.is_loading():
+        messagebox.showerror("Error", "File is still loading")
+        return
+
+    app.update_selected_rows()
+    sources = app.get_file_selections()
+    if not sources:
+        messagebox.showerror("Error", "No rows selected")
+        return
+
+    result_name = simpledialog.askstring("Merge Files",
+                                         f"Merge selected rows from {len(sources)} file(s) into:",
+                                         initialvalue=MERGED_RESULT_NAME, parent=app.root)
+    if not result_name:
+        return
+    if not result_name.lower().endswith(".xlsx"):
+        result_name += ".xlsx"
+
+    # Настройки читаются при каждом объединении, чтобы учесть изменения в SettingsDialog
+    settings = Settings()
+    try:
+        result_path = excel_processing_merge(
+            sources=sources,
+            save_path=settings.get_save_path(),
+            columns_to_keep=settings.get_column_to_keep(),
+            result_name=result_name
+        )
+        messagebox.showinfo("Success", f"Merged {len(sources)} file(s) into {result_path}")
+    except Exception as e:
+        messagebox.showerror("Error", f"Merge failed: {str(e)}")
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Для скольких файлов держать извлеченные записи в памяти
+RECORD_CACHE_FILES = 4
+
+
+class RecordCache:
+    """
+    Извлеченные записи листов недавно обработанных файлов
+
+    Записи (строки с ISIN, группы и заголовки листа) не зависят от
+    выделения и выбранных столбцов, поэтому повторная обработка того же
+    файла только фильтрует их. Запись файла действительна, пока не
+    изменились его размер и время изменения. Хранится не больше max_files
+    файлов, давно не использованные вытесняются.
+    """
+
+    def __init__(self, max_files: int = RECORD_CACHE_FILES):
+        self.max_files = max_files
+        self._files: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, object]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(file_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, file_path: str) -> Optional[Dict[str, object]]:
+        """
+        Возвращает записи всех листов файла
+
+        Returns:
+            Optional[Dict[str, object]]: {имя листа: записи} или None, если файла
+                нет в кэше или он изменился
+        """
+        key = os.path.abspath(file_path)
+        stamp = self._stamp(file_path)
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is None:
+                return None
+            if entry[0] != stamp:
+                del self._files[key]
+                return None
+            self._files.move_to_end(key)
+            return entry[1]
+
+    def put(self, file_path: str, records: Dict[str, object]):
+        """Сохраняет записи всех листов файла"""
+        stamp = self._stamp(file_path)
+        if stamp is None:
+            return
+        key = os.path.abspath(file_path)
+        with self._lock:
+            self._files[key] = (stamp, records)
+            self._files.move_to_end(key)
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+
+    def discard(self, file_path: str):
+        """Удаляет записи файла"""
+        with self._lock:
+            self._files.pop(os.path.abspath(file_path), None)
+
+    def clear(self):
+        """Удаляет все записи"""
+        with self._lock:
+            self._files.clear()
+
+
+# Кэш по умолчанию для повторной обработки в GUI
+default_record_cache = RecordCache()
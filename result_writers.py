@@ -0,0 +1,262 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+# Первый столбец плоского результата - название группы
+GROUP_COLUMN = "Group"
+
+# Сколько строк листа собирается в один блок перед записью в zip
+XML_CHUNK_ROWS = 2000
+
+# Начало отсчета дат Excel (система 1900 с учетом несуществующего 29.02.1900)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Индексы стилей в styles.xml минимальной книги
+XF_DATE = 1
+XF_DATETIME = 2
+XF_HEADER = 3
+
+
+class ResultTable(NamedTuple):
+    """
+    Результат в плоском виде для облегченных форматов
+
+    columns - названия видимых столбцов, indexes - их индексы в кортеже
+    из 25 позиций, groups - непустые группы (название, строки) в порядке
+    вывода.
+    """
+    columns: List[str]
+    indexes: List[int]
+    groups: List[Tuple[str, set]]
+
+
+def build_result_table(Chosen_assets: Dict[str, set], Used_positions: set,
+                       column_labels: Sequence[Tuple[object, object]]) -> ResultTable:
+    """
+    Плоская таблица результата
+
+    Args:
+        Chosen_assets (Dict[str, set]): Строки по группам из extract_selected_rows
+        Used_positions (set): Позиции 1..25, в которых есть значения
+        column_labels (Sequence[Tuple[object, object]]): Двухстрочные заголовки
+            позиций (Old_Columns), 0 - пустая часть заголовка
+    """
+    positions = sorted(pos for pos in range(1, 26) if pos in Used_positions)
+    columns = [" ".join(str(part) for part in column_labels[pos - 1] if part != 0) for pos in positions]
+    groups = [(title, rows) for title, rows in Chosen_assets.items() if rows]
+    return ResultTable(columns, [pos - 1 for pos in positions], groups)
+
+
+def _flat_value(value):
+    """Значение для текстового формата: даты в ISO, пустые значения -> "" """
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.date().isoformat()
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _flat_rows(table: ResultTable) -> Iterator[List[object]]:
+    indexes = table.indexes
+    for title, rows in table.groups:
+        for row in rows:
+            yield [title] + [_flat_value(row[i]) for i in indexes]
+
+
+def write_result_csv(result_path: str, table: ResultTable, delimiter: str = ","):
+    """
+    Записывает результат в CSV потоково, строка за строкой
+
+    Одна строка на актив: название группы и значения видимых столбцов.
+
+    Args:
+        result_path (str): Путь к файлу результата
+        table (ResultTable): Плоская таблица из build_result_table
+        delimiter (str): Разделитель полей
+    """
+    with open(result_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow([GROUP_COLUMN] + table.columns)
+        writer.writerows(_flat_rows(table))
+
+
+def write_result_tsv(result_path: str, table: ResultTable):
+    """write_result_csv с разделителем табуляции"""
+    write_result_csv(result_path, table, delimiter="\t")
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Стили: 0 - обычный, 1 - дата, 2 - дата и время, 3 - заголовок (жирный)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+# Символы, недопустимые в XML 1.0 (управляющие, кроме табуляции и переводов строки)
+_XML_ILLEGAL = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+# Строки без этих символов записываются как есть, без экранирования
+_NEEDS_ESCAPE_RE = re.compile(r"[&<>\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _text_body(text: str, style: int = 0) -> str:
+    """Окончание XML ячейки со строкой (все после r="...")"""
+    if _NEEDS_ESCAPE_RE.search(text):
+        text = escape(text.translate(_XML_ILLEGAL))
+    space = ' xml:space="preserve"' if text[:1].isspace() or text[-1:].isspace() else ""
+    style_attr = f' s="{style}"' if style else ""
+    return f'{style_attr} t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+def _cell_xml(ref: str, value) -> str:
+    """XML ячейки; пустые значения не записываются"""
+    # Частые типы проверяются по точному типу, остальные - через isinstance
+    kind = type(value)
+    if kind is str:
+        return f'<c r="{ref}"{_text_body(value)}'
+    if kind is float:
+        if value != value or value in (float("inf"), float("-inf")):
+            return ""
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    if kind is int:
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return f'<c r="{ref}"{_text_body(str(value))}'
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        return _cell_xml(ref, float(value))
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        style = XF_DATE if serial == int(serial) else XF_DATETIME
+        return f'<c r="{ref}" s="{style}"><v>{serial!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{XF_DATE}"><v>{(value - EXCEL_EPOCH.date()).days}</v></c>'
+    return f'<c r="{ref}"{_text_body(str(value))}'
+
+
+def _sheet_rows_xml(table: ResultTable) -> Iterable[str]:
+    letters = [get_column_letter(i) for i in range(1, len(table.columns) + 2)]
+    header = "".join(f'<c r="{letter}1"{_text_body(str(text), XF_HEADER)}'
+                     for letter, text in zip(letters, [GROUP_COLUMN] + table.columns))
+    yield f'<row r="1">{header}</row>'
+
+    columns = list(zip(letters[1:], table.indexes))
+    row_number = 1
+    for title, rows in table.groups:
+        # Название группы одинаково во всех ее строках, экранируется один раз
+        title_body = _text_body(title)
+        for row in rows:
+            row_number += 1
+            number = str(row_number)
+            cells = "".join([_cell_xml(letter + number, row[i]) for letter, i in columns])
+            yield f'<row r="{number}"><c r="A{number}"{title_body}{cells}</row>'
+
+
+def write_result_xlsx_raw(result_path: str, table: ResultTable, sheet_name: str = "Result"):
+    """
+    Записывает результат в минимальную xlsx книгу без openpyxl
+
+    XML листа формируется напрямую и пишется в zip потоком блоками по
+    XML_CHUNK_ROWS строк; строки хранятся как inline strings, поэтому
+    таблица общих строк не нужна. Оформление только у дат и заголовка,
+    раскладка та же, что у CSV: строка на актив со столбцом группы.
+
+    Args:
+        result_path (str): Путь к файлу результата
+        table (ResultTable): Плоская таблица из build_result_table
+        sheet_name (str): Имя листа
+    """
+    with zipfile.ZipFile(result_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(sheet_name=escape(sheet_name, {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _STYLES)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as f:
+            f.write(_SHEET_START.encode("utf-8"))
+            chunk = []
+            for row_xml in _sheet_rows_xml(table):
+                chunk.append(row_xml)
+                if len(chunk) >= XML_CHUNK_ROWS:
+                    f.write("".join(chunk).encode("utf-8"))
+                    chunk = []
+            if chunk:
+                f.write("".join(chunk).encode("utf-8"))
+            f.write(_SHEET_END.encode("utf-8"))
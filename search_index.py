@@ -0,0 +1,159 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from excel_handler import DATA_ROW_OFFSET, default_matcher, sheet_group_index, sheet_header_rows
+from header_matcher import HeaderMatcher
+
+# Позиции 1..25, по которым идет текстовый поиск: тикер, название, сектор
+SEARCH_POSITIONS = (2, 5, 6)
+
+# Разделители слов для поиска по началу слова
+TOKEN_SPLIT_RE = r"[\s,;:/()&.\-\x1f]+"
+# Символ больше любого другого: верхняя граница диапазона префикса
+PREFIX_END = "\U0010ffff"
+
+
+class SheetIndex(NamedTuple):
+    """
+    Поисковый индекс листа
+
+    isins - ISIN -> номера строк Excel; tokens - отсортированные слова
+    тикера, названия и сектора в нижнем регистре, token_rows - их строки;
+    text/rows - строка поиска по вхождению для каждой строки с ISIN.
+    """
+    isins: Dict[str, List[int]]
+    tokens: np.ndarray
+    token_rows: np.ndarray
+    text: np.ndarray
+    rows: np.ndarray
+
+
+def _column_strings(column: pd.Series) -> pd.Series:
+    """Значения столбца как строки в нижнем регистре, пустые ячейки -> "" """
+    return column.astype(str).where(column.notna(), "").str.lower()
+
+
+def build_sheet_index(df: pd.DataFrame, matcher: Optional[HeaderMatcher] = None) -> Optional[SheetIndex]:
+    """
+    Строит поисковый индекс строк с ISIN листа (колонка C, начиная с 5-й строки)
+
+    Строки с ISIN берутся из разметки листа (sheet_group_index), как и при
+    обработке, поэтому найденные строки совпадают с теми, что обработка
+    считает строками с ISIN. Столбцы тикера, названия и сектора находятся
+    по заголовкам 2/3 строк через сопоставление заголовков. Все
+    преобразования векторные.
+
+    Returns:
+        Optional[SheetIndex]: Индекс или None, если в листе нет данных
+    """
+    if len(df.columns) < 3 or len(df) < 4:
+        return None
+    matcher = matcher or default_matcher
+
+    layout = matcher.layout(*sheet_header_rows(df))
+    search_columns = [source_col for source_col, positions in layout.items()
+                      if any(position in SEARCH_POSITIONS for position in positions)]
+
+    group_index = sheet_group_index(df)
+    positions = group_index.isin_positions
+    rows = positions + DATA_ROW_OFFSET
+    isin_values = pd.Series(group_index.isin_values, dtype=object).str.upper()
+    isins: Dict[str, List[int]] = {}
+    for isin, row in zip(isin_values.tolist(), rows.tolist()):
+        isins.setdefault(isin, []).append(row)
+
+    text = isin_values.str.lower()
+    for source_col in search_columns:
+        column = df.iloc[positions, source_col - 1].reset_index(drop=True)
+        text = text.str.cat(_column_strings(column), sep="\x1f")
+    text = text.reset_index(drop=True)
+
+    tokens = text.str.split(TOKEN_SPLIT_RE, regex=True).explode()
+    tokens = tokens[tokens.notna() & (tokens != "")]
+    token_rows = rows[tokens.index.to_numpy()]
+    token_values = tokens.to_numpy(dtype=str)
+    order = np.argsort(token_values, kind="stable")
+
+    return SheetIndex(isins, token_values[order], token_rows[order],
+                      text.to_numpy(dtype=str), rows)
+
+
+def search_sheet(index: SheetIndex, query: str, substring: bool = False) -> np.ndarray:
+    """
+    Ищет строки листа по запросу
+
+    ISIN ищется точно. Остальные слова запроса ищутся по началу слов тикера,
+    названия и сектора (все слова должны совпасть), а при substring - как
+    вхождение в строку поиска.
+
+    Returns:
+        np.ndarray: Отсортированные номера строк Excel
+    """
+    query = query.strip().lower()
+    if not query:
+        return np.zeros(0, dtype=np.int64)
+
+    exact = index.isins.get(query.upper(), [])
+    if substring:
+        found = index.rows[np.char.find(index.text, query) >= 0]
+    else:
+        found = None
+        for word in re.split(TOKEN_SPLIT_RE, query):
+            if not word:
+                continue
+            start = np.searchsorted(index.tokens, word, side="left")
+            end = np.searchsorted(index.tokens, word + PREFIX_END, side="left")
+            word_rows = np.unique(index.token_rows[start:end])
+            found = word_rows if found is None else np.intersect1d(found, word_rows, assume_unique=True)
+        if found is None:
+            found = np.zeros(0, dtype=np.int64)
+    return np.union1d(found, np.asarray(exact, dtype=np.int64))
+
+
+class SearchIndex:
+    """
+    Поисковый индекс всех листов файла
+
+    Листы добавляются по мере построения (например, из фонового потока),
+    поиск идет по уже проиндексированным листам в порядке книги.
+    """
+
+    def __init__(self, sheet_names: Iterable[str]):
+        self.sheet_names = list(sheet_names)
+        self.sheets: Dict[str, Optional[SheetIndex]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_sheet(self, sheet_name: str, df: pd.DataFrame):
+        """Индексирует лист"""
+        index = build_sheet_index(df)
+        with self._lock:
+            self.sheets[sheet_name] = index
+
+    def has_sheet(self, sheet_name: str) -> bool:
+        """Проиндексирован ли лист"""
+        return sheet_name in self.sheets
+
+    def is_complete(self) -> bool:
+        """Проиндексированы ли все листы"""
+        return len(self.sheets) >= len(self.sheet_names)
+
+    def search(self, query: str, substring: bool = False) -> List[Tuple[str, int]]:
+        """
+        Ищет строки во всех проиндексированных листах
+
+        Returns:
+            List[Tuple[str, int]]: (имя листа, номер строки Excel) в порядке книги
+        """
+        with self._lock:
+            indexed = [(name, self.sheets[name]) for name in self.sheet_names if name in self.sheets]
+        hits = []
+        for sheet_name, index in indexed:
+            if index is None:
+                continue
+            hits.extend((sheet_name, int(row)) for row in search_sheet(index, query, substring))
+        return hits
@@ -0,0 +1,398 @@
+import json
+import os
+import re
+import warnings
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from excel_handler import DATA_ROW_OFFSET, Old_Columns, _cell_value, default_matcher, sheet_group_index
+
+# Имена полей в правилах -> позиции 1..25
+RULE_FIELDS: Dict[str, int] = {
+    "isin": 1, "ticker": 2, "ccy": 3, "cpn": 4, "name": 5, "sector": 6, "industry": 7,
+    "maturity": 8, "price": 9, "perf": 10, "mkcap": 11, "ytm": 12, "share_class": 13,
+    "er_mf": 14, "rating_moody": 15, "rating_sp": 16, "rating_fitch": 17, "size": 18,
+    "z_spread": 19, "asw_spread": 20, "min_piece": 21, "min_incr": 22, "market": 23,
+    "notes": 24, "added_on": 25,
+}
+DATE_POSITIONS = {8, 25}
+RATING_POSITIONS = {15, 16, 17}
+
+# Шкалы рейтингов S&P/Fitch и Moody's выровнены по ступеням: AAA = Aaa, ..., C = C
+SP_SCALE = ("AAA", "AA+", "AA", "AA-", "A+", "A", "A-", "BBB+", "BBB", "BBB-", "BB+", "BB", "BB-",
+            "B+", "B", "B-", "CCC+", "CCC", "CCC-", "CC", "C", "D")
+MOODY_SCALE = ("Aaa", "Aa1", "Aa2", "Aa3", "A1", "A2", "A3", "Baa1", "Baa2", "Baa3", "Ba1", "Ba2", "Ba3",
+               "B1", "B2", "B3", "Caa1", "Caa2", "Caa3", "Ca", "C")
+# Чем выше ранг, тем выше качество: "rating_sp >= A-" - рейтинг A- и лучше
+RATING_RANKS: Dict[str, int] = {}
+for _scale in (SP_SCALE, MOODY_SCALE):
+    for _index, _rating in enumerate(_scale):
+        RATING_RANKS[_rating.upper()] = len(SP_SCALE) - _index
+RATING_RE = re.compile(r"^\s*([A-Da-d][A-Za-z]*[1-3]?[+-]?)")
+
+# Файл сохраненных правил (рядом с config.json)
+RULES_FILE = "selection_rules.json"
+
+TOKEN_RE = re.compile(r'\s*(?:("[^"]*"|\'[^\']*\')|(<=|>=|!=|==|[<>=≤≥≠(){},])|([^\s(){},<>=!≤≥≠"\']+))')
+COMPARISON_OPS = {"=", "==", "!=", "<", "<=", ">", ">=", "contains", "startswith", "before", "after"}
+UNICODE_OPS = {"≤": "<=", "≥": ">=", "≠": "!="}
+# Слова, на которых заканчивается имя поля
+FIELD_STOP_WORDS = {"not", "in", "contains", "startswith", "before", "after"}
+
+
+class RuleError(ValueError):
+    """Ошибка в тексте правила выбора"""
+
+
+def _normalize_field(name: str) -> str:
+    return re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+
+
+# Поля можно называть и по заголовкам столбцов ("Rating S&P" -> rating_s_p)
+FIELD_ALIASES: Dict[str, int] = dict(RULE_FIELDS)
+for _position, (_top, _bottom) in enumerate(Old_Columns, start=1):
+    _label = f"{_top} {_bottom}" if _bottom != 0 else str(_top)
+    FIELD_ALIASES.setdefault(_normalize_field(_label), _position)
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    """Разбивает правило на лексемы: ("str", значение), ("op", знак) или ("word", слово)"""
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise RuleError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+        quoted, op, word = match.groups()
+        if quoted is not None:
+            tokens.append(("str", quoted[1:-1]))
+        elif op is not None:
+            tokens.append(("op", UNICODE_OPS.get(op, op)))
+        else:
+            tokens.append(("word", word))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Разбор правила рекурсивным спуском
+
+    expr := and_expr ("or" and_expr)*
+    and_expr := not_expr ("and" not_expr)*
+    not_expr := "not" not_expr | "(" expr ")" | condition
+    condition := field op value | field ["not"] "in" (set)
+    """
+
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise RuleError("Unexpected end of rule")
+        self.pos += 1
+        return token
+
+    def keyword(self, *words: str) -> bool:
+        token = self.peek()
+        if token is not None and token[0] == "word" and token[1].lower() in words:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise RuleError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def expr(self):
+        nodes = [self.and_expr()]
+        while self.keyword("or"):
+            nodes.append(self.and_expr())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def and_expr(self):
+        nodes = [self.not_expr()]
+        while self.keyword("and"):
+            nodes.append(self.not_expr())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def not_expr(self):
+        if self.keyword("not"):
+            return ("not", self.not_expr())
+        if self.peek() == ("op", "("):
+            self.take()
+            node = self.expr()
+            if self.take() != ("op", ")"):
+                raise RuleError("Missing ')'")
+            return node
+        return self.condition()
+
+    def condition(self):
+        # Имя поля может состоять из нескольких слов ("Rating S&P")
+        words = []
+        while True:
+            token = self.peek()
+            if token is None or token[0] != "word" or (words and token[1].lower() in FIELD_STOP_WORDS):
+                break
+            words.append(self.take()[1])
+        if not words:
+            raise RuleError(f"Expected a field name, got {self.peek()[1] if self.peek() else 'end of rule'!r}")
+        name = " ".join(words)
+        position = FIELD_ALIASES.get(_normalize_field(name))
+        if position is None:
+            raise RuleError(f"Unknown field {name!r}")
+
+        negate = self.keyword("not")
+        if self.keyword("in"):
+            node = ("cond", position, "in", self.value_set())
+            return ("not", node) if negate else node
+        if negate:
+            raise RuleError("Expected 'in' after 'not'")
+
+        kind, op = self.take()
+        op = op.lower()
+        if op not in COMPARISON_OPS:
+            raise RuleError(f"Unknown operator {op!r}")
+        op = {"==": "=", "before": "<", "after": ">"}.get(op, op)
+        return ("cond", position, op, [self.value()])
+
+    def value(self) -> str:
+        kind, value = self.take()
+        if kind == "op":
+            raise RuleError(f"Expected a value, got {value!r}")
+        return value
+
+    def value_set(self) -> List[str]:
+        opening = self.take()
+        if opening not in (("op", "{"), ("op", "(")):
+            raise RuleError("Expected '{' or '(' after 'in'")
+        closing = "}" if opening[1] == "{" else ")"
+        values = [self.value()]
+        while self.peek() == ("op", ","):
+            self.take()
+            values.append(self.value())
+        if self.take() != ("op", closing):
+            raise RuleError(f"Missing {closing!r}")
+        return values
+
+
+def _map_unique(series: pd.Series, func, missing) -> np.ndarray:
+    """
+    Применяет func к различным значениям столбца и раскладывает результат по строкам
+
+    В столбцах валют, рейтингов и секторов различных значений мало, поэтому
+    преобразование строк не зависит от количества строк листа.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    mapped = np.array([func(value) for value in uniques] + [missing], dtype=object)
+    return mapped[codes]
+
+
+def _rating_rank(value) -> float:
+    match = RATING_RE.match(str(value))
+    return RATING_RANKS.get(match.group(1).upper(), np.nan) if match else np.nan
+
+
+def _rating_ranks(series: pd.Series) -> pd.Series:
+    """Ранги рейтингов столбца (NaN для пустых и неизвестных значений)"""
+    return pd.Series(_map_unique(series, _rating_rank, np.nan), dtype=float)
+
+
+def _parse_date(value: str) -> pd.Timestamp:
+    if re.fullmatch(r"\d{4}", value):
+        return pd.Timestamp(int(value), 1, 1)
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise RuleError(f"Invalid date {value!r}") from None
+
+
+def _compare(left: pd.Series, op: str, right):
+    if op == "=":
+        return left == right
+    if op == "!=":
+        return left != right
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    raise RuleError(f"Operator {op!r} is not supported for this field")
+
+
+def _evaluate_condition(series: pd.Series, position: int, op: str, values: List[str]) -> np.ndarray:
+    """Векторное условие над столбцом; пустые ячейки условию не удовлетворяют"""
+    present = series.notna().to_numpy()
+
+    if position in RATING_POSITIONS and op not in ("contains", "startswith"):
+        ranks = _rating_ranks(series)
+        wanted = []
+        for value in values:
+            rank = RATING_RANKS.get(value.upper())
+            if rank is None:
+                raise RuleError(f"Unknown rating {value!r}")
+            wanted.append(rank)
+        if op == "in":
+            return ranks.isin(wanted).to_numpy()
+        return _compare(ranks, op, wanted[0]).fillna(False).to_numpy(dtype=bool)
+
+    if position in DATE_POSITIONS and op not in ("contains", "startswith"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            dates = pd.to_datetime(series, errors="coerce")
+        wanted = [_parse_date(value) for value in values]
+        if op == "in":
+            return dates.isin(wanted).to_numpy()
+        return (_compare(dates, op, wanted[0]) & dates.notna()).to_numpy(dtype=bool)
+
+    numbers = None
+    if op not in ("contains", "startswith"):
+        try:
+            wanted_numbers = [float(value) for value in values]
+            numbers = pd.to_numeric(series, errors="coerce")
+        except ValueError:
+            numbers = None
+    if numbers is not None:
+        if op == "in":
+            return numbers.isin(wanted_numbers).to_numpy()
+        return (_compare(numbers, op, wanted_numbers[0]) & numbers.notna()).to_numpy(dtype=bool)
+
+    strings = pd.Series(_map_unique(series, lambda value: str(value).strip().lower(), ""), dtype=object)
+    wanted_strings = [value.strip().lower() for value in values]
+    if op == "in":
+        result = strings.isin(wanted_strings)
+    elif op == "contains":
+        result = strings.str.contains(wanted_strings[0], regex=False)
+    elif op == "startswith":
+        result = strings.str.startswith(wanted_strings[0])
+    else:
+        result = _compare(strings, op, wanted_strings[0])
+    return result.to_numpy(dtype=bool) & present
+
+
+class SelectionRule:
+    """
+    Правило выбора строк, например:
+    "ccy in {USD, EUR} and rating_sp >= A- and maturity before 2030"
+
+    Поля - имена из RULE_FIELDS или заголовки столбцов; операторы =, !=, <,
+    <=, >, >= (before/after для дат), in/not in, contains, startswith;
+    условия объединяются через and/or/not и скобки. Рейтинги сравниваются
+    по шкале (A- лучше BBB+), даты и числа - как значения, остальное - как
+    строки без учета регистра.
+
+    Правило вычисляется векторно над DataFrame каждого листа и отбирает
+    только строки с ISIN. Вызов правила с данными листов возвращает
+    selected_rows.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tree = _Parser(text).parse()
+
+    def evaluate(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Номера строк Excel листа, удовлетворяющих правилу
+
+        Returns:
+            np.ndarray: Отсортированные номера строк Excel
+        """
+        if len(df.columns) < 3 or len(df) < 4:
+            return np.zeros(0, dtype=np.int64)
+
+        header_row2 = [_cell_value(v) for v in df.iloc[0].tolist()]
+        header_row3 = [_cell_value(v) for v in df.iloc[1].tolist()]
+        layout = default_matcher.layout(header_row2, header_row3)
+
+        # Строки с данными начинаются с 5-й, группы (не ISIN) не выбираются
+        isin_positions = sheet_group_index(df).isin_positions
+        block = df.iloc[isin_positions]
+        rows = isin_positions + DATA_ROW_OFFSET
+
+        columns: Dict[int, Optional[pd.Series]] = {}
+
+        def column(position: int) -> Optional[pd.Series]:
+            if position not in columns:
+                source_cols = [col for col, positions in layout.items() if positions[0] == position]
+                if not source_cols and position == 1:
+                    source_cols = [3]
+                columns[position] = block.iloc[:, source_cols[0] - 1] if source_cols else None
+            return columns[position]
+
+        def evaluate_node(node) -> np.ndarray:
+            kind = node[0]
+            if kind == "and":
+                return np.logical_and.reduce([evaluate_node(child) for child in node[1]])
+            if kind == "or":
+                return np.logical_or.reduce([evaluate_node(child) for child in node[1]])
+            if kind == "not":
+                return ~evaluate_node(node[1])
+            _, position, op, values = node
+            series = column(position)
+            if series is None:
+                # Столбца нет в листе: условие не выполняется ни для одной строки
+                return np.zeros(len(block), dtype=bool)
+            return _evaluate_condition(series, position, op, values)
+
+        return rows[evaluate_node(self.tree)]
+
+    def select(self, sheet_data: Mapping[str, pd.DataFrame]) -> Dict[str, List[int]]:
+        """
+        Применяет правило ко всем листам
+
+        Returns:
+            Dict[str, List[int]]: Номера строк по листам в формате selected_rows
+        """
+        return {sheet_name: self.evaluate(df).tolist() for sheet_name, df in sheet_data.items()}
+
+    __call__ = select
+
+
+class RuleStore:
+    """Сохраненные правила выбора {имя: текст правила} в JSON файле"""
+
+    def __init__(self, rules_file: str = RULES_FILE):
+        self.rules_file = rules_file
+        self.rules = self.load_rules()
+
+    def load_rules(self) -> Dict[str, str]:
+        if os.path.exists(self.rules_file):
+            try:
+                with open(self.rules_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Failed to read selection rules from {self.rules_file}: {e}")
+        return {}
+
+    def get_rules(self) -> Dict[str, str]:
+        return dict(self.rules)
+
+    def get_rule(self, name: str) -> Optional[str]:
+        return self.rules.get(name)
+
+    def save_rule(self, name: str, text: str):
+        """Проверяет и сохраняет правило"""
+        SelectionRule(text)
+        self.rules[name] = text
+        self._save()
+
+    def delete_rule(self, name: str):
+        if self.rules.pop(name, None) is not None:
+            self._save()
+
+    def _save(self):
+        with open(self.rules_file, "w", encoding="utf-8") as f:
+            json.dump(self.rules, f, ensure_ascii=False, indent=2)
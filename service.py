@@ -0,0 +1,375 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+from batch import load_isins, load_rule, process_file
+from excel_handler import RESULT_FORMATS
+from instrumentation import configure, default_instrumentation
+from selection_rules import RuleError, SelectionRule
+from settings import Settings
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Сколько заданий может ждать свободного рабочего процесса
+DEFAULT_MAX_QUEUE = 16
+# Предельный размер загружаемой книги
+MAX_UPLOAD_BYTES = 256 * 1024 * 1024
+# По скольким последним заданиям считаются задержки
+LATENCY_WINDOW = 500
+# Блок при отправке результата
+SEND_CHUNK_BYTES = 1024 * 1024
+
+CONTENT_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv; charset=utf-8",
+    ".tsv": "text/tab-separated-values; charset=utf-8",
+}
+
+
+class QueueFull(Exception):
+    """Очередь заданий заполнена"""
+
+
+def _warm_worker(log_path: Optional[str], trace_memory: bool, profile_dir: Optional[str]):
+    """
+    Initializer рабочего процесса: настройки замеров, импорт pandas/openpyxl и шаблон результата
+
+    Импорт и разбор шаблона результата выполняются один раз при запуске
+    процесса, а не в первом задании.
+    """
+    configure(log_path, trace_memory, profile_dir)
+    from excel_handler import preload_result_template
+    preload_result_template()
+
+
+def _ready() -> int:
+    """Пустое задание, чтобы пул запустил рабочие процессы заранее"""
+    return os.getpid()
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+class JobQueue:
+    """
+    Очередь заданий перед пулом рабочих процессов
+
+    Одновременно выполняется не больше workers заданий, еще до max_queue
+    ждут свободного процесса; остальные сразу отклоняются (QueueFull).
+    Процессы запускаются и импортируют pandas/openpyxl при создании
+    очереди. Для метрик запоминаются ожидание в очереди и время обработки
+    последних LATENCY_WINDOW заданий.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        instrumentation_args = (default_instrumentation.log_path, default_instrumentation.trace_memory,
+                                default_instrumentation.profile_dir)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker,
+                                        initargs=instrumentation_args)
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._latencies: Deque[Tuple[float, float, float]] = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+
+        # Прогрев: все процессы запущены до первого запроса
+        for future in [self.pool.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def run(self, func, *args):
+        """
+        Выполняет func(*args) в рабочем процессе, дождавшись своей очереди
+
+        Returns:
+            Tuple[object, float, float]: (результат, ожидание в очереди, время обработки) в секундах
+
+        Raises:
+            QueueFull: Очередь заполнена
+        """
+        with self._lock:
+            if self.waiting >= self.max_queue and self.running >= self.workers:
+                self.rejected += 1
+                raise QueueFull(f"{self.waiting} jobs already queued")
+            self.waiting += 1
+
+        queued_at = time.perf_counter()
+        self._slots.acquire()
+        started_at = time.perf_counter()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+
+        ok = False
+        try:
+            result = self.pool.submit(func, *args).result()
+            ok = True
+            return result, started_at - queued_at, time.perf_counter() - started_at
+        finally:
+            finished_at = time.perf_counter()
+            self._slots.release()
+            with self._lock:
+                self.running -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._latencies.append((started_at - queued_at, finished_at - started_at,
+                                        finished_at - queued_at))
+
+    def record_failure(self):
+        """Задание выполнилось, но обработка файла завершилась ошибкой"""
+        with self._lock:
+            self.completed -= 1
+            self.failed += 1
+
+    def metrics(self) -> Dict[str, object]:
+        """Глубина очереди, счетчики и задержки (p50/p95/max) последних заданий"""
+        with self._lock:
+            latencies = list(self._latencies)
+            metrics: Dict[str, object] = {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.waiting,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "uptime_s": round(time.time() - self.started, 1),
+            }
+        for index, name in enumerate(("queue_s", "process_s", "total_s")):
+            values = [latency[index] for latency in latencies]
+            metrics[name] = {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95),
+                             "max": round(max(values), 4) if values else None}
+        metrics["latency_window"] = len(latencies)
+        return metrics
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+class ServiceConfig:
+    """Настройки сервиса по умолчанию для запросов без параметров"""
+
+    def __init__(self, columns_to_keep: List[int], use_cache: bool = True):
+        self.columns_to_keep = columns_to_keep
+        self.use_cache = use_cache
+
+
+def _parse_job(query: Dict[str, List[str]], config: ServiceConfig
+               ) -> Tuple[List[int], Optional[Set[str]], Optional[SelectionRule], str]:
+    """
+    Параметры задания из строки запроса
+
+    columns=1,2,5 (по умолчанию из профиля настроек), select=all | ISIN,ISIN |
+    rule:<имя или текст правила>, format=xlsx | raw_xlsx | csv | tsv.
+
+    Raises:
+        ValueError: Неверный параметр
+    """
+    columns = query.get("columns", [""])[0]
+    if columns:
+        columns_to_keep = [int(c) for c in columns.split(",") if c.strip()]
+        if not columns_to_keep or any(not 1 <= c <= 25 for c in columns_to_keep):
+            raise ValueError("columns must be numbers 1..25")
+    else:
+        columns_to_keep = config.columns_to_keep
+
+    result_format = query.get("format", ["xlsx"])[0]
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(RESULT_FORMATS)}")
+
+    select = query.get("select", ["all"])[0]
+    if select.startswith("rule:"):
+        return columns_to_keep, None, load_rule(select[len("rule:"):]), result_format
+    if select.startswith("isin:"):
+        # Файлы на сервере не читаются по запросу клиента
+        raise ValueError("isin:<file> is not supported by the service; pass ISINs inline")
+    return columns_to_keep, load_isins(select), None, result_format
+
+
+def _upload_name(name: Optional[str]) -> str:
+    """Безопасное имя загруженного файла (имя результата строится из него)"""
+    name = os.path.basename(name or "") or "upload.xlsx"
+    name = re.sub(r"[^\w.\- ]", "_", name)
+    if not name.lower().endswith(".xlsx"):
+        name += ".xlsx"
+    return name
+
+
+def _content_disposition(file_name: str) -> str:
+    """
+    Заголовок Content-Disposition для имени файла с любыми символами
+
+    Заголовки http.server кодируются в latin-1, поэтому кириллическое имя
+    передается через filename* (RFC 5987), а в filename - ASCII замена.
+    """
+    fallback = file_name.encode("ascii", "replace").decode("ascii").replace("?", "_").replace('"', "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(file_name, safe='')}"
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API сервиса
+
+    POST /process?columns=..&select=..&format=..&name=file.xlsx - тело запроса
+    книга xlsx, в ответ файл результата; GET /metrics - метрики очереди
+    в JSON; GET /health - проверка доступности.
+    """
+
+    server_version = "LightAppService/1.0"
+    jobs: JobQueue
+    config: ServiceConfig
+
+    def _send_json(self, status: int, payload: Dict[str, object]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.jobs.metrics())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/process":
+            self._send_json(404, {"error": f"unknown path {url.path}"})
+            return
+
+        query = parse_qs(url.query)
+        try:
+            columns_to_keep, isins, rule, result_format = _parse_job(query, self.config)
+        except (ValueError, RuleError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send_json(400, {"error": "request body must contain the workbook"})
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self._send_json(413, {"error": f"workbook larger than {MAX_UPLOAD_BYTES} bytes"})
+            return
+
+        work_dir = tempfile.mkdtemp(prefix="light_app_job_")
+        try:
+            name = _upload_name(query.get("name", [None])[0] or self.headers.get("X-File-Name"))
+            upload_path = os.path.join(work_dir, name)
+            with open(upload_path, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(SEND_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if remaining:
+                self._send_json(400, {"error": "incomplete upload"})
+                return
+
+            try:
+                (_, error, _), queue_s, process_s = self.jobs.run(
+                    process_file, upload_path, work_dir, columns_to_keep, isins,
+                    self.config.use_cache, rule, (result_format,))
+            except QueueFull as e:
+                self.send_response(503)
+                self.send_header("Retry-After", "5")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                print(f"Rejected {name}: {e}")
+                return
+            except Exception as e:
+                # Например, BrokenProcessPool: клиент получает ответ, а не закрытое соединение
+                print(f"Job for {name} failed: {e!r}")
+                self._send_json(500, {"error": f"processing failed: {e!r}"})
+                return
+            if error is not None:
+                self.jobs.record_failure()
+                self._send_json(422, {"error": error})
+                return
+
+            suffix = RESULT_FORMATS[result_format]
+            result_name = f"{os.path.splitext(name)[0]}_result{suffix}"
+            result_path = os.path.join(work_dir, result_name)
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPES[os.path.splitext(result_name)[1]])
+            self.send_header("Content-Length", str(os.path.getsize(result_path)))
+            self.send_header("Content-Disposition", _content_disposition(result_name))
+            self.send_header("X-Queue-Seconds", f"{queue_s:.3f}")
+            self.send_header("X-Process-Seconds", f"{process_s:.3f}")
+            self.end_headers()
+            with open(result_path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, SEND_CHUNK_BYTES)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def make_server(host: str, port: int, jobs: JobQueue, config: ServiceConfig) -> ThreadingHTTPServer:
+    """HTTP сервер с общими очередью заданий и настройками"""
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"jobs": jobs, "config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local HTTP service that processes uploaded broker workbooks")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on (localhost by default)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="Jobs allowed to wait for a worker before new uploads are rejected")
+    parser.add_argument("--config", default="config.json", help="Settings profile for default columns")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the parsed sheet cache")
+    parser.add_argument("--span-log", help="Append per-stage timings to this JSON-lines file")
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        configure(args.span_log)
+
+    config = ServiceConfig(Settings(args.config).get_column_to_keep(), not args.no_cache)
+    jobs = JobQueue(args.workers, args.max_queue)
+    server = make_server(args.host, args.port, jobs, config)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with {jobs.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        server.server_close()
+        jobs.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -2,11 +2,13 @@ import json
 import os
 
 class Settings:
-    def __init__(self):
-        self.config_file = "config.json"
+    def __init__(self, config_file="config.json"):
+        self.config_file = config_file
         self.default_settings = {
             "save_path": os.path.expanduser("~/Desktop"),
-            "column_to_keep": [1, 2, 3, 4, 5, 6, 7]
+            "column_to_keep": [1, 2, 3, 4, 5, 6, 7],
+            # Компактное хранение листов в памяти (см. compact_frames)
+            "compact_mode": False
         }
         self.settings = self.load_settings()
 
@@ -19,10 +21,11 @@ class Settings:
                 return self.default_settings
         return self.default_settings
     
-    def save_settings(self, save_path, column_to_keep):
+    def save_settings(self, save_path, column_to_keep, compact_mode=False):
         self.settings = {
             "save_path": save_path,
-            "column_to_keep": column_to_keep
+            "column_to_keep": column_to_keep,
+            "compact_mode": compact_mode
         }
         with open(self.config_file, "w") as f:
             json.dump(self.settings, f)
@@ -31,4 +34,7 @@ class Settings:
         return self.settings.get("save_path", self.default_settings["save_path"])
     
     def get_column_to_keep(self):
-        return self.settings.get("column_to_keep", self.default_settings["column_to_keep"]) 
+        return self.settings.get("column_to_keep", self.default_settings["column_to_keep"])
+
+    def get_compact_mode(self):
+        return self.settings.get("compact_mode", self.default_settings["compact_mode"])
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Каталог кэша разобранных листов и его предельный размер
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".light_app_cache")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SUFFIX = ".pkl"
+
+# Размер блока при вычислении хэша файла
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class SheetCache:
+    """
+    Дисковый кэш разобранных листов Excel
+
+    Ключ - хэш содержимого исходного файла и имя листа, поэтому копия или
+    повторно сохраненный без изменений файл тоже попадают в кэш. Листы
+    хранятся как pickle DataFrame (столбцы смешанных типов сохраняются
+    без преобразований). При превышении max_bytes удаляются давно не
+    использованные записи.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Хэш файла вычисляется один раз для пути, размера и времени изменения
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def file_hash(self, file_path: str) -> str:
+        """Хэш содержимого файла (кэшируется по пути, размеру и mtime)"""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()
+
+        with self._lock:
+            self._hashes[key] = file_hash
+        return file_hash
+
+    def _entry_path(self, file_path: str, sheet_name: str) -> str:
+        sheet_hash = hashlib.blake2b(sheet_name.encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f"{self.file_hash(file_path)}-{sheet_hash}{CACHE_SUFFIX}")
+
+    def get(self, file_path: str, sheet_name: str) -> Optional[pd.DataFrame]:
+        """
+        Возвращает лист из кэша
+
+        Returns:
+            Optional[pd.DataFrame]: Данные листа или None, если листа нет в кэше
+        """
+        try:
+            entry_path = self._entry_path(file_path, sheet_name)
+            with open(entry_path, "rb") as f:
+                df = pickle.load(f)
+            # Отмечаем использование для LRU
+            os.utime(entry_path)
+            return df
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Sheet cache read failed for {file_path} [{sheet_name}]: {e}")
+            return None
+
+    def has_all(self, file_path: str, sheet_names: List[str]) -> bool:
+        """Есть ли в кэше все перечисленные листы файла"""
+        try:
+            return all(os.path.exists(self._entry_path(file_path, name)) for name in sheet_names)
+        except OSError:
+            return False
+
+    def put(self, file_path: str, sheet_name: str, df: pd.DataFrame):
+        """Сохраняет лист в кэш и при необходимости освобождает место"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entry_path = self._entry_path(file_path, sheet_name)
+            # Пишем во временный файл и переименовываем, чтобы не оставить битую запись
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.evict()
+        except Exception as e:
+            print(f"Sheet cache write failed for {file_path} [{sheet_name}]: {e}")
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш больше max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(CACHE_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                continue
+
+    def clear(self):
+        """Удаляет все записи кэша"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX):
+                os.unlink(os.path.join(self.cache_dir, name))
+
+
+# Кэш по умолчанию для GUI и обработки
+default_cache = SheetCache()
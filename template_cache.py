@@ -0,0 +1,122 @@
+import io
+import os
+import threading
+from copy import copy
+from typing import Dict, NamedTuple, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Font
+
+from instrumentation import span
+
+
+class ResultTemplate(NamedTuple):
+    """
+    Разобранный шаблон результата cleaned.xlsx и логотип
+
+    Параметры листа (вид, формат строк, поля, печать, колонтитулы) и шрифт
+    новых ячеек шаблона. Объекты общие для всех результатов процесса,
+    в книгу результата попадают только их копии (apply_sheet_setup).
+    """
+    title: str
+    views: object
+    sheet_format: object
+    page_margins: object
+    page_setup: object
+    print_options: object
+    header_footer: object
+    base_font: Font
+    logo: bytes
+
+    def apply_sheet_setup(self, ws):
+        """Копирует параметры листа шаблона в лист результата"""
+        ws.views = copy(self.views)
+        ws.sheet_format = copy(self.sheet_format)
+        ws.page_margins = copy(self.page_margins)
+        ws.page_setup = copy(self.page_setup)
+        ws.print_options = copy(self.print_options)
+        ws.HeaderFooter = copy(self.header_footer)
+
+    def logo_image(self) -> Image:
+        """Новое изображение логотипа из байтов в памяти"""
+        return Image(io.BytesIO(self.logo))
+
+
+def _stamp(file_path: str) -> Tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_result_template(template_path: str, logo_path: str) -> ResultTemplate:
+    """
+    Разбирает шаблон и читает логотип с диска
+
+    Args:
+        template_path (str): Путь к шаблону cleaned.xlsx
+        logo_path (str): Путь к логотипу QW.png
+
+    Returns:
+        ResultTemplate: Параметры листа шаблона и байты логотипа
+    """
+    with span("load_template"):
+        template_wb = load_workbook(template_path)
+        try:
+            template_ws = template_wb.active
+            template = ResultTemplate(
+                title=template_ws.title,
+                views=copy(template_ws.views),
+                sheet_format=copy(template_ws.sheet_format),
+                page_margins=copy(template_ws.page_margins),
+                page_setup=copy(template_ws.page_setup),
+                print_options=copy(template_ws.print_options),
+                header_footer=copy(template_ws.HeaderFooter),
+                # Шрифт, который получают новые ячейки шаблона
+                base_font=copy(template_ws.cell(row=2, column=1).font),
+                logo=b"",
+            )
+        finally:
+            template_wb.close()
+        with open(logo_path, "rb") as f:
+            return template._replace(logo=f.read())
+
+
+class TemplateCache:
+    """
+    Разобранные шаблоны результата в памяти процесса
+
+    Шаблон и логотип одинаковы для всех результатов, поэтому они читаются
+    один раз на процесс (в пакетной обработке - один раз на рабочий
+    процесс). Запись действительна, пока не изменились размер и время
+    изменения обоих файлов.
+    """
+
+    def __init__(self):
+        self._templates: Dict[Tuple[str, str], Tuple[Tuple, ResultTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str, logo_path: str) -> ResultTemplate:
+        """
+        Возвращает шаблон, при необходимости разбирая его
+
+        Raises:
+            OSError: Шаблон или логотип не найден
+        """
+        key = (os.path.abspath(template_path), os.path.abspath(logo_path))
+        stamp = (_stamp(template_path), _stamp(logo_path))
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+            template = read_result_template(template_path, logo_path)
+            self._templates[key] = (stamp, template)
+            return template
+
+    def clear(self):
+        """Удаляет все шаблоны"""
+        with self._lock:
+            self._templates.clear()
+
+
+# Кэш шаблонов процесса
+default_template_cache = TemplateCache()
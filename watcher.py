@@ -0,0 +1,315 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from batch import collect_source_files, load_isins, load_rule, process_file
+from excel_handler import RESULT_FORMATS
+from instrumentation import configure, default_instrumentation
+from selection_rules import RuleError, SelectionRule
+from settings import Settings
+from sheet_cache import default_cache
+
+# Период опроса папки
+WATCH_INTERVAL_S = 2.0
+# Журнал обработанных файлов в каталоге результатов
+STATE_FILE = ".light_app_watch.json"
+
+
+def profile_hash(columns_to_keep: Sequence[int], isins: Optional[Set[str]],
+                 rule: Optional[SelectionRule], formats: Sequence[str]) -> str:
+    """
+    Хэш параметров обработки: столбцов, выбора строк и форматов результата
+
+    Тот же файл с другими параметрами дает другой результат, поэтому
+    входит в ключ журнала вместе с хэшем содержимого.
+    """
+    profile = {
+        "columns": list(columns_to_keep),
+        "isins": sorted(isins) if isins is not None else None,
+        "rule": rule.text if rule is not None else None,
+        "formats": list(formats),
+    }
+    encoded = json.dumps(profile, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=10).hexdigest()
+
+
+class WatchState:
+    """
+    Уже обработанные файлы: хэш содержимого и хэш параметров обработки
+
+    Хранится в JSON файле, поэтому после перезапуска наблюдателя уже
+    обработанные файлы (и их копии под другими именами) не обрабатываются
+    повторно, пока не изменились столбцы, выбор строк или форматы.
+    """
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self.processed: Dict[str, Dict[str, str]] = self.load()
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Failed to read watch state {self.state_path}: {e}")
+        return {}
+
+    @staticmethod
+    def key(file_hash: str, profile: str) -> str:
+        """Ключ журнала: содержимое файла и параметры обработки"""
+        return f"{file_hash}:{profile}"
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.processed
+
+    def add(self, key: str, file_path: str):
+        """Отмечает файл обработанным и сохраняет журнал"""
+        self.processed[key] = {"file": file_path,
+                               "processed": datetime.now().isoformat(timespec="seconds")}
+        self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        # Пишем во временный файл и переименовываем, чтобы не оставить битый журнал
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.processed, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class FolderWatcher:
+    """
+    Опрос папки: новые и измененные .xlsx файлы
+
+    Файл считается готовым, когда его размер и время изменения не
+    изменились с прошлого опроса (копирование завершено). Готовый файл
+    возвращается один раз, пока снова не изменится.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        # Состояние файлов на прошлом опросе и на момент выдачи
+        self._last: Dict[str, Tuple[int, int]] = {}
+        self._dispatched: Dict[str, Tuple[int, int]] = {}
+
+    def poll(self) -> List[str]:
+        """Готовые новые или измененные файлы"""
+        current: Dict[str, Tuple[int, int]] = {}
+        for path in collect_source_files([self.folder]):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime_ns)
+
+        ready = [path for path, stamp in current.items()
+                 if self._last.get(path) == stamp and self._dispatched.get(path) != stamp]
+        for path in ready:
+            self._dispatched[path] = current[path]
+        self._last = current
+        # Удаленные файлы забываем: файл с тем же именем будет новым
+        for path in list(self._dispatched):
+            if path not in current:
+                del self._dispatched[path]
+        return ready
+
+    def retry(self, path: str):
+        """Вернуть файл в опрос (например, его не удалось прочитать)"""
+        self._dispatched.pop(path, None)
+
+    def is_settling(self) -> bool:
+        """Есть ли файлы, которые еще не выданы (копируются или только появились)"""
+        return any(self._dispatched.get(path) != stamp for path, stamp in self._last.items())
+
+
+def run_watch(folder: str, save_path: str, columns_to_keep: List[int], isins: Optional[Set[str]],
+              rule: Optional[SelectionRule] = None, workers: Optional[int] = None,
+              use_cache: bool = True, formats: Sequence[str] = ("xlsx",),
+              interval: float = WATCH_INTERVAL_S, once: bool = False) -> int:
+    """
+    Следит за папкой и обрабатывает новые файлы в пуле процессов
+
+    Одновременно в пуле выполняется не больше workers файлов, остальные
+    ждут в очереди, поэтому всплеск новых файлов не перегружает машину.
+    Файлы с уже обработанным содержимым (по хэшу) пропускаются, если
+    параметры обработки с тех пор не менялись. Ошибка в файле
+    не останавливает наблюдение; такой файл будет обработан снова, когда
+    изменится.
+
+    Args:
+        folder (str): Папка, куда поступают файлы брокеров
+        save_path (str): Каталог результатов (там же журнал STATE_FILE)
+        columns_to_keep (List[int]): Список столбцов (1..25) для сохранения
+        isins (Optional[Set[str]]): Набор ISIN для отбора (None - все ISIN-строки)
+        rule (Optional[SelectionRule]): Правило выбора строк вместо isins
+        workers (Optional[int]): Количество рабочих процессов
+        use_cache (bool): Использовать дисковый кэш листов
+        formats (Sequence[str]): Форматы результата из RESULT_FORMATS
+        interval (float): Период опроса папки в секундах
+        once (bool): Обработать уже лежащие файлы и завершиться
+
+    Returns:
+        int: Количество файлов, обработанных с ошибкой
+    """
+    state = WatchState(os.path.join(save_path, STATE_FILE))
+    profile = profile_hash(columns_to_keep, isins, rule, formats)
+    watcher = FolderWatcher(folder)
+    queue: Deque[Tuple[str, str]] = deque()
+    queued_keys: Set[str] = set()
+    # Копии файлов в очереди: пропускаются после успешной обработки оригинала,
+    # а если он не обработался - обрабатываются вместо него
+    duplicates: Dict[str, List[str]] = {}
+    running: Dict[Future, Tuple[str, str]] = {}
+    max_running = workers or os.cpu_count() or 1
+    processed = failed = skipped = 0
+
+    print(f"Watching {folder} -> {save_path} (Ctrl+C to stop)")
+    # Рабочие процессы получают настройки замеров основного процесса
+    instrumentation_args = (default_instrumentation.log_path, default_instrumentation.trace_memory,
+                            default_instrumentation.profile_dir)
+    with ProcessPoolExecutor(max_workers=max_running, initializer=configure,
+                             initargs=instrumentation_args) as pool:
+        try:
+            while True:
+                for path in watcher.poll():
+                    try:
+                        state_key = WatchState.key(default_cache.file_hash(path), profile)
+                    except OSError as e:
+                        # Файл еще занят копированием или удален
+                        print(f"WAIT  {path}: {e}")
+                        watcher.retry(path)
+                        continue
+                    if state_key in state:
+                        skipped += 1
+                        print(f"SKIP  {path}: same content and settings already processed")
+                        continue
+                    if state_key in queued_keys:
+                        duplicates.setdefault(state_key, []).append(path)
+                        print(f"HOLD  {path}: same content and settings already queued")
+                        continue
+                    queue.append((path, state_key))
+                    queued_keys.add(state_key)
+
+                while queue and len(running) < max_running:
+                    path, state_key = queue.popleft()
+                    future = pool.submit(process_file, path, save_path, columns_to_keep, isins,
+                                         use_cache, rule, formats)
+                    running[future] = (path, state_key)
+
+                if running:
+                    done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    if once and not watcher.is_settling():
+                        break
+                    time.sleep(interval)
+
+                for future in done:
+                    path, state_key = running.pop(future)
+                    _, error, elapsed = future.result()
+                    if error is None:
+                        processed += 1
+                        state.add(state_key, path)
+                        print(f"OK    {path} ({elapsed:.2f} s, {len(queue)} queued)")
+                        queued_keys.discard(state_key)
+                        for duplicate in duplicates.pop(state_key, []):
+                            skipped += 1
+                            print(f"SKIP  {duplicate}: same content and settings already processed")
+                    else:
+                        failed += 1
+                        print(f"FAIL  {path}: {error}")
+                        waiting = duplicates.get(state_key)
+                        if waiting:
+                            # Результата с этим содержимым нет: обрабатываем копию
+                            queue.append((waiting.pop(0), state_key))
+                            if not waiting:
+                                del duplicates[state_key]
+                        else:
+                            queued_keys.discard(state_key)
+        except KeyboardInterrupt:
+            print("Stopping: waiting for running files")
+            for future in running:
+                future.cancel()
+
+    print(f"Processed {processed} files, {failed} failed, {skipped} skipped as duplicates")
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Watch a drop folder and process incoming broker workbooks")
+    parser.add_argument("folder", help="Folder where broker .xlsx files arrive")
+    parser.add_argument("--columns", help="Columns to keep (1..25), comma separated; "
+                                          "defaults to the settings profile")
+    parser.add_argument("--config", default="config.json", help="Settings profile (config.json)")
+    parser.add_argument("--select", default="all",
+                        help='Row selection rule: "all", "isin:<file>", comma separated ISINs or '
+                             '"rule:<saved rule name or rule text>"')
+    parser.add_argument("--out", help="Output directory; defaults to the settings save path")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the parsed sheet cache")
+    parser.add_argument("--format", default="xlsx",
+                        help="Result formats, comma separated: " + ", ".join(RESULT_FORMATS))
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL_S, help="Polling interval in seconds")
+    parser.add_argument("--once", action="store_true", help="Process the files already present and exit")
+    parser.add_argument("--span-log", help="Append per-stage timings to this JSON-lines file")
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        configure(args.span_log)
+
+    if not os.path.isdir(args.folder):
+        print(f"Folder not found: {args.folder}")
+        return 1
+
+    settings = Settings(args.config)
+    if args.columns:
+        columns_to_keep = [int(c) for c in args.columns.split(",") if c.strip()]
+    else:
+        columns_to_keep = settings.get_column_to_keep()
+    save_path = args.out or settings.get_save_path()
+    os.makedirs(save_path, exist_ok=True)
+
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in RESULT_FORMATS]
+    if unknown or not formats:
+        print(f"Unknown result format: {', '.join(unknown) or args.format}; "
+              f"expected {', '.join(RESULT_FORMATS)}")
+        return 1
+
+    rule = None
+    isins = None
+    if args.select.startswith("rule:"):
+        try:
+            rule = load_rule(args.select[len("rule:"):])
+        except RuleError as e:
+            print(f"Invalid selection rule: {e}")
+            return 1
+    else:
+        try:
+            isins = load_isins(args.select)
+        except OSError as e:
+            print(f"Cannot read ISIN file: {e}")
+            return 1
+
+    failed = run_watch(args.folder, save_path, columns_to_keep, isins, rule, args.workers,
+                       not args.no_cache, formats, args.interval, args.once)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,379 @@
+import re
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+from xml.etree import ElementTree
+
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601
+
+from lazy_workbook import NS_MAIN, read_sheet_index
+
+# Строки заголовков и первая строка с данными (как в excel_processing)
+HEADER_ROWS = (2, 3)
+FIRST_DATA_ROW = 5
+# Колонка C: ISIN или название группы
+GROUP_COLUMN = 3
+
+_ROW = f"{NS_MAIN}row"
+_CELL = f"{NS_MAIN}c"
+_VALUE = f"{NS_MAIN}v"
+_INLINE = f"{NS_MAIN}is"
+_TEXT = f"{NS_MAIN}t"
+_RUN = f"{NS_MAIN}r"
+_SHARED_STRING = f"{NS_MAIN}si"
+
+_DIGITS = "0123456789"
+
+# Нужные столбцы листа по его строкам 2 и 3
+ColumnsFilter = Callable[[Sequence[object], Sequence[object]], Iterable[int]]
+
+# XML листа читается блоками такого размера
+SHEET_CHUNK_BYTES = 4 * 1024 * 1024
+# Начало листа, в котором ищется корневой элемент <worksheet>
+SHEET_HEAD_BYTES = 64 * 1024
+
+WORKSHEET_RE = re.compile(rb"<(\w+:)?worksheet\b([^>]*)>")
+XMLNS_RE = re.compile(rb'xmlns(?::\w+)?="[^"]*"')
+# Строка целиком (в том числе пустая <row .../>), группа 1 - атрибуты
+ROW_RE = re.compile(rb"<row\b([^>]*?)(?:/>|>.*?</row>)", re.S)
+ROW_NUMBER_RE = re.compile(rb'\br="(\d+)"')
+# Ячейка колонки C с адресом
+CELL_C_RE = re.compile(rb'<c\b[^>]*?\br="C\d+"[^>]*?(?:/>|>.*?</c>)', re.S)
+# Ячейка без атрибута r
+CELL_WITHOUT_REF_RE = re.compile(rb"<c(?:\s(?![^>]*\br=)[^>]*)?/?>")
+
+
+class UnsupportedWorkbook(ValueError):
+    """Книга, которую выборочное чтение не разбирает (нужен openpyxl)"""
+
+
+class TargetedSheet(NamedTuple):
+    """
+    Выборочно прочитанный лист
+
+    header_row2/header_row3 - значения 2-й и 3-й строк, начиная со столбца A;
+    column_C - непустые значения колонки C с 5-й строки в виде (строка, значение);
+    rows - значения выделенных строк по номеру строки Excel.
+    """
+    name: str
+    header_row2: List[object]
+    header_row3: List[object]
+    column_C: List[Tuple[int, object]]
+    rows: Dict[int, List[object]]
+
+
+class _Shared:
+    """Ссылка на общую строку, которая подставляется после чтения листов"""
+    __slots__ = ("index",)
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+def _text_content(element: ElementTree.Element) -> str:
+    """Текст <si>/<is> без форматирования (как Text.content в openpyxl)"""
+    parts = []
+    plain = element.find(_TEXT)
+    if plain is not None and plain.text:
+        parts.append(plain.text)
+    for run in element.iter(_RUN):
+        text = run.find(_TEXT)
+        if text is not None and text.text:
+            parts.append(text.text)
+    return "".join(parts)
+
+
+class _CellParser:
+    """Значения ячеек с теми же преобразованиями типов, что и у openpyxl"""
+
+    def __init__(self, date_styles: Set[int], timedelta_styles: Set[int], epoch):
+        self.date_styles = date_styles
+        self.timedelta_styles = timedelta_styles
+        self.epoch = epoch
+
+    def value(self, cell: ElementTree.Element):
+        data_type = cell.get("t", "n")
+        if data_type == "inlineStr":
+            inline = cell.find(_INLINE)
+            return _text_content(inline) if inline is not None else None
+
+        value = cell.findtext(_VALUE) or None
+        if value is None:
+            return None
+        if data_type == "n":
+            number = float(value) if "." in value or "E" in value or "e" in value else int(value)
+            style = int(cell.get("s") or 0)
+            if style in self.date_styles:
+                try:
+                    return from_excel(number, self.epoch, timedelta=style in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return number
+        if data_type == "s":
+            return _Shared(int(value))
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        # "str" (результат формулы) и "e" (ошибка) - строки как есть
+        return value
+
+
+def _cell_column(reference: Optional[str], previous: int) -> int:
+    if not reference:
+        return previous + 1
+    return column_index_from_string(reference.rstrip(_DIGITS))
+
+
+def _row_values(row: ElementTree.Element, parser: _CellParser,
+                wanted: Optional[Dict[str, int]] = None) -> List[object]:
+    """
+    Значения строки, начиная со столбца A
+
+    Args:
+        wanted (Optional[Dict[str, int]]): {буквы столбца: номер} нужных
+            столбцов; остальные ячейки с адресом пропускаются (None - все)
+    """
+    values: List[object] = []
+    column = 0
+    for cell in row.iter(_CELL):
+        reference = cell.get("r")
+        if reference and wanted is not None:
+            column = wanted.get(reference.rstrip(_DIGITS), 0)
+            if not column:
+                continue
+        else:
+            column = _cell_column(reference, column)
+        value = parser.value(cell)
+        if value is None:
+            continue
+        if len(values) < column:
+            values.extend([None] * (column - len(values)))
+        values[column - 1] = value
+    return values
+
+
+def _column_C_value(row: ElementTree.Element, parser: _CellParser):
+    """Значение колонки C строки без разбора остальных ячеек"""
+    column = 0
+    for cell in row.iter(_CELL):
+        reference = cell.get("r")
+        if reference:
+            # Быстрая проверка "C<цифры>" без перевода адреса в номер столбца
+            if reference[0] == "C" and reference[1:2].isdigit():
+                return parser.value(cell)
+            column = _cell_column(reference, column)
+        else:
+            column += 1
+            if column == GROUP_COLUMN:
+                return parser.value(cell)
+        if column > GROUP_COLUMN:
+            return None
+    return None
+
+
+def _row_element(fragment: bytes, namespaces: bytes) -> ElementTree.Element:
+    """Разбирает XML одной строки листа с объявлениями пространств имен листа"""
+    wrapped = ElementTree.fromstring(b"<sheetData" + namespaces + b">" + fragment + b"</sheetData>")
+    return wrapped[0]
+
+
+def _sheet_namespaces(head: bytes) -> bytes:
+    """Объявления xmlns корневого элемента листа для разбора отдельных строк"""
+    match = WORKSHEET_RE.search(head)
+    if match is None:
+        raise UnsupportedWorkbook("worksheet root element not found")
+    if match.group(1):
+        # Префиксные имена ячеек (x:c) построчный разбор не поддерживает
+        raise UnsupportedWorkbook("prefixed worksheet namespace")
+    return b"".join(b" " + declaration for declaration in XMLNS_RE.findall(match.group(2)))
+
+
+def _iter_row_fragments(source, buffer: bytes = b"") -> Iterator[Tuple[bytes, bytes]]:
+    """
+    XML строк листа по порядку: (атрибуты <row>, строка целиком)
+
+    Файл читается блоками по SHEET_CHUNK_BYTES; блок обрабатывается до
+    последнего закрытого </row>, остаток переносится в следующий блок.
+
+    Args:
+        source: Открытый XML листа
+        buffer (bytes): Уже прочитанное начало XML
+    """
+    while True:
+        chunk = source.read(SHEET_CHUNK_BYTES)
+        buffer += chunk
+        end = buffer.rfind(b"</row>") + len(b"</row>") if chunk else len(buffer)
+        position = 0
+        for match in ROW_RE.finditer(buffer, 0, end):
+            yield match.group(1), match.group(0)
+            position = match.end()
+        if not chunk:
+            return
+        buffer = buffer[position:]
+
+
+def _read_sheet(source, name: str, selected: Set[int], parser: _CellParser,
+                columns: Optional[ColumnsFilter] = None) -> TargetedSheet:
+    """
+    Выборочно читает XML листа
+
+    XML читается потоком, строки выделяются по границам <row>. Через
+    ElementTree разбираются только 2-я, 3-я и выделенные строки (из
+    выделенных - только столбцы, которые вернул columns по заголовкам, и
+    колонка C), у остальных регулярным выражением берется одна ячейка
+    колонки C, а прочие ячейки не разбираются вовсе. Память не растет с
+    размером листа.
+    """
+    header_row2: List[object] = []
+    header_row3: List[object] = []
+    column_C: List[Tuple[int, object]] = []
+    rows: Dict[int, List[object]] = {}
+
+    head = source.read(SHEET_HEAD_BYTES)
+    namespaces = _sheet_namespaces(head)
+
+    row_number = 0
+    wanted: Optional[Dict[str, int]] = None
+    for attributes, fragment in _iter_row_fragments(source, head):
+        match = ROW_NUMBER_RE.search(attributes)
+        row_number = int(match.group(1)) if match else row_number + 1
+
+        if row_number in selected or row_number in HEADER_ROWS:
+            if wanted is None and columns is not None and row_number > HEADER_ROWS[-1]:
+                # Заголовки уже прочитаны: нужные столбцы известны
+                numbers = set(columns(header_row2, header_row3)) | {GROUP_COLUMN}
+                wanted = {get_column_letter(number): number for number in numbers if number >= 1}
+            values = _row_values(_row_element(fragment, namespaces), parser,
+                                 wanted if row_number > HEADER_ROWS[-1] else None)
+            if row_number == 2:
+                header_row2 = values
+            elif row_number == 3:
+                header_row3 = values
+            if row_number in selected:
+                rows[row_number] = values
+            value_C = values[GROUP_COLUMN - 1] if len(values) >= GROUP_COLUMN else None
+        elif row_number >= FIRST_DATA_ROW:
+            cell = CELL_C_RE.search(fragment)
+            if cell is not None:
+                value_C = parser.value(_row_element(cell.group(0), namespaces))
+            elif CELL_WITHOUT_REF_RE.search(fragment):
+                # Ячейки без адресов: позицию колонки C можно найти только разбором строки
+                value_C = _column_C_value(_row_element(fragment, namespaces), parser)
+            else:
+                value_C = None
+        else:
+            value_C = None
+        if row_number >= FIRST_DATA_ROW and value_C is not None:
+            column_C.append((row_number, value_C))
+
+    # Заголовки одной ширины, как у строк openpyxl
+    width = max(len(header_row2), len(header_row3))
+    header_row2 = header_row2 + [None] * (width - len(header_row2))
+    header_row3 = header_row3 + [None] * (width - len(header_row3))
+    return TargetedSheet(name, header_row2, header_row3, column_C, rows)
+
+
+def _read_shared_strings(archive: zipfile.ZipFile, needed: Set[int]) -> Dict[int, str]:
+    """
+    Читает только нужные общие строки
+
+    Таблица разбирается потоком до последнего нужного индекса, остальные
+    строки не сохраняются.
+    """
+    if not needed:
+        return {}
+    last = max(needed)
+    strings: Dict[int, str] = {}
+    index = 0
+    with archive.open("xl/sharedStrings.xml") as source:
+        for _, element in ElementTree.iterparse(source):
+            if element.tag != _SHARED_STRING:
+                continue
+            if index in needed:
+                strings[index] = _text_content(element).replace("x005F_", "")
+            element.clear()
+            if index >= last:
+                break
+            index += 1
+    if len(strings) < len(needed):
+        raise UnsupportedWorkbook("shared string index out of range")
+    return strings
+
+
+def _iter_shared(sheets: Iterable[TargetedSheet]) -> Iterable[List[object]]:
+    """Все списки значений листов, где могут быть ссылки на общие строки"""
+    for sheet in sheets:
+        yield sheet.header_row2
+        yield sheet.header_row3
+        yield from sheet.rows.values()
+
+
+def _resolve_shared(sheets: List[TargetedSheet], archive: zipfile.ZipFile) -> List[TargetedSheet]:
+    needed = {value.index for values in _iter_shared(sheets) for value in values if isinstance(value, _Shared)}
+    needed.update(value.index for sheet in sheets for _, value in sheet.column_C if isinstance(value, _Shared))
+    strings = _read_shared_strings(archive, needed)
+
+    def resolve(value):
+        return strings[value.index] if isinstance(value, _Shared) else value
+
+    for values in _iter_shared(sheets):
+        values[:] = [resolve(value) for value in values]
+    return [sheet._replace(column_C=[(row, resolve(value)) for row, value in sheet.column_C])
+            for sheet in sheets]
+
+
+def _cell_parser(archive: zipfile.ZipFile) -> _CellParser:
+    """Форматы дат из styles.xml и система дат книги"""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    properties = workbook.find(f"{NS_MAIN}workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+    epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+    if "xl/styles.xml" not in archive.namelist():
+        return _CellParser(set(), set(), epoch)
+    stylesheet = Stylesheet.from_tree(ElementTree.fromstring(archive.read("xl/styles.xml")))
+    return _CellParser(stylesheet.date_formats, stylesheet.timedelta_formats, epoch)
+
+
+def read_targeted_sheets(file_path: str, selected_rows: Mapping[str, Iterable[int]],
+                         columns: Optional[ColumnsFilter] = None) -> List[TargetedSheet]:
+    """
+    Выборочно читает xlsx: строки заголовков, колонку C и выделенные строки
+
+    Архив читается напрямую, XML листов разбирается потоком, модель книги
+    openpyxl не строится; общие строки подставляются только для
+    прочитанных ячеек. Значения совпадают с values_only openpyxl.
+
+    Args:
+        file_path (str): Путь к xlsx файлу
+        selected_rows (Mapping[str, Iterable[int]]): Выделенные строки по листам
+        columns (Optional[ColumnsFilter]): Номера нужных столбцов по строкам 2/3
+            листа; остальные ячейки выделенных строк не читаются (None - все)
+
+    Returns:
+        List[TargetedSheet]: Листы в порядке книги
+
+    Raises:
+        UnsupportedWorkbook: Файл не удалось разобрать (нужно читать через openpyxl)
+    """
+    if not zipfile.is_zipfile(file_path):
+        raise UnsupportedWorkbook("not an xlsx archive")
+    try:
+        sheet_index = read_sheet_index(file_path)
+        with zipfile.ZipFile(file_path) as archive:
+            names = set(archive.namelist())
+            parser = _cell_parser(archive)
+            sheets = []
+            for info in sheet_index:
+                if info.path is None or info.path not in names:
+                    raise UnsupportedWorkbook(f"sheet {info.name} has no worksheet part")
+                with archive.open(info.path) as source:
+                    sheets.append(_read_sheet(source, info.name, set(selected_rows.get(info.name, ())), parser,
+                                              columns))
+            return _resolve_shared(sheets, archive)
+    except UnsupportedWorkbook:
+        raise
+    except (KeyError, ValueError, IndexError, ElementTree.ParseError, zipfile.BadZipFile) as e:
+        raise UnsupportedWorkbook(str(e)) from e